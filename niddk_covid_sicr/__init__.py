@@ -14,6 +14,7 @@ elif 'SLURM_CPUS_ON_NODE' in os.environ:
      except ValueError:
          ncpus = 2
 
+from .dates import *
 from .io import *
 from .stats import *
 from .analysis import *
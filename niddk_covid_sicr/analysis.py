@@ -1,6 +1,5 @@
 """Analyses to run on the fits."""
 
-from datetime import datetime
 import math
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,7 +9,10 @@ from scipy.stats import norm
 from tqdm import tqdm
 import re
 
-from .io import get_data, get_fit_path, list_rois, load_fit
+from .dates import date_to_day
+from .io import (fit_to_dataframe, get_data, get_fit_path, get_region_value,
+                 list_data_rois, list_rois, load_fit, read_timeseries,
+                 timeseries_exists)
 import niddk_covid_sicr as ncs
 
 
@@ -27,17 +29,15 @@ def get_top_n(
 
     last_data: Use 'YYYY/MM/DD' format.
     """
-    rois = list_rois(data_path, prefix, extension)
+    rois = list_data_rois(data_path)
     if exclude_us_states:
         rois = [roi for roi in rois if not roi.startswith('US_')]
     total_cases = pd.Series(index=rois, dtype=int)
     for roi in rois:
         file_path = Path(data_path) / ("%s_%s%s" % (prefix, roi, extension))
-        df = pd.read_csv(file_path).set_index("dates2")
-        df.index = df.index.map(lambda x: datetime.strptime(x, "%m/%d/%y"))
-        # return df
+        df = read_timeseries(file_path, columns=["cum_cases"])
         if last_date:
-            df = df[df.index <= last_date]
+            df = df[df["day"] <= date_to_day(last_date)]
         total_cases[roi] = df["cum_cases"].max()
     total_cases = total_cases.sort_values(ascending=False)
     if verbose:
@@ -151,15 +151,15 @@ def get_weeks(args, rois):
     Need this to calculate number of parameters per model to then calulate AIC.
     Return dataframe, then merge on roi on big table. """
     # Create lists: rois, and num weeks.
-    roi_weeks = {}
+    csvs = {}
     for roi in rois:
         csv = Path(args.data_path) / ("covidtimeseries_%s.csv" % roi)
         csv = csv.resolve()
-        assert csv.exists(), "No such csv file: %s" % csv
-        if not args.totwk:
-            stan_data, t0, num_weeks = ncs.get_stan_data(csv, args)
-        if args.totwk:
-            stan_data, t0, num_weeks = ncs.get_stan_data_weekly_total(csv, args)
+        assert timeseries_exists(csv), "No such csv file: %s" % csv
+        csvs[roi] = csv
+    roi_weeks = {}
+    for roi, (stan_data, t0, num_weeks) in \
+            ncs.load_stan_data_many(csvs, args).items():
         roi_weeks[roi] = num_weeks
     df_numweek = pd.DataFrame(roi_weeks.items(), columns=['roi', 'num weeks'])
     df_numweek = df_numweek.set_index('roi').sort_index()
@@ -208,7 +208,8 @@ def get_ss_ifrs(fits_path: str, model_name: str,
         except Exception as e:
             print(e)
         else:
-            samples = fit.to_dataframe()
+            samples = fit_to_dataframe(fit, ['sigmac', 'sigmau', 'sigmad',
+                                             'sigmar'])
             s = samples
             x = (s['sigmac']/(s['sigmac']+s['sigmau'])) * \
                 (s['sigmad']/(s['sigmad']+s['sigmar']))
@@ -228,15 +229,15 @@ def get_timing(roi: str, data_path: str) -> tuple:
     Returns:
         tuple: The first day of data and the first day of mitigation.
     """
-    data = get_data(roi, data_path)  # Load the data
+    data = get_data(roi, data_path, with_day=True)  # Load the data
     t0date = data[data["new_cases"] >= 1].index[0]
     t0 = data.index.get_loc(t0date)
-    try:
-        dfm = pd.read_csv(Path(data_path) / 'mitigationprior.csv')\
-                .set_index('region')
-        tmdate = dfm.loc[roi, 'date']
-        tm = data.index.get_loc(tmdate)
-    except FileNotFoundError:
+    tm = np.where(data['day'] == get_region_value(data_path, 'mitigation',
+                                                  roi))[0]
+    if len(tm):
+        tm = tm[0]
+        tmdate = data.index[tm]
+    else:
         print("No mitigation data found; falling back to default value")
         tm = t0 + 10
         tmdate = data.index[t0]
@@ -1,20 +1,92 @@
 """Functions for getting data needed to fit the models."""
 
-import bs4
-from datetime import datetime
+from array import array
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from io import BytesIO
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import requests
+import time
 from tqdm import tqdm
 from typing import Union
-from urllib.error import HTTPError
-import urllib.request, json
+from urllib.error import URLError
+import json
 import os
+from pathlib import Path
 from datetime import timedelta, date
-import pandas as pd
+from functools import partial
 pd.options.mode.chained_assignment = None  # default='warn'
 
+from .dates import DATES2_FORMAT, date_to_day, format_days, to_days
+# (fetch is renamed so that it does not hide the fetch module in the package)
+from .fetch import (HTTP_OPTIONS, fetch as fetch_url, fetch_all, fetch_file,
+                    fingerprint, get_cache_path, iter_json_records)
+from . import metrics
+from .io import (REGION_TABLES, content_hash, file_hash, get_data_prefix,
+                 get_manifest_path, get_region_table, get_store_path,
+                 list_rois, list_rois_in_store, read_manifest,
+                 read_timeseries, to_store_frame, write_timeseries)
+
+# Where JHU stores their data
+JHU_URL_TEMPLATE = ("https://raw.githubusercontent.com/CSSEGISandData/"
+                    "COVID-19/master/csse_covid_19_data/"
+                    "csse_covid_19_time_series/time_series_covid19_%s_%s.csv")
+
+# Where JHU stores their daily US state reports (one file per day)
+JHU_TESTS_URL_TEMPLATE = ("https://raw.githubusercontent.com/CSSEGISandData/"
+                          "COVID-19/master/csse_covid_19_data/"
+                          "csse_covid_19_daily_reports_us/%s.csv")
+# Maximum number of daily reports to download at the same time
+JHU_TESTS_MAX_REQUESTS = 16
+# Days before today for which a missing daily report may still be published
+JHU_TESTS_RETRY_DAYS = 3
+# Archived US recovery data from The COVID Tracking Project (in the data path)
+CTP_RECOVERY_FILE = 'covid-tracking-project-recovery.csv'
+
+# Where Our World In Data stores the data used by get_owid
+OWID_URLS = {
+    'owid_tests': ("https://raw.githubusercontent.com/owid/covid-19-data/"
+                   "master/public/data/testing/"
+                   "covid-testing-all-observations.csv"),
+    'owid_global_vaccines': ("https://raw.githubusercontent.com/owid/"
+                             "covid-19-data/master/public/data/vaccinations/"
+                             "vaccinations.csv"),
+    'owid_us_vaccines': ("https://raw.githubusercontent.com/owid/"
+                         "covid-19-data/master/public/data/vaccinations/"
+                         "us_state_vaccinations.csv")}
+# Countries whose OWID data is not used
+OWID_SKIP = ["US", "Marshall Islands", "Micronesia", "Samoa", "Vanuatu"]
+OWID_VACCINE_COLUMNS = ['cum_vaccinations', 'daily_vaccinations',
+                        'cum_people_vaccinated', 'cum_people_fully_vaccinated']
+
+# Where opencovid.ca serves each province-level time series
+CANADA_URL_TEMPLATE = ('https://api.opencovid.ca/timeseries?stat=%s'
+                       '&loc=prov&date=01-22-2020')
+# The opencovid.ca stats, and the name of the cumulative count in each
+CANADA_STATS = {'cases': 'cumulative_cases',
+                'mortality': 'cumulative_deaths',
+                'recovered': 'cumulative_recovered'}
+CANADA_PROVINCES = ['Alberta', 'BC', 'Manitoba', 'New Brunswick', 'NL',
+                    'Nova Scotia', 'Nunavut', 'NWT', 'Ontario', 'PEI',
+                    'Quebec', 'Saskatchewan', 'Yukon']
+
+# Where Wesley Cota's group stores the state-level data for Brazil
+BRAZIL_URL = ("https://raw.githubusercontent.com/wcota/covid19br/master/"
+              "cases-brazil-states.csv")
+# State codes in the Brazil data, and the region names they are saved under
+BRAZIL_STATES = {'AC': 'Acre', 'AL': 'Alagoas', 'AM': 'Amazonas',
+                 'AP': 'Amapa', 'BA': 'Bahia', 'CE': 'Ceara',
+                 'DF': 'Distrito Federal', 'ES': 'Espirito Santo',
+                 'GO': 'Goias', 'MA': 'Maranhao', 'MG': 'Minas Gerais',
+                 'MS': 'Mato Grosso do Sul', 'MT': 'Mato Grosso',
+                 'PA': 'Para', 'PB': 'Paraiba', 'PE': 'Pernambuco',
+                 'PI': 'Piaui', 'PR': 'Parana', 'RJ': 'Rio de Janeiro',
+                 'RN': 'Rio Grande do Norte', 'RO': 'Rondonia',
+                 'RR': 'Roraima', 'RS': 'Rio Grande do Sul',
+                 'SC': 'Santa Catarina', 'SE': 'Sergipe', 'SP': 'Sao Paulo',
+                 'TO': 'Tocantins'}
+
 JHU_FILTER_DEFAULTS = {'confirmed': 5, 'recovered': 1, 'deaths': 0}
 COVIDTRACKER_FILTER_DEFAULTS = {'cum_cases': 5, 'cum_recover': 1, 'cum_deaths': 0}
 
@@ -83,142 +155,262 @@ def get_jhu(data_path: str, filter_: Union[dict, bool] = True) -> None:
     https://coronavirus.jhu.edu/map.html
     https://github.com/CSSEGISandData/COVID-19
 
+    The six source files are downloaded concurrently and conditionally (see
+    `fetch.fetch_all`); if none of them changed since the last export, the
+    parsing is skipped and the regions' files are written again from the
+    tables kept in the cache at the last export.  The files are always
+    written, so that the later cleaning stages (e.g. `fix_negatives`) start
+    from the same data on every run.
+
     Args:
         data_path (str): Full path to data directory.
 
     Returns:
         None
     """
-    # Where JHU stores their data
-    url_template = ("https://raw.githubusercontent.com/CSSEGISandData/"
-                    "COVID-19/master/csse_covid_19_data/"
-                    "csse_covid_19_time_series/time_series_covid19_%s_%s.csv")
-
     # Scrape the data
+    urls = {(region, kind): JHU_URL_TEMPLATE % (kind, region)
+            for region in ['global', 'US']
+            for kind in ['confirmed', 'deaths', 'recovered']}
+    downloads = fetch_all(urls.values(), cache_path=get_cache_path(data_path))
+    fingerprint_path = get_cache_path(data_path) / 'jhu.fingerprint'
+    # The population estimates and the archived US recovery data are part
+    # of the tables written
+    file_hashes = [file_hash(Path(data_path) / name)
+                   for name in [REGION_TABLES['population'][0],
+                                CTP_RECOVERY_FILE]]
+    source_fingerprint = fingerprint(filter_, *file_hashes,
+                                     *[downloads.get(url, (b'',))[0]
+                                       for url in urls.values()])
+    # The tables of countries and US states written at the last export
+    tables = {desc: get_cache_path(data_path) / ('jhu_%s.parquet' % name)
+              for desc, name in [('Countries', 'countries'),
+                                 ('US States', 'states')]}
+    if fingerprint_path.is_file() and \
+            fingerprint_path.read_text() == source_fingerprint and \
+            all(path.is_file() for path in tables.values()):
+        print("JHU data unchanged since the last download; not parsing it")
+        for desc, path in tables.items():
+            write_regions(pd.read_parquet(path), data_path, desc=desc)
+        return
+
     dfs = {}
-    for region in ['global', 'US']:
-        dfs[region] = {}
-        for kind in ['confirmed', 'deaths', 'recovered']:
-            url = url_template % (kind, region)  # Create the full data URL
-            try:
-                df = pd.read_csv(url)  # Download the data into a dataframe
-            except HTTPError:
-                print("Could not download data for %s, %s" % (kind, region))
-            else:
-                if region == 'global':
-                    has_no_province = df['Province/State'].isnull()
-                    # Whole countries only; use country name as index
-                    df1 = df[has_no_province].set_index('Country/Region')
-                    more_dfs = []
-                    for country in ['China', 'Canada', 'Australia']:
-                        if country == 'Canada' and kind in 'recovered':
-                            continue
-                        is_c = df['Country/Region'] == country
-                        df2 = df[is_c].sum(axis=0, skipna=False).to_frame().T
-                        df2['Country/Region'] = country
-                        df2 = df2.set_index('Country/Region')
-                        more_dfs.append(df2)
-                    df = pd.concat([df1] + more_dfs)
-                elif region == 'US':
-                    # Use state name as index
-                    # for k, v in US_STATE_ABBREV.items(): # get US state abbrev
-                    #     if not US_STATE_ABBREV[k].startswith('US_'):
-                    #         US_STATE_ABBREV[k] = 'US_' + v # Add 'US_' to abbrev
-                    df.replace(US_STATE_ABBREV, inplace=True)
-                    df = df.set_index('Province_State')
-                    df = df.groupby('Province_State').sum() # combine counties to create state level data
-
-                df = df[[x for x in df if any(year in x for year in ['20', '21'])]]  # Use only data columns
-                                                # 20 or 21 signifies 2020 or 2021
-                dfs[region][kind] = df  # Add to dictionary of dataframes
+    for (region, kind), url in urls.items():
+        dfs.setdefault(region, {})
+        if url not in downloads:
+            print("Could not download data for %s, %s" % (kind, region))
+            continue
+        with metrics.stage('parse', source='jhu', url=url) as counters:
+            df = pd.read_csv(BytesIO(downloads[url][0]))  # Parse the download
+            counters['rows'] = len(df)
+        if region == 'global':
+            has_no_province = df['Province/State'].isnull()
+            # Whole countries only; use country name as index
+            df1 = df[has_no_province].set_index('Country/Region')
+            more_dfs = []
+            for country in ['China', 'Canada', 'Australia']:
+                if country == 'Canada' and kind in 'recovered':
+                    continue
+                is_c = df['Country/Region'] == country
+                df2 = df[is_c].sum(axis=0, skipna=False).to_frame().T
+                df2['Country/Region'] = country
+                df2 = df2.set_index('Country/Region')
+                more_dfs.append(df2)
+            df = pd.concat([df1] + more_dfs)
+        elif region == 'US':
+            # Use state name as index
+            # for k, v in US_STATE_ABBREV.items(): # get US state abbrev
+            #     if not US_STATE_ABBREV[k].startswith('US_'):
+            #         US_STATE_ABBREV[k] = 'US_' + v # Add 'US_' to abbrev
+            df.replace(US_STATE_ABBREV, inplace=True)
+            df = df.set_index('Province_State')
+            df = df.groupby('Province_State').sum() # combine counties to create state level data
+
+        df = df[[x for x in df if any(year in x for year in ['20', '21'])]]  # Use only data columns
+                                        # 20 or 21 signifies 2020 or 2021
+        dfs[region][kind] = df  # Add to dictionary of dataframes
 
     # Generate a list of countries that have "good" data,
     # according to these criteria:
     good_countries = get_countries(dfs['global'], filter_=filter_)
-    # For each "good" country,
-    # reformat and save that data in its own .csv file.
     source = dfs['global']
-    for country in tqdm(good_countries, desc='Countries'):  # For each country
+    countries = []
+    for country in sorted(good_countries):
         if country in ['Diamond Princess', 'Grand Princess', 'MS Zaandam', 'Samoa',
                        'Vanuatu', 'Marshall Islands', 'US', 'Micronesia','Kiribati']:
             print("Skipping {}".format(country))
-            continue
         # If we have data in the downloaded JHU files for that country
-        if country in source['confirmed'].index:
-            df = pd.DataFrame(columns=['dates2', 'cum_cases', 'cum_deaths',
-                                       'cum_recover', 'new_cases',
-                                       'new_deaths', 'new_recover',
-                                       'new_uninfected'])
-            df['dates2'] = source['confirmed'].columns
-            df['dates2'] = df['dates2'].apply(fix_jhu_dates)
-            df['cum_cases'] = source['confirmed'].loc[country].values
-            df['cum_deaths'] = source['deaths'].loc[country].values
-            df['cum_recover'] = source['recovered'].loc[country].values
-            df[['new_cases', 'new_deaths', 'new_recover']] = \
-                df[['cum_cases', 'cum_deaths', 'cum_recover']].diff()
-            df['new_uninfected'] = df['new_recover'] + df['new_deaths']
-
-
-            try:
-                population = get_population_count(data_path, country)
-                df['population'] = population
-            except:
-                pass
-
-            # Fill NaN with 0 and convert to int
-            dfs[country] = df.set_index('dates2').fillna(0).astype(int)
-            dfs[country].to_csv(data_path / ('covidtimeseries_%s.csv' % country))
-
+        elif country in source['confirmed'].index:
+            countries.append(country)
         else:
             print("No data for %s" % country)
 
-    source = dfs['US']
-    states = source['confirmed'].index.tolist()
+    # Reshape all countries at once and save each one in its own .csv file.
+    cum = ['cum_cases', 'cum_deaths', 'cum_recover']
+    new = ['new_cases', 'new_deaths', 'new_recover']
+    df = jhu_wide_to_long(source, dict(zip(['confirmed', 'deaths',
+                                            'recovered'], cum)), countries)
+    df[new] = df.groupby('roi')[cum].diff().values
+    df['new_uninfected'] = df['new_recover'] + df['new_deaths']
+    # Fill NaN with 0 and convert to int
+    df[cum + new + ['new_uninfected']] = \
+        df[cum + new + ['new_uninfected']].fillna(0).astype(int)
+    df = add_population(df.drop('day', axis=1), data_path, desc='countries')
+    write_regions(df, data_path, desc='Countries')
+    df.to_parquet(tables['Countries'])
 
-    us_recovery_data = covid_tracking_recovery(data_path)
-    for state in tqdm(states, desc='US States'):  # For each country
+    source = dfs['US']
+    states = []
+    for state in source['confirmed'].index:
         if state in ['Diamond Princess', 'Grand Princess', 'MS Zaandam', 'US_AS']:
             print("Skipping {}".format(state))
-            continue
-        # If we have data in the downloaded JHU files for that country
-        if state in source['confirmed'].index:
-            df = pd.DataFrame(columns=['dates2', 'cum_cases', 'cum_deaths',
-                                       'new_cases','new_deaths','new_uninfected'])
-            df['dates2'] = source['confirmed'].columns
-            df['dates2'] = df['dates2'].apply(fix_jhu_dates)
-            df['cum_cases'] = source['confirmed'].loc[state].values
-            df['cum_deaths'] = source['deaths'].loc[state].values
-
-            df[['new_cases', 'new_deaths']] = df[['cum_cases', 'cum_deaths']].diff()
-
-            # add recovery data
-            df.set_index('dates2', inplace=True)
-            df = df.merge(us_recovery_data[state], on='dates2', how='left')
-
-            df['tmp_new_recover'] = df['new_recover'].fillna(0).astype(int) # create temp new recover for
-            df['new_uninfected'] = df['tmp_new_recover'] + df['new_deaths'] # new uninfected calculation
-            df = df.fillna(-1).astype(int)
-            df = df.drop(['tmp_new_recover'], axis=1)
-
-            try:
-                population = get_population_count(data_path, state)
-                df['population'] = population
-            except:
-                pass
-
-            dfs[state] = df
-            dfs[state].to_csv(data_path /
-                                ('covidtimeseries_%s.csv' % state))
         else:
-            print("No data for %s" % state)
+            states.append(state)
+
+    # Reshape all states at once and add recovery data with a single join
+    cum = ['cum_cases', 'cum_deaths']
+    new = ['new_cases', 'new_deaths']
+    df = jhu_wide_to_long(source, dict(zip(['confirmed', 'deaths'], cum)),
+                          states)
+    df[new] = df.groupby('roi')[cum].diff().values
+    recovery = covid_tracking_recovery_table(data_path)
+    df = df.merge(recovery[['roi', 'day', 'cum_recover', 'new_recover']],
+                  on=['roi', 'day'], how='left')
+    df['new_uninfected'] = df['new_recover'].fillna(0) + df['new_deaths'] # new uninfected calculation
+    columns = cum + new + ['new_uninfected', 'cum_recover', 'new_recover']
+    df[columns] = df[columns].fillna(-1).astype(int)
+    df = add_population(df[['roi', 'dates2'] + columns], data_path,
+                        desc='US states')
+    write_regions(df, data_path, desc='US States')
+    df.to_parquet(tables['US States'])
+
+    fingerprint_path.write_text(source_fingerprint)
+
+
+def jhu_wide_to_long(source: dict, columns: dict, rois: list) -> pd.DataFrame:
+    """Reshape JHU tables (regions x dates) into one long table.
+
+    Args:
+        source (dict): Kind (e.g. 'confirmed'): regions x dates DataFrame.
+        columns (dict): Kind: name of the column to put its values in.
+        rois (list): Regions to keep.
+
+    Returns:
+        pd.DataFrame: One row per region and date (sorted by both), with
+                      'roi', 'dates2', 'day' and one column per kind.
+    """
+    dfs = []
+    for kind, column in columns.items():
+        df = source[kind]
+        df = df[df.index.isin(rois)]
+        # Convert each date column label once, rather than once per region
+        df = df.set_axis(jhu_days(df.columns), axis=1).rename_axis('roi')
+        df = df.reset_index().melt(id_vars='roi', var_name='day',
+                                   value_name=column)
+        dfs.append(df.set_index(['roi', 'day']))
+    df = pd.concat(dfs, axis=1).sort_index().reset_index()
+    df.insert(1, 'dates2', format_days(df['day']))
+    return df
+
+
+def write_regions(df: pd.DataFrame, data_path: str, desc: str = 'Regions',
+                  max_workers: int = 8) -> None:
+    """Write one time-series .csv file per region in a long table.
+
+    The 'population' column is left out for regions without an estimate.
+
+    Args:
+        df (pd.DataFrame): One row per region and date, with 'roi' and
+                           'dates2' columns.
+        data_path (str): Full path to data directory.
+        desc (str, optional): Label for the progress bar.
+        max_workers (int, optional): Number of files to write at once.
+    """
+    def write(item):
+        roi, df_roi = item
+        with metrics.stage('write', roi, rows=len(df_roi), files=1):
+            df_roi = df_roi.drop('roi', axis=1).set_index('dates2')
+            if 'population' in df_roi:
+                if df_roi['population'].isnull().all():
+                    df_roi = df_roi.drop('population', axis=1)
+                else:
+                    df_roi['population'] = df_roi['population'].astype(int)
+            df_roi.to_csv(Path(data_path) / ('covidtimeseries_%s.csv' % roi))
 
-def fix_jhu_dates(x):
-    y = datetime.strptime(x, '%m/%d/%y')
-    return datetime.strftime(y, '%m/%d/%y')
+    groups = list(df.groupby('roi', sort=False))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(tqdm(pool.map(write, groups), total=len(groups), desc=desc))
 
 
-def fix_ct_dates(x):
-    return datetime.strptime(str(x), '%Y%m%d')
+def get_population_index(data_path: str) -> pd.Series:
+    """Population estimates for all regions, indexed by roi.
+
+    The estimates are read once per process (and again only if
+    population_estimates.csv changes), see `io.get_region_table`.
+
+    Args:
+        data_path (str): Full path to data directory.
+
+    Returns:
+        pd.Series: Population count for each roi (empty if the file is
+                   missing).
+    """
+    population = get_region_table(data_path, 'population')
+    if not population:
+        print("Missing population_estimates.csv in data-path")
+    return pd.Series(population, dtype=int, name='population')\
+        .rename_axis('roi')
+
+
+def add_population(df: pd.DataFrame, data_path: str,
+                   desc: str = 'regions') -> pd.DataFrame:
+    """Add a 'population' column to a table with a 'roi' column.
+
+    Regions without an estimate get NaN and are reported all at once.
+
+    Args:
+        df (pd.DataFrame): Table with a 'roi' column.
+        data_path (str): Full path to data directory.
+        desc (str, optional): What the regions are, for the report.
+
+    Returns:
+        pd.DataFrame: The table with a 'population' column.
+    """
+    population = get_population_index(data_path)
+    df = df.drop('population', axis=1, errors='ignore')
+    df = df.merge(population, left_on='roi', right_index=True, how='left')
+    report_missing_population(df['roi'].unique(), population, desc)
+    return df
+
+
+def report_missing_population(rois, population: pd.Series,
+                              desc: str = 'regions') -> list:
+    """Print which regions have no population estimate.
+
+    Args:
+        rois: The regions to check.
+        population (pd.Series): Population index (see
+                                `get_population_index`).
+        desc (str, optional): What the regions are, for the report.
+
+    Returns:
+        list: The regions without an estimate.
+    """
+    missing = sorted(set(rois).difference(population.index))
+    if missing:
+        print("No population estimate in population_estimates.csv for "
+              "%d %s: %s" % (len(missing), desc, ', '.join(missing)))
+    return missing
+
+
+def jhu_days(x) -> np.ndarray:
+    """Days since DAY_ZERO for JHU time-series dates (e.g. 1/22/20)."""
+    return to_days(x, '%m/%d/%y')
+
+
+def ct_days(x) -> np.ndarray:
+    """Days since DAY_ZERO for COVID Tracking Project dates (e.g. 20200412)."""
+    return to_days(x, '%Y%m%d')
 
 
 def get_countries(d: pd.DataFrame, filter_: Union[dict, bool] = True):
@@ -249,19 +441,14 @@ def get_population_count(data_path:str, roi):
             data_path (str): Full path to data directory.
             roi (str): Region.
         Returns:
-            population (int): Population count for ROI (if exists).
+            population (int): Population count for ROI (None if it does not
+                              exist).
     """
-    try:  # open population file
-        df_pop = pd.read_csv(data_path / 'population_estimates.csv')
-    except:
-        print("Missing population_estimates.csv in data-path")
-
-    try:
-        population = df_pop.query('roi == "{}"'.format(roi))['population'].values
-    except:
-        print("{} population estimate not found in population_estimates.csv".format(args.roi))
-
-    return int(population)
+    population = get_population_index(data_path)
+    if roi not in population.index:
+        report_missing_population([roi], population, desc='region')
+        return None
+    return int(population[roi])
 
 def covid_tracking_recovery(data_path: str):
     """Gets archived US recovery data from The COVID Tracking Project.
@@ -272,144 +459,274 @@ def covid_tracking_recovery(data_path: str):
 
     Returns:
         ctp_dfs (dict): Dictionary containing US States (keys) and dataframes
-        containing dates, recovery data (values).
+        containing recovery data indexed by day (values).
     """
-    archived_data = data_path / 'covid-tracking-project-recovery.csv'
-    df_raw = pd.read_csv(archived_data)
-    states = df_raw['state'].unique()
-    ctp_dfs = {}
-    for state in states: # For each country
-        source = df_raw[df_raw['state'] == state] # Only the given state
-        df = pd.DataFrame(columns=['dates2','cum_recover','new_recover'])
-        df['dates2'] = source['date'].apply(fix_ct_dates) # Convert date format
-        # first check if roi reports recovery data as recovered
-        if source['recovered'].isnull().all() == False:
-            df['cum_recover'] = source['recovered'].values
-        # check if roi reports recovery data as hospitalizedDischarged
-        elif source['hospitalizedDischarged'].isnull().all() == False:
-            df['cum_recover'] = source['hospitalizedDischarged'].values
-        else:
-            df['cum_recover'] = np.NaN
+    df = covid_tracking_recovery_table(data_path)
+    return {roi: source.drop('roi', axis=1).set_index('day')
+            for roi, source in df.groupby('roi', sort=False)}
+
+
+def covid_tracking_recovery_table(data_path: str) -> pd.DataFrame:
+    """Archived US recovery data from The COVID Tracking Project, for all
+    states in one table.
+
+    The archive does not change, so it is parsed only once and kept as a
+    Parquet file in the cache directory of `data_path`, named after a hash
+    of the archive (so that a different archive is parsed again).
+
+    Args:
+        data_path (str): Full path to data directory.
 
-        df.sort_values(by=['dates2'], inplace=True) # sort by datetime obj before converting to string
-        df['dates2'] = pd.to_datetime(df['dates2']).dt.strftime('%m/%d/%y') # convert dates to string
-        df = df.set_index('dates2') # Convert to int
-        df['new_recover'] = df['cum_recover'].diff()
-        ctp_dfs['US_'+state] = df
-    return ctp_dfs
+    Returns:
+        pd.DataFrame: 'roi' (e.g. 'US_MI'), 'day' (since DAY_ZERO),
+                      'cum_recover' and 'new_recover' columns, sorted by day
+                      within each state.
+    """
+    archived_data = Path(data_path) / CTP_RECOVERY_FILE
+    content = archived_data.read_bytes()
+    cache_dir = Path(data_path) / '.cache'
+    cache_file = cache_dir / ('ctp-recovery-%s.parquet'
+                              % fingerprint(content)[:16])
+    if cache_file.is_file():
+        return pd.read_parquet(cache_file)
+
+    with metrics.stage('parse', source='covid_tracking_recovery',
+                       url=str(archived_data)) as counters:
+        df_raw = pd.read_csv(BytesIO(content))
+        counters['rows'] = len(df_raw)
+    # For each state, use recovery data reported as recovered if there is
+    # any, or else as hospitalizedDischarged
+    by_state = df_raw.groupby('state', sort=False)
+    has_recovered = by_state['recovered'].transform('count') > 0
+    has_discharged = by_state['hospitalizedDischarged'].transform('count') > 0
+    cum_recover = df_raw['recovered'].where(
+        has_recovered, df_raw['hospitalizedDischarged'].where(has_discharged))
+    df = pd.DataFrame({'roi': 'US_' + df_raw['state'],
+                       'day': ct_days(df_raw['date']),  # Days since DAY_ZERO
+                       'cum_recover': cum_recover.astype(float)})
+    # Keep the states in order of first appearance
+    df['order'] = pd.factorize(df['roi'])[0]
+    df = df.sort_values(['order', 'day'], kind='stable')
+    df = df.drop('order', axis=1).reset_index(drop=True)
+    df['new_recover'] = df.groupby('roi', sort=False)['cum_recover'].diff()
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for old in cache_dir.glob('ctp-recovery-*.parquet'):
+        old.unlink()
+    tmp_file = cache_file.with_name('%s.%d.tmp' % (cache_file.name,
+                                                   os.getpid()))
+    df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, cache_file)
+    return df
 
 
 def get_canada(data_path: str, filter_: Union[dict, bool] = True,
-                       fixes: bool = False) -> None:
+               fixes: bool = False,
+               url_template: str = CANADA_URL_TEMPLATE) -> None:
     """ Gets data from Canada's Open Covid group for Canadian Provinces.
         https://opencovid.ca/
+
+        The cases, mortality and recovered time series are downloaded at
+        once and each is decoded record by record into typed columns (see
+        `read_canada_stat`).
+
+        Args:
+            data_path (str): Full path to data directory.
+            url_template (str, optional): URL of each time series, with a %s
+                                          for the stat.  Any URL that
+                                          urllib can open, so a recorded
+                                          response can be used with file://.
     """
-    dfs = [] # we will append dfs for cases, deaths, recovered here
-    # URL for API call to get Province-level timeseries data starting on Jan 22 2020
-    url_template = 'https://api.opencovid.ca/timeseries?stat=%s&loc=prov&date=01-22-2020'
-    for kind in ['cases', 'mortality', 'recovered']:
-        url_path = url_template % kind  # Create the full data URL
-        with urllib.request.urlopen(url_path) as url:
-            data = json.loads(url.read().decode())
-            source = pd.json_normalize(data[kind])
-            if kind == 'cases':
-                source.drop('cases', axis=1, inplace=True) # removing this column so
-                # we can index into date on all 3 dfs at same position
-            source.rename(columns={source.columns[1]: "date" }, inplace=True)
-            dfs.append(source)
-    cases = dfs[0]
-    deaths = dfs[1]
-    recovered = dfs[2]
-    # combine dfs
-    df_rawtemp = cases.merge(recovered, on=['date', 'province'], how='outer')
-    df_raw = df_rawtemp.merge(deaths, on=['date', 'province'], how='outer')
-    df_raw.fillna(0, inplace=True)
-
-    provinces = ['Alberta', 'BC', 'Manitoba', 'New Brunswick', 'NL',
-                'Nova Scotia', 'Nunavut', 'NWT', 'Ontario', 'PEI', 'Quebec',
-                'Saskatchewan', 'Yukon']
+    data_path = Path(data_path)
+    urls = [url_template % kind for kind in CANADA_STATS]
+    with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        stats = list(pool.map(partial(read_canada_stat,
+                                      cache_path=get_cache_path(data_path)),
+                              urls, CANADA_STATS))
+    # Outer join of the three stats on province and day
+    df_raw = pd.concat(stats, axis=1).fillna(0)
+    df_raw = df_raw.rename(columns={'cumulative_cases': 'cum_cases',
+                                    'cumulative_deaths': 'cum_deaths',
+                                    'cumulative_recovered': 'cum_recover'})
+    df_raw = df_raw.sort_index().reset_index()
+    df_raw = df_raw[df_raw['province'].isin(CANADA_PROVINCES)]
+
+    population = get_population_index(data_path)
+    report_missing_population(['CA_' + p for p in CANADA_PROVINCES],
+                              population, desc='Canadian provinces')
+
+    cum_columns = ['cum_cases', 'cum_deaths', 'cum_recover']
+    new_columns = ['new_cases', 'new_deaths', 'new_recover']
+    df_raw[new_columns] = df_raw.groupby('province')[cum_columns].diff()
+    df_raw['new_uninfected'] = df_raw['new_recover'] + df_raw['new_deaths']
+    df_raw['population'] = df_raw['province'].map(
+        lambda province: population.get('CA_' + province))
+    df_raw['dates2'] = format_days(df_raw['day'])
 
     # Export timeseries data for each province
-    for province in tqdm(provinces, desc='Canadian Provinces'):
-        source = df_raw[df_raw['province'] == province]  # Only the given province
-        df = pd.DataFrame(columns=['dates2','cum_cases', 'cum_deaths',
-                                   'cum_recover', 'new_cases',
-                                   'new_deaths', 'new_recover',
-                                   'new_uninfected'])
-        df['dates2'] = source['date'].apply(fix_canada_dates) # Convert date format
-        df['cum_cases'] = source['cumulative_cases'].values
-        df['cum_deaths'] = source['cumulative_deaths'].values
-        df['cum_recover'] = source['cumulative_recovered'].values
-
-        df[['new_cases', 'new_deaths', 'new_recover']] = \
-            df[['cum_cases', 'cum_deaths', 'cum_recover']].diff()
-        df['new_uninfected'] = df['new_recover'] + df['new_deaths']
+    columns = ['dates2'] + cum_columns + new_columns + ['new_uninfected']
+    for province, df in tqdm(df_raw.groupby('province'),
+                             desc='Canadian Provinces'):
+        if df['population'].notnull().any():
+            df = df[columns + ['population']]
+        else:
+            df = df[columns]
+        df = df.set_index('dates2').fillna(0).astype(int) # Fill NaN with 0 and convert to int
+        with metrics.stage('write', 'CA_' + province, rows=len(df), files=1):
+            df.to_csv(data_path / ('covidtimeseries_CA_%s.csv' % province))
 
-        try:
-            population = get_population_count(data_path, 'CA_' + province)
-            df['population'] = population
-        except:
-            pass
 
-        df.sort_values(by=['dates2'], inplace=True) # sort by datetime obj before converting to string
-        df['dates2'] = pd.to_datetime(df['dates2']).dt.strftime('%m/%d/%y') # convert dates to string
-        df = df.set_index('dates2').fillna(0).astype(int) # Fill NaN with 0 and convert to int
-        df.to_csv(data_path / ('covidtimeseries_CA_%s.csv' % province))
+def read_canada_stat(url: str, kind: str,
+                     cache_path: str = None) -> pd.DataFrame:
+    """Download one opencovid.ca time series as typed columns.
+
+    The response is downloaded into the cache (see `fetch.fetch_file`) and
+    decoded one record at a time (see `fetch.iter_json_records`), keeping
+    only the province, the date and the cumulative count of each.
+
+    Args:
+        url (str): URL of the time series.
+        kind (str): The stat, e.g. 'cases' (a key of CANADA_STATS).
+        cache_path (str, optional): Directory for cached downloads.
 
-def fix_canada_dates(x):
-    return datetime.strptime(x, '%d-%m-%Y')
+    Returns:
+        pd.DataFrame: The cumulative counts (a column named after
+                      CANADA_STATS[kind]), indexed by province and day.
+    """
+    provinces, dates, counts = [], [], array('d')
+    if cache_path is None and HTTP_OPTIONS['cache_path'] is None:
+        stream = BytesIO(fetch_url(url)[0])
+    else:
+        stream = open(fetch_file(url, cache_path=cache_path)[0], 'rb')
+    with stream, metrics.stage('parse', source='canada', url=url) as counters:
+        for record in iter_json_records(stream, kind):
+            provinces.append(record['province'])
+            dates.append(next(value for name, value in record.items()
+                              if name.startswith('date')))
+            counts.append(record[CANADA_STATS[kind]])
+        counters['rows'] = len(counts)
+    index = pd.MultiIndex.from_arrays(
+        [provinces, canada_days(dates)],
+        names=['province', 'day'])
+    return pd.DataFrame({CANADA_STATS[kind]: np.asarray(counts)}, index=index)
+
+
+def canada_days(x) -> np.ndarray:
+    """Days since DAY_ZERO for opencovid.ca dates (e.g. 22-01-2020)."""
+    return to_days(x, '%d-%m-%Y')
 
 def get_brazil(data_path: str, filter_: Union[dict, bool] = True,
-                       fixes: bool = False) -> None:
+               fixes: bool = False, url: str = BRAZIL_URL,
+               max_workers: int = 8) -> None:
     """ Get state-level data for Brazil.
 
     https://github.com/wcota/covid19br (Wesley Cota)
 
-    """
+    All states are transformed together (see `brazil_timeseries`) and their
+    files are then written in parallel.
 
-    url = "https://raw.githubusercontent.com/wcota/covid19br/master/cases-brazil-states.csv"
+    Args:
+        data_path (str): Full path to data directory.
+        url (str, optional): Where to read cases-brazil-states.csv from.
+        max_workers (int, optional): Number of files to write at once.
+    """
     try:
-        df_raw = pd.read_csv(url)
-    except HTTPError:
+        content, _ = fetch_url(url, cache_path=get_cache_path(data_path))
+    except URLError:  # Includes HTTPError
         print("Could not download state-level data for Brazil")
+        return
+    with metrics.stage('parse', source='brazil', url=url) as counters:
+        df_raw = pd.read_csv(BytesIO(content))
+        counters['rows'] = len(df_raw)
+    df = add_population(brazil_timeseries(df_raw), data_path,
+                        desc='Brazilian states')
+    write_regions(df, data_path, desc='Brazilian States',
+                  max_workers=max_workers)
+
 
-    state_code = {'AC':'Acre', 'AL':'Alagoas', 'AM':'Amazonas', 'AP':'Amapa',
-                  'BA':'Bahia','CE':'Ceara', 'DF':'Distrito Federal',
-                  'ES':'Espirito Santo', 'GO':'Goias', 'MA':'Maranhao',
-                  'MG':'Minas Gerais', 'MS':'Mato Grosso do Sul', 'MT':'Mato Grosso',
-                  'PA':'Para', 'PB':'Paraiba', 'PE':'Pernambuco', 'PI':'Piaui',
-                  'PR':'Parana', 'RJ':'Rio de Janeiro', 'RN':'Rio Grande do Norte',
-                  'RO':'Rondonia', 'RR':'Roraima', 'RS':'Rio Grande do Sul',
-                  'SC':'Santa Catarina', 'SE':'Sergipe', 'SP':'Sao Paulo', 'TO':'Tocantins'}
-
-    for state in tqdm(state_code, desc='Brazilian States'):
-        source = df_raw[df_raw['state'] == state]  # Only the given province
-        df = pd.DataFrame(columns=['dates2','cum_cases', 'cum_deaths',
-                                   'cum_recover', 'new_cases',
-                                   'new_deaths', 'new_recover',
-                                   'new_uninfected'])
-
-        df['dates2'] = source['date']
-        df['cum_cases'] = source['totalCases'].values
-        df['cum_deaths'] = source['deaths'].values
-        df['cum_recover'] = source['recovered'].values
-        df['new_cases'] = source['newCases'].values
-        df['new_deaths'] = source['newDeaths'].values
-        df['new_recover'] = df['cum_recover'].diff()
-        df['new_uninfected'] = df['new_recover'] + df['new_deaths']
+def brazil_timeseries(df_raw: pd.DataFrame) -> pd.DataFrame:
+    """Convert cases-brazil-states.csv into one long table for all states.
 
+    Args:
+        df_raw (pd.DataFrame): The national file, one row per state and date.
+
+    Returns:
+        pd.DataFrame: One row per state and date (sorted by both), with
+                      'roi' (e.g. 'BR_Acre'), 'dates2' and the data columns.
+    """
+    df_raw = df_raw[df_raw['state'].isin(BRAZIL_STATES)]
+    df = pd.DataFrame({'roi': 'BR_' + df_raw['state'].map(BRAZIL_STATES),
+                       'day': owid_days(df_raw['date']), # Days since DAY_ZERO
+                       'cum_cases': df_raw['totalCases'],
+                       'cum_deaths': df_raw['deaths'],
+                       'cum_recover': df_raw['recovered'],
+                       'new_cases': df_raw['newCases'],
+                       'new_deaths': df_raw['newDeaths']})
+    df = df.sort_values(['roi', 'day'], kind='stable')
+    df['new_recover'] = df.groupby('roi')['cum_recover'].diff()
+    df['new_uninfected'] = df['new_recover'] + df['new_deaths']
+    columns = ['cum_cases', 'cum_deaths', 'cum_recover', 'new_cases',
+               'new_deaths', 'new_recover', 'new_uninfected']
+    df[columns] = df[columns].fillna(0).astype(int) # Fill NaN with 0 and convert to int
+    df.insert(1, 'dates2', format_days(df['day']))
+    return df.drop('day', axis=1).reset_index(drop=True)
+
+
+def get_owid(data_path: str, sources: list = None,
+             filter_: Union[dict, bool] = True, max_workers: int = 8) -> None:
+    """ Add data from Our World In Data to the time-series files.
+        https://github.com/owid/covid-19-data
+
+        All sources are downloaded at once and split by region, and then each
+        region's file is read, joined with every source and written only once.
+
+        Args:
+            data_path (str): Full path to data directory.
+            sources (list, optional): Keys of OWID_URLS to use (default all).
+            filter_ (bool, optional): Unused.
+            max_workers (int, optional): Number of regions to update at once.
+    """
+    data_path = Path(data_path)
+    sources = list(OWID_URLS) if sources is None else list(sources)
+    urls = [OWID_URLS[source] for source in sources]
+    downloads = fetch_all(urls, cache_path=get_cache_path(data_path))
+
+    # Group each source by region once; keep the order of the sources
+    stages = {}  # roi: [(add function, that region's rows of the source)]
+    for source, url in zip(sources, urls):
+        if url not in downloads:
+            print("Could not download %s data" % source)
+            continue
+        with metrics.stage('parse', source=source, url=url) as counters:
+            src = pd.read_csv(BytesIO(downloads[url][0]))
+            counters['rows'] = len(src)
+        split, add = OWID_STAGES[source]
+        for roi, src_roi in split(src, data_path).items():
+            stages.setdefault(roi, []).append((add, src_roi))
+
+    def enrich(item):
+        roi, roi_stages = item
+        timeseries_path = data_path / ('covidtimeseries_%s.csv' % roi)
         try:
-            roi = 'BR_' + state_code[state]
-            population = get_population_count(data_path, roi)
-            df['population'] = population
-        except:
-            print("Could not add population data for {}".format(state))
-            pass
+            with metrics.stage('read', roi, files=1):
+                df = read_timeseries_by_day(timeseries_path)
+        except FileNotFoundError:
+            return roi
+        with metrics.stage('owid', roi, rows=len(df)):
+            for add, src_roi in roi_stages:
+                df = add(roi, df, src_roi)
+            df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+        with metrics.stage('write', roi, rows=len(df), files=1):
+            write_timeseries_by_day(df, timeseries_path)  # overwrite timeseries CSV
 
-        df.sort_values(by=['dates2'], inplace=True) # sort by datetime obj before converting to string
-        df['dates2'] = pd.to_datetime(df['dates2']).dt.strftime('%m/%d/%y') # convert dates to string
-        df = df.set_index('dates2').fillna(0).astype(int) # Fill NaN with 0 and convert to int
-        df.to_csv(data_path / ('covidtimeseries_BR_%s.csv' % state_code[state]))
+    items = list(stages.items())
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        missing = list(tqdm(pool.map(enrich, items), total=len(items),
+                            desc='OWID'))
+    missing = [roi for roi in missing if roi is not None]
+    if missing:
+        print("Could not add OWID data (no time-series file) for: %s"
+              % ' '.join(missing))
 
 
 def get_owid_tests(data_path: str, filter_: Union[dict, bool] = True,
@@ -417,109 +734,126 @@ def get_owid_tests(data_path: str, filter_: Union[dict, bool] = True,
     """ Get testing data from Our World In Data
         https://github.com/owid/covid-19-data
         Add columns cum_tests and new_tests to csvs in data_path. """
-    url = 'https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/testing/covid-testing-all-observations.csv'
-    src = pd.read_csv(url)
-    roi_codes = pd.read_csv(data_path / 'country_iso_codes.csv')
-    roi_codes_dict = pd.Series(roi_codes.Country.values,index=roi_codes['Alpha-3 code']).to_dict()
-    # trim down source dataframe
-    src_trim = pd.DataFrame(columns=['dates2','Alpha-3 code','cum_tests'])
-    src_trim['dates2'] = src['Date'].apply(fix_owid_dates).values # fix dates
-    src_trim['Alpha-3 code'] = src['ISO code'].values
-    src_trim['cum_tests'] = src['Cumulative total'].fillna(-1).astype(int).values
-    src_trim.set_index('dates2',inplace=True, drop=True)
+    get_owid(data_path, ['owid_tests'], filter_=filter_)
 
-    src_rois = src_trim['Alpha-3 code'].unique()
-    unavailable_testing_data = [] # for appending rois that don't have testing data
-
-    for roi in roi_codes_dict:
-        if roi not in src_rois:
-            unavailable_testing_data.append(roi)
-            continue
-        if roi_codes_dict[roi] in ["US", "Marshall Islands", "Micronesia", "Samoa", "Vanuatu"]: # skipping because bad data
-            continue
-        try:
-            timeseries_path = data_path / ('covidtimeseries_%s.csv' % roi_codes_dict[roi])
-            df_timeseries = pd.read_csv(timeseries_path, index_col='dates2')
-        except FileNotFoundError as fnf_error:
-            print(fnf_error, 'Could not add OWID data.')
-            pass
-
-        for i in df_timeseries.columns: # Check if OWID testng data already included
-            if 'tests' in i:
-                df_timeseries.drop([i], axis=1, inplace=True) # drop so we can add new
-        src_roi = src_trim[src_trim['Alpha-3 code'] == roi] # filter rows that match roi
-
-        df_combined = df_timeseries.merge(src_roi[['cum_tests']], how='left', on='dates2')
-        df_combined['new_tests'] = df_combined['cum_tests'].diff()
-        df_combined.loc[df_combined['new_tests'] < 0, 'new_tests'] = -1 # Handle cases where
-        # cumulative counts decrease and new_tests becomes a large negative number
-
-        df_combined[['cum_tests', 'new_tests']] = df_combined[['cum_tests', 'new_tests']].fillna(-1).astype(int).values
-        df_combined = df_combined.loc[:, ~df_combined.columns.str.contains('^Unnamed')]
-        df_combined.to_csv(timeseries_path) # overwrite timeseries CSV
-
-    print("OWID global test results missing for: ")
-    for roi in roi_codes_dict:
-        if roi in unavailable_testing_data:
-            print(roi_codes_dict[roi], end=" ")
-    print("")
 
 def get_owid_global_vaccines(data_path: str, filter_: Union[dict, bool] = True,
                        fixes: bool = False) -> None:
     """ Get global vaccines data from Our World In Data
         https://github.com/owid/covid-19-data
         Add columns to global csvs in data_path. """
-    url = 'https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/vaccinations/vaccinations.csv'
-    src = pd.read_csv(url)
-    src_trim = pd.DataFrame(columns=['dates2', 'Alpha-3 code', 'cum_vaccinations', 'daily_vaccinations',
-                                     'cum_people_vaccinated', 'cum_people_fully_vaccinated'])
-    src_trim['dates2'] = src['date'].apply(fix_owid_dates).values # fix dates
+    get_owid(data_path, ['owid_global_vaccines'], filter_=filter_)
+
+
+def get_owid_us_vaccines(data_path: str, filter_: Union[dict, bool] = True,
+                       fixes: bool = False) -> None:
+    """ Get US vaccines data from Our World In Data
+        https://github.com/owid/covid-19-data
+        Add columns to US csvs in data_path. """
+    get_owid(data_path, ['owid_us_vaccines'], filter_=filter_)
+
+
+def _owid_country_names(data_path: str) -> dict:
+    """Country name for each ISO code (e.g. 'ITA') used by OWID."""
+    roi_codes = pd.read_csv(Path(data_path) / 'country_iso_codes.csv')
+    return pd.Series(roi_codes.Country.values,
+                     index=roi_codes['Alpha-3 code']).to_dict()
+
+
+def _split_by_country(src_trim: pd.DataFrame, data_path: str,
+                      desc: str) -> dict:
+    """Split OWID data (with an 'Alpha-3 code' column) into one DataFrame per
+    country, and print the countries that are missing from it."""
+    roi_codes_dict = _owid_country_names(data_path)
+    src_rois = set(src_trim['Alpha-3 code'].unique())
+    print("OWID %s results missing for: " % desc)
+    print(' '.join(roi_codes_dict[roi] for roi in roi_codes_dict
+                   if roi not in src_rois))
+    by_roi = {}
+    for code, src_roi in src_trim.groupby('Alpha-3 code', sort=False):
+        roi = roi_codes_dict.get(code)
+        if roi is None or roi in OWID_SKIP:
+            continue
+        by_roi[roi] = src_roi
+    return by_roi
+
+
+def split_owid_tests(src: pd.DataFrame, data_path: str) -> dict:
+    """Split the OWID testing data into one DataFrame (indexed by day) per
+    region."""
+    src_trim = pd.DataFrame(columns=['day','Alpha-3 code','cum_tests'])
+    src_trim['day'] = owid_days(src['Date']) # Days since DAY_ZERO
+    src_trim['Alpha-3 code'] = src['ISO code'].values
+    src_trim['cum_tests'] = src['Cumulative total'].fillna(-1).astype(int).values
+    src_trim.set_index('day',inplace=True, drop=True)
+    return _split_by_country(src_trim, data_path, 'global test')
+
+
+def split_owid_global_vaccines(src: pd.DataFrame, data_path: str) -> dict:
+    """Split the OWID global vaccinations data into one DataFrame (indexed by
+    day) per region."""
+    src_trim = pd.DataFrame(columns=['day', 'Alpha-3 code'] + OWID_VACCINE_COLUMNS)
+    src_trim['day'] = owid_days(src['date']) # Days since DAY_ZERO
     src_trim['Alpha-3 code'] = src['iso_code'].values
     src_trim['cum_vaccinations'] = src['total_vaccinations'].values
     src_trim['daily_vaccinations'] = src['daily_vaccinations'].values
     src_trim['cum_people_vaccinated'] = src['people_vaccinated'].values
     src_trim['cum_people_fully_vaccinated'] = src['people_fully_vaccinated'].values
+    src_trim.set_index('day',inplace=True, drop=True)
+    return _split_by_country(src_trim, data_path, 'global vaccine')
 
-    roi_codes = pd.read_csv(data_path / 'country_iso_codes.csv')
-    roi_codes_dict = pd.Series(roi_codes.Country.values,index=roi_codes['Alpha-3 code']).to_dict()
-
-    # trim down source dataframe
-    src_trim.set_index('dates2',inplace=True, drop=True)
 
-    src_rois = src_trim['Alpha-3 code'].unique()
-    unavailable_testing_data = [] # for appending rois that don't have testing data
+def split_owid_us_vaccines(src: pd.DataFrame, data_path: str) -> dict:
+    """Split the OWID US vaccinations data into one DataFrame (indexed by day)
+    per state."""
+    src_trim = pd.DataFrame(columns=['day', 'region'] + OWID_VACCINE_COLUMNS)
+    src_trim['day'] = owid_days(src['date']) # Days since DAY_ZERO
+    src_trim['region'] = src['location'].replace("New York State", "New York").values # fix NY name
+    src_trim['cum_vaccinations'] = src['total_vaccinations'].values
+    src_trim['daily_vaccinations'] = src['daily_vaccinations'].values
+    src_trim['cum_people_vaccinated'] = src['people_vaccinated'].values
+    src_trim['cum_people_fully_vaccinated'] = src['people_fully_vaccinated'].values
+    src_trim.set_index('day', inplace=True, drop=True)
+    return {US_STATE_ABBREV[state]: src_roi
+            for state, src_roi in src_trim.groupby('region', sort=False)
+            if state in US_STATE_ABBREV}
+
+
+def add_owid_tests(roi: str, df_timeseries: pd.DataFrame,
+                   src_roi: pd.DataFrame) -> pd.DataFrame:
+    """Replace the cum_tests and new_tests columns of one region's time
+    series (indexed by day) with those from the OWID testing data."""
+    # Drop OWID testing data if already included, so we can add new
+    df_timeseries = df_timeseries.drop(
+        [i for i in df_timeseries.columns if 'tests' in i], axis=1)
+    df_combined = df_timeseries.merge(src_roi[['cum_tests']], how='left', on='day')
+    df_combined['new_tests'] = df_combined['cum_tests'].diff()
+    df_combined.loc[df_combined['new_tests'] < 0, 'new_tests'] = -1 # Handle cases where
+    # cumulative counts decrease and new_tests becomes a large negative number
+
+    df_combined[['cum_tests', 'new_tests']] = df_combined[['cum_tests', 'new_tests']].fillna(-1).astype(int).values
+    return df_combined
+
+
+def add_owid_vaccines(roi: str, df_timeseries: pd.DataFrame,
+                      src_roi: pd.DataFrame) -> pd.DataFrame:
+    """Replace the vaccination columns of one region's time series (indexed
+    by day) with those from the OWID vaccinations data."""
+    # Drop OWID vaccines data if already included, so we can add new
+    df_timeseries = df_timeseries.drop(
+        [i for i in df_timeseries.columns if 'vaccin' in i], axis=1)
+    df_combined = df_timeseries.merge(src_roi[OWID_VACCINE_COLUMNS], how='left', on='day')
+    cum_vacc_columns = ['vaccinations', 'people_vaccinated', 'people_fully_vaccinated']
+    return dummy_cumulative_new_counts(roi, df_combined, cum_vacc_columns)
+
+
+# How to split each OWID source by region and add it to a region's data
+OWID_STAGES = {'owid_tests': (split_owid_tests, add_owid_tests),
+               'owid_global_vaccines': (split_owid_global_vaccines,
+                                        add_owid_vaccines),
+               'owid_us_vaccines': (split_owid_us_vaccines,
+                                    add_owid_vaccines)}
 
-    for roi in roi_codes_dict:
-        if roi not in src_rois:
-            unavailable_testing_data.append(roi)
-            continue
-        if roi_codes_dict[roi] in ["US", "Marshall Islands", "Micronesia", "Samoa", "Vanuatu"]: # skipping because no data
-            continue
-        try:
-            timeseries_path = data_path / ('covidtimeseries_%s.csv' % roi_codes_dict[roi])
-            df_timeseries = pd.read_csv(timeseries_path, index_col='dates2')
-        except FileNotFoundError as fnf_error:
-            print(fnf_error, 'Could not add OWID global vaccines data.')
-            pass
-
-        for i in df_timeseries.columns: # Check if OWID testing data already included
-            if 'vaccin' in i:
-                df_timeseries.drop([i], axis=1, inplace=True) # drop so we can add new
-        src_roi = src_trim[src_trim['Alpha-3 code'] == roi] # filter rows that match roi
-
-        df_combined = df_timeseries.merge(src_roi[['cum_vaccinations', 'daily_vaccinations', 'cum_people_vaccinated',
-                                                               'cum_people_fully_vaccinated']], how='left', on='dates2')
-        cum_vacc_columns = ['vaccinations', 'people_vaccinated', 'people_fully_vaccinated']
-        df = dummy_cumulative_new_counts(roi_codes_dict[roi], df_combined, cum_vacc_columns)
-        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-        df.to_csv(timeseries_path) # overwrite timeseries CSV
-
-
-    print("OWID global vaccine results missing for: ")
-    for roi in roi_codes_dict:
-        if roi in unavailable_testing_data:
-            print(roi_codes_dict[roi], end=" ")
-    print("")
 
 def dummy_cumulative_new_counts(roi, df, columns: list):
     """ There are cases where cum counts go missing and new counts get missed.
@@ -546,7 +880,7 @@ def dummy_cumulative_new_counts(roi, df, columns: list):
         try:
             start = df_tmp[df_tmp[cum_col] > 0].index.values[0]
             df_ffill = df_tmp.iloc[start:]
-            df_ffill.set_index('dates2', drop=True, inplace=True)
+            df_ffill.set_index(df.index.name, drop=True, inplace=True)
             df_ffill[dummy_cum_col] = df_ffill[cum_col].ffill().astype(int).values
             df_ffill[new_col] = df_ffill[dummy_cum_col].diff().astype('Int64')
             # If cumulative counts are missing, set new counts to -1 so they don't become 0.
@@ -563,155 +897,328 @@ def dummy_cumulative_new_counts(roi, df, columns: list):
     df_fixed = df_fixed.fillna(-1).astype(int)
     return df_fixed
 
-def get_owid_us_vaccines(data_path: str, filter_: Union[dict, bool] = True,
-                       fixes: bool = False) -> None:
-    """ Get US vaccines data from Our World In Data
-        https://github.com/owid/covid-19-data
-        Add columns to US csvs in data_path. """
-
-    url = 'https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/vaccinations/us_state_vaccinations.csv'
-    src = pd.read_csv(url)
-    src_trim = pd.DataFrame(columns=['dates2', 'region', 'cum_vaccinations', 'daily_vaccinations',
-                                     'people_vaccinated', 'people_fully_vaccinated'])
-
-    src_trim['dates2'] = src['date'].apply(fix_owid_dates).values # fix dates
-    src_trim['region'] = src['location'].values
-    src_trim['cum_vaccinations'] = src['total_vaccinations'].values
-    src_trim['daily_vaccinations'] = src['daily_vaccinations'].values
-    src_trim['cum_people_vaccinated'] = src['people_vaccinated'].values
-    src_trim['cum_people_fully_vaccinated'] = src['people_fully_vaccinated'].values
-    src_trim.set_index('dates2', inplace=True, drop=True)
-    src_trim.replace("New York State", "New York", inplace=True) # fix NY name
-    src_rois = src_trim['region'].unique()
-    for roi in src_rois:
-        if roi in US_STATE_ABBREV:
-            try:
-                timeseries_path = data_path / ('covidtimeseries_%s.csv' % US_STATE_ABBREV[roi])
-                df_timeseries = pd.read_csv(timeseries_path, index_col='dates2')
-
-            except FileNotFoundError as fnf_error:
-                print(fnf_error, 'Could not add OWID vaccinations data.')
-                pass
-
-            for i in df_timeseries.columns: # Check if OWID vaccines data already included
-                if 'vaccin' in i:
-                    df_timeseries.drop([i], axis=1, inplace=True) # drop so we can add new
-
-            src_roi = src_trim[src_trim['region'] == roi] # filter rows that match roi
 
-            df_combined = df_timeseries.merge(src_roi[['cum_vaccinations', 'daily_vaccinations', 'cum_people_vaccinated',
-                                                       'cum_people_fully_vaccinated']], how='left', on='dates2')
+def owid_days(x) -> np.ndarray:
+    """Days since DAY_ZERO for ISO dates (e.g. 2020-01-22), as used by OWID
+    and the Brazil data."""
+    return to_days(x, '%Y-%m-%d')
 
-            cum_vacc_columns = ['vaccinations', 'people_vaccinated', 'people_fully_vaccinated']
-            df = dummy_cumulative_new_counts(US_STATE_ABBREV[roi], df_combined, cum_vacc_columns)
 
-            df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-            df.to_csv(timeseries_path) # overwrite timeseries CSV
+def read_timeseries_by_day(path: str) -> pd.DataFrame:
+    """Read a time-series .csv file indexed by day (since DAY_ZERO)."""
+    df = pd.read_csv(path, index_col='dates2')
+    df.index = pd.Index(jhu_days(df.index), name='day')
+    return df
 
 
-def fix_owid_dates(x):
-    y = datetime.strptime(x, '%Y-%m-%d')
-    return datetime.strftime(y, '%m/%d/%y')
+def write_timeseries_by_day(df: pd.DataFrame, path: str) -> None:
+    """Write a time-series indexed by day as a .csv file indexed by 'dates2'."""
+    df = df.copy()
+    df.index = pd.Index(format_days(df.index), name='dates2')
+    df.to_csv(path)
 
 
-def get_jhu_us_states_tests(data_path: str, filter_: Union[dict, bool] = False) -> None:
+def get_jhu_us_states_tests(data_path: str, filter_: Union[dict, bool] = False,
+                            max_requests: int = JHU_TESTS_MAX_REQUESTS,
+                            download: bool = True) -> None:
     """ Scrape JHU for US State level test results. Data is stored as a collection of
         CSVs per date containing states and test results.
 
+        Only days that are not yet cached are downloaded (concurrently; see
+        `cache_jhu_us_states_tests`).
+
         Args:
             data_path (str): Full path to data directory.
+            max_requests (int): Maximum number of daily reports to download
+                                at the same time.
+            download (bool): Whether to download the new days first, or only
+                             use those already cached (e.g. by the prefetch
+                             in `run_sources`).
         Returns:
             None
          """
-    url_template = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports_us/%s.csv"
-    # generate a list of dates for scraping
-    start_dt = date(2020, 4, 12) # When JHU starts reporting
-    end_dt = date.today()
-    dates = []
-    delta = end_dt - start_dt
-    delta = delta.days
-    for dt in daterange(start_dt, end_dt):
-        dates.append(dt.strftime("%m-%d-%Y"))
-    # cumulative tests are named 'People_Tested' for first 200 ish days
-    # then cumulative tests are named 'Total_Test_Results' after 200 ish days
-    dfs = []
-    for i in tqdm(dates, desc=f'Scraping {delta} days of data across all states'):
-        url = url_template % i
-        try:
-            df = pd.read_csv(url)
-            df_trim = pd.DataFrame(columns=['Province_State', 'cum_tests', 'dates2'])
-            df_trim['Province_State'] = df['Province_State'].values
-            df_trim['dates2'] = fix_jhu_testing_dates(i)
-
-            # handle cases where column is people_tested and then switches to Total_Test_Results
-            if 'People_Tested' in df.columns:
-                df_trim['cum_tests'] = df['People_Tested'].fillna(-1).astype(int).values
-                dfs.append(df_trim)
-            if 'Total_Test_Results' in df.columns:
-                df_trim['cum_tests'] = df['Total_Test_Results'].fillna(-1).astype(int).values
-                dfs.append(df_trim)
-        except HTTPError:
-            print("Could not download tests data for %s" % i)
-    df_combined = pd.concat(dfs)
-    df_combined.sort_values(by='Province_State', inplace=True)
-    df_combined['Date'] = pd.to_datetime(df_combined['dates2'])
-    rois = df_combined['Province_State'].unique()
-    sorted_dfs = []
-    for roi in rois:
-        df_roi = df_combined[df_combined['Province_State'] == roi]
-        df_roi = df_roi.sort_values(by="Date")
-        df_roi['new_tests'] = df_roi['cum_tests'].diff().fillna(-1).astype(int)
-        sorted_dfs.append(df_roi)
-
-    df_tests = pd.concat(sorted_dfs)
-    df_tests.reset_index(inplace=True, drop=True)
+    if download:
+        df_merged = cache_jhu_us_states_tests(data_path, max_requests)
+    else:
+        df_merged = read_jhu_us_states_tests(data_path)
+    if not len(df_merged):
+        print("No tests data available")
+        return
+
+    df_tests = df_merged.copy()
+    df_tests['day'] = jhu_days(df_tests['dates2'])
+    df_tests = df_tests.sort_values(by=['Province_State', 'day'])
+    df_tests['new_tests'] = df_tests.groupby('Province_State')['cum_tests']\
+                                    .diff().fillna(-1).astype(int)
     df_tests.replace(US_STATE_ABBREV, inplace=True)
     df_tests.rename(columns={'Province_State': 'roi'}, inplace=True)
 
     # now open csvs in data_path that match rois and merge on csv to add cum_test and new_tests
-    rois = df_tests.roi.unique().tolist()
     to_remove = ['Diamond Princess', 'Grand Princess', 'Recovered']
-    for i in to_remove:
-        if i in rois:
-            rois.remove(i)
-
-    for roi in rois:
+    for roi, df_roi_tests in df_tests.groupby('roi'):
+        if roi in to_remove:
+            continue
         csv_path = data_path / f'covidtimeseries_{roi}.csv'
         try:
-            df_timeseries = pd.read_csv(csv_path)
-        except:
+            with metrics.stage('read', roi, files=1):
+                df_timeseries = pd.read_csv(csv_path)
+        except FileNotFoundError:
             print(f"{csv_path} not found in data path.")
+            continue
         try:
             for i in df_timeseries.columns: # Check if testng data already included
                 if 'tests' in i:
                     df_timeseries.drop([i], axis=1, inplace=True) # drop so we can add new
-            df_roi_tests = df_tests[df_tests['roi'] == roi] # filter down to roi
-            df_result = df_timeseries.merge(df_roi_tests, on='dates2', how='left')
-            df_result.fillna(-1, inplace=True)
+            df_timeseries['day'] = jhu_days(df_timeseries['dates2'])
+            df_result = df_timeseries.merge(df_roi_tests[['day', 'cum_tests', 'new_tests']],
+                                            on='day', how='left')
+            df_result[['cum_tests', 'new_tests']] = df_result[['cum_tests', 'new_tests']].fillna(-1)
             df_result.loc[df_result['new_tests'] < 0, 'new_tests'] = -1 # Handle cases where
                         # cumulative counts decrease and new_tests becomes a large negative number
-            df_result['new_tests'] = df_result['new_tests'].astype(int)
             df_result[['cum_tests', 'new_tests']] = df_result[['cum_tests', 'new_tests']].astype(int)
-            df_result_trim = df_result[['dates2', 'cum_cases', 'new_cases',
-                                        'cum_deaths', 'new_deaths', 'cum_recover',
-                                        'new_recover', 'new_uninfected', 'cum_tests',
-                                        'new_tests', 'population']].copy()
+            df_result = df_result.loc[:, ~df_result.columns.str.contains('^Unnamed')]
+            with metrics.stage('write', roi, rows=len(df_result), files=1):
+                df_result.drop('day', axis=1).set_index('dates2').to_csv(csv_path) # overwrite timeseries CSV
 
-            df_result_trim = df_result_trim.loc[:, ~df_result_trim.columns.str.contains('^Unnamed')]
-            df_result_trim.to_csv(csv_path) # overwrite timeseries CSV
-
-        except:
+        except Exception:
             print(f'Could not get tests data for {roi}.')
 
 
+def cache_jhu_us_states_tests(data_path: str,
+                              max_requests: int = JHU_TESTS_MAX_REQUESTS
+                              ) -> pd.DataFrame:
+    """ Download the JHU daily US state reports that are not yet cached.
+
+        Each daily report is parsed once and cached under
+        <data_path>/.cache/jhu_us_states_tests, and the merged table of state
+        test results in the same directory is extended with the new days.
+        Days without a report (or without test results in it) are kept in
+        missing.json there and not requested again, unless they are within
+        JHU_TESTS_RETRY_DAYS of today.
+
+        Args:
+            data_path (str): Full path to data directory.
+            max_requests (int): Maximum number of daily reports to download
+                                at the same time.
+        Returns:
+            pd.DataFrame: The merged table, with 'Province_State',
+                          'cum_tests' and 'dates2' columns.
+         """
+    cache_path = _jhu_us_states_tests_cache(data_path)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    merged_path = cache_path / 'merged.csv'
+    missing_path = cache_path / 'missing.json'
+    # generate a list of days for scraping
+    start_day = date_to_day(date(2020, 4, 12)) # When JHU starts reporting
+    end_day = date_to_day(date.today())
+    days = np.arange(start_day, end_day + 1)
+    dates = dict(zip(days, format_days(days, '%m-%d-%Y')))
+
+    df_merged = read_jhu_us_states_tests(data_path)
+    merged_days = set(jhu_days(df_merged['dates2']))
+    known_missing = set()
+    if missing_path.is_file():
+        with open(missing_path) as f:
+            known_missing = set(json.load(f))
+    # Days already parsed but not yet merged (e.g. if a previous run stopped)
+    dfs = [pd.read_csv(cache_path / ('%s.csv' % dates[day])) for day in days
+           if day not in merged_days
+           and (cache_path / ('%s.csv' % dates[day])).is_file()]
+    cached_days = merged_days.union(*[set(jhu_days(df['dates2'])) for df in dfs])
+    missing = [day for day in days if day not in cached_days
+               and dates[day] not in known_missing]
+
+    print("Scraping %d new days of data across all states" % len(missing))
+    urls = [JHU_TESTS_URL_TEMPLATE % dates[day] for day in missing]
+    errors = {}
+    downloads = fetch_all(urls, cache_path=get_cache_path(data_path),
+                          max_workers=max_requests, errors=errors)
+    # Days with no report that will not get one any more
+    unavailable = []
+    for day, url in zip(missing, urls):
+        i = dates[day]
+        if url not in downloads:
+            print("Could not download tests data for %s" % i)
+            if getattr(errors.get(url), 'code', None) == 404:
+                unavailable.append(day)
+            continue
+        with metrics.stage('parse', source='jhu_us_states_tests',
+                           url=url) as counters:
+            df = pd.read_csv(BytesIO(downloads[url][0]))
+            counters['rows'] = len(df)
+        df_trim = pd.DataFrame(columns=['Province_State', 'cum_tests', 'dates2'])
+        df_trim['Province_State'] = df['Province_State'].values
+        df_trim['dates2'] = format_days([day])[0]
+        # cumulative tests are named 'People_Tested' for first 200 ish days
+        # then cumulative tests are named 'Total_Test_Results' after 200 ish days
+        if 'Total_Test_Results' in df.columns:
+            df_trim['cum_tests'] = df['Total_Test_Results'].fillna(-1).astype(int).values
+        elif 'People_Tested' in df.columns:
+            df_trim['cum_tests'] = df['People_Tested'].fillna(-1).astype(int).values
+        else:
+            unavailable.append(day)
+            continue
+        df_trim.to_csv(cache_path / ('%s.csv' % i), index=False)
+        dfs.append(df_trim)
+
+    unavailable = [day for day in unavailable
+                   if day < end_day - JHU_TESTS_RETRY_DAYS]
+    if unavailable:
+        known_missing.update(dates[day] for day in unavailable)
+        with open(missing_path, 'w') as f:
+            json.dump(sorted(known_missing), f, indent=1)
+    if dfs:
+        df_merged = pd.concat([df_merged] + dfs, ignore_index=True)
+        df_merged.to_csv(merged_path, index=False)
+    return df_merged
+
+
+def read_jhu_us_states_tests(data_path: str) -> pd.DataFrame:
+    """ The merged table of JHU US state test results cached so far by
+        `cache_jhu_us_states_tests`, without downloading anything.
+
+        Args:
+            data_path (str): Full path to data directory.
+        Returns:
+            pd.DataFrame: The merged table, with 'Province_State',
+                          'cum_tests' and 'dates2' columns.
+         """
+    merged_path = _jhu_us_states_tests_cache(data_path) / 'merged.csv'
+    if merged_path.is_file():
+        return pd.read_csv(merged_path)
+    return pd.DataFrame(columns=['Province_State', 'cum_tests', 'dates2'])
+
+
+def _jhu_us_states_tests_cache(data_path: str) -> Path:
+    """The directory of the cached JHU daily US state reports."""
+    return get_cache_path(data_path).parent / 'jhu_us_states_tests'
+
+
+def prefetch_owid(data_path: str, source: str) -> None:
+    """Download one OWID source into the HTTP cache (see `fetch.fetch`), so
+    that `get_owid` only has to revalidate it."""
+    fetch_all([OWID_URLS[source]], cache_path=get_cache_path(data_path))
+
+
+# The data sources that get-data.py can use.  Each declares the regions'
+# time-series files that it creates or updates, and `run_sources` runs a
+# source that updates some files after the sources that create them (and
+# after the sources listed before it that update them too).  A 'prefetch'
+# function downloads a source's data and can run before those sources are
+# done.  Sources with the same 'merge' function are run as one call to it.
+SOURCES = {
+    'jhu': {'function': get_jhu,
+            'creates': ['countries', 'US states']},
+    'canada': {'function': get_canada,
+               'creates': ['Canadian provinces']},
+    'brazil': {'function': get_brazil,
+               'creates': ['Brazilian states']},
+    # Downloaded by the prefetch, so the function only reads the cache
+    'jhu_us_states_tests': {'function': partial(get_jhu_us_states_tests,
+                                                download=False),
+                            'updates': ['US states'],
+                            'prefetch': cache_jhu_us_states_tests},
+    'owid_tests': {'function': get_owid_tests,
+                   'updates': ['countries'],
+                   'prefetch': partial(prefetch_owid, source='owid_tests'),
+                   'merge': get_owid},
+    'owid_global_vaccines': {'function': get_owid_global_vaccines,
+                             'updates': ['countries'],
+                             'prefetch': partial(prefetch_owid,
+                                                 source='owid_global_vaccines'),
+                             'merge': get_owid},
+    'owid_us_vaccines': {'function': get_owid_us_vaccines,
+                         'updates': ['US states'],
+                         'prefetch': partial(prefetch_owid,
+                                             source='owid_us_vaccines'),
+                         'merge': get_owid},
+}
+
+
+def run_sources(data_path: str, sources: list = None,
+                filter_: Union[dict, bool] = True,
+                max_workers: int = None) -> None:
+    """Get data from several sources, running independent ones concurrently.
+
+    Args:
+        data_path (str): Full path to data directory.
+        sources (list, optional): Names of the sources (keys of SOURCES).
+                                  Defaults to all of them.
+        filter_ (dict or bool, optional): Passed to each source.
+        max_workers (int, optional): Maximum number of sources (and
+                                     prefetches) to run at once.  Defaults
+                                     to all of them.
+    """
+    sources = list(SOURCES) if sources is None else list(sources)
+    unknown = set(sources).difference(SOURCES)
+    if unknown:
+        raise ValueError("Unknown data sources: %s" % ', '.join(unknown))
+
+    # Each task is one source, or one group of sources with a 'merge'
+    # function (at the position of the last of them)
+    tasks = {}  # name: (function, outputs created, outputs updated)
+    after = {}  # name: names of the tasks to wait for
+    for source in sources:
+        merge = SOURCES[source].get('merge')
+        if merge is None:
+            group = [source]
+            function = partial(SOURCES[source]['function'], data_path,
+                               filter_=filter_)
+        else:
+            group = [x for x in sources if SOURCES[x].get('merge') is merge]
+            if source != group[-1]:
+                continue
+            function = partial(merge, data_path, sources=group,
+                               filter_=filter_)
+        name = ', '.join(group)
+        tasks[name] = (function,
+                       {x for y in group for x in SOURCES[y].get('creates', [])},
+                       {x for y in group for x in SOURCES[y].get('updates', [])})
+        after[name] = {'prefetch %s' % x for x in group
+                       if 'prefetch' in SOURCES[x]}
+        for x in group:
+            if 'prefetch' in SOURCES[x]:
+                tasks['prefetch %s' % x] = (partial(SOURCES[x]['prefetch'],
+                                                    data_path), set(), set())
+                after['prefetch %s' % x] = set()
+    names = [name for name in tasks if not name.startswith('prefetch ')]
+    for i, name in enumerate(names):
+        _, creates, updates = tasks[name]
+        for j, other in enumerate(names):
+            _, other_creates, other_updates = tasks[other]
+            if other_creates & updates or (j < i and other_updates & updates):
+                after[name].add(other)
+
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as pool:
+        while after or running:
+            for name in [name for name in after if after[name] <= done]:
+                if name in names:
+                    print("Getting data from %s..." % name)
+                label = name if name.startswith('prefetch ') \
+                    else 'get %s' % name
+                running[pool.submit(_run_stage, label, tasks[name][0])] = name
+                del after[name]
+            if not running:
+                raise RuntimeError("Data sources wait for each other: %s"
+                                   % ', '.join(after))
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                future.result()  # Raise any error from the source
+                done.add(name)
+
+
+def _run_stage(label: str, function) -> None:
+    with metrics.stage(label):
+        function()
+
+
 def daterange(date1, date2):
     for n in range(int ((date2 - date1).days)+1):
         yield date1 + timedelta(n)
 
-def fix_jhu_testing_dates(x):
-    y = datetime.strptime(x, '%m-%d-%Y')
-    return datetime.strftime(y, '%m/%d/%y')
-
 def fix_negatives(data_path: str, plot: bool = False) -> None:
     """Fix negative values in daily data.
 
@@ -729,14 +1236,16 @@ def fix_negatives(data_path: str, plot: bool = False) -> None:
     Returns:
         None
     """
-    csvs = [x for x in data_path.iterdir() if 'covidtimeseries' in str(x)]
-    for csv in tqdm(csvs, desc="Regions"):
-        roi = str(csv).split('.')[0].split('_')[-1]
-        df = pd.read_csv(csv)
-        # Exclude final day because it is often a partial count.
-        df = df.iloc[:-1]
-        df = fix_neg(df, roi, plot=plot)
-        df.to_csv(data_path / (csv.name.split('.')[0]+'.csv'))
+    clean_timeseries(data_path, ['fix_negatives'], plot=plot)
+
+
+def fix_negatives_stage(df: pd.DataFrame, roi: str,
+                        plot: bool = False) -> pd.DataFrame:
+    """Cleaning stage (see `clean_timeseries`) that fixes negative values in
+    the daily data of one region."""
+    # Exclude final day because it is often a partial count.
+    df = df.iloc[:-1]
+    return fix_neg(df, roi, plot=plot)
 
 
 def fix_neg(df: pd.DataFrame, roi: str,
@@ -745,109 +1254,361 @@ def fix_neg(df: pd.DataFrame, roi: str,
     """Used by `fix_negatives` to fix negatives values for a single region.
 
     This function uses monotonic spline interpolation to make sure that
-    cumulative counts are non-decreasing.
+    cumulative counts are non-decreasing (see `repair_monotone`).
 
     Args:
         df (pd.DataFrame): DataFrame containing data for one region.
         roi (str): One region, e.g 'US_MI' or 'Greece'.
         columns (list, optional): Columns to make non-decreasing.
             Defaults to ['cases', 'deaths', 'recover'].
+        plot (bool, optional): Whether to plot the changed columns.
     Returns:
-        pd.DataFrame: [description]
+        pd.DataFrame: The region's data with repaired cumulative and daily
+                      columns.
     """
-    for c in columns:
-        cum = 'cum_%s' % c
-        new = 'new_%s' % c
-        before = df[cum].copy()
-        non_zeros = df[df[new] > 0].index
-        has_negs = before.diff().min() < 0
-        if len(non_zeros) and has_negs:
-            first_non_zero = non_zeros[0]
-            maxx = df.loc[first_non_zero, cum].max()
-            # Find the bad entries and null the corresponding
-            # cumulative column, which are:
-            # 1) Cumulative columns which are zero after previously
-            # being non-zero
-            bad = df.loc[first_non_zero:, cum] == 0
-            df.loc[bad[bad].index, cum] = None
-            # 2) New daily columns which are negative
-            bad = df.loc[first_non_zero:, new] < 0
-            df.loc[bad[bad].index, cum] = None
-            # Protect against 0 null final value which screws up interpolator
-            if np.isnan(df.loc[df.index[-1], cum]):
-                df.loc[df.index[-1], cum] = maxx
-            # Then run a loop which:
-            while True:
-                # Interpolates the cumulative column nulls to have
-                # monotonic growth
-                after = df[cum].interpolate('pchip')
-                diff = after.diff()
-                if diff.min() < 0:
-                    # If there are still negative first-differences at this
-                    # point, increase the corresponding cumulative values by 1.
-                    neg_index = diff[diff < 0].index
-                    df.loc[neg_index, cum] += 1
-                else:
-                    break
-                # Then repeat
-            if plot:
-                plt.figure()
-                plt.plot(df.index, before, label='raw')
-                plt.plot(df.index, after, label='fixed')
-                r = np.corrcoef(before, after)[0, 1]
-                plt.title("%s %s Raw vs Fixed R=%.5g" % (roi, c, r))
-                plt.legend()
-        else:
-            after = before
-        # Make sure the first differences are now all non-negative
-        assert after.diff().min() >= 0
-        # Replace the values
+    cums = ['cum_%s' % c for c in columns]
+    news = ['new_%s' % c for c in columns]
+    before = df[cums]
+    after = repair_monotone(before, df[news].set_axis(cums, axis=1))
+    if plot:
+        for c, cum in zip(columns, cums):
+            if after[cum].equals(before[cum].astype(float)):
+                continue
+            plt.figure()
+            plt.plot(df.index, before[cum], label='raw')
+            plt.plot(df.index, after[cum], label='fixed')
+            r = np.corrcoef(before[cum], after[cum])[0, 1]
+            plt.title("%s %s Raw vs Fixed R=%.5g" % (roi, c, r))
+            plt.legend()
+    # Make sure the first differences are now all non-negative
+    assert (after.diff().min() >= 0).all()
+    # Replace the values
+    for cum, new in zip(cums, news):
+        fixed = after[cum].round()
+        df[cum] = fixed.astype(int).values if fixed.notnull().all() \
+            else fixed.values
         df[new] = df[cum].diff().fillna(0).astype(int).values
     return df
 
 
+def repair_monotone(cum: pd.DataFrame, new: pd.DataFrame,
+                    method: str = 'raise') -> pd.DataFrame:
+    """Make cumulative counts non-decreasing in a single pass.
+
+    Each column is one series (e.g. the cumulative cases of one region), so
+    any number of columns and regions can be repaired at once.  In a series
+    that decreases somewhere, the entries from the first day with new counts
+    onward which are zero or have negative new counts are nulled.  The
+    remaining entries are made non-decreasing, and the nulled ones are then
+    filled with one monotonic (pchip) interpolation.  Series that never
+    decrease are returned unchanged.  Series of different lengths can be
+    combined by padding them with NaN.
+
+    Args:
+        cum (pd.DataFrame): Cumulative counts, days x series.
+        new (pd.DataFrame): The corresponding new daily counts (same shape).
+        method (str, optional): How to make the remaining entries
+            non-decreasing.  'raise' raises each entry to the largest one
+            before it, which is what repeatedly adding 1 to the entries that
+            decrease converges to.  'isotonic' uses the least-squares
+            non-decreasing fit (pool adjacent violators) instead, which also
+            lowers outliers that are too high.
+
+    Returns:
+        pd.DataFrame: The repaired cumulative counts (as floats).
+    """
+    values = cum.to_numpy(dtype=float, copy=True)
+    new_values = new.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    n_days = values.shape[0]
+    # From the first day with new counts onward
+    started = np.maximum.accumulate(new_values > 0, axis=0)
+    with np.errstate(invalid='ignore'):
+        decreasing = (np.diff(values, axis=0) < 0).any(axis=0)
+        bad = started & ((values == 0) | (new_values < 0))
+    repair = np.flatnonzero(started.any(axis=0) & decreasing)
+    if not len(repair):
+        return cum.astype(float)
+
+    values = values[:, repair]
+    first = started[:, repair].argmax(axis=0)
+    last = n_days - 1 - present[::-1, repair].argmax(axis=0)
+    columns = np.arange(len(repair))
+    first_value = values[first, columns]
+    values[bad[:, repair]] = np.nan
+    # Protect against a null final value, which screws up the interpolator
+    final_null = np.isnan(values[last, columns])
+    values[last[final_null], columns[final_null]] = first_value[final_null]
+
+    known = ~np.isnan(values)
+    if method == 'raise':
+        values = np.where(known, np.fmax.accumulate(values, axis=0), np.nan)
+    elif method == 'isotonic':
+        for j in columns:
+            values[known[:, j], j] = isotonic_fit(values[known[:, j], j])
+    else:
+        raise ValueError("Unknown monotone repair method '%s'" % method)
+
+    repaired = pd.DataFrame(values).interpolate('pchip', limit_area='inside')
+    result = cum.astype(float)
+    result.iloc[:, repair] = repaired.to_numpy()
+    return result
+
+
+def isotonic_fit(y: np.ndarray) -> np.ndarray:
+    """Least-squares non-decreasing fit to a series (pool adjacent violators).
+
+    Args:
+        y (np.ndarray): The series.
+
+    Returns:
+        np.ndarray: The closest non-decreasing series.
+    """
+    means, counts = [], []
+    for value in y:
+        mean, count = float(value), 1
+        # Pool with the previous blocks while they are higher
+        while means and means[-1] > mean:
+            count_before = counts.pop()
+            mean = (means.pop() * count_before + mean * count) \
+                / (count_before + count)
+            count += count_before
+        means.append(mean)
+        counts.append(count)
+    return np.repeat(means, counts)
+
+
 def negify_missing(data_path: str) -> None:
-    """Fix negative values in daily data.
+    """Set the daily counts of columns that are missing to -1.
 
-    The purpose of this script is to fix spurious negative values in new daily
-    numbers.  For example, the cumulative total of cases should not go from N
-    to a value less than N on a subsequent day.  This script fixes this by
-    nulling such data and applying a monotonic spline interpolation in between
-    valid days of data.  This only affects a small number of regions.  It
-    overwrites the original .csv files produced by the functions above.
+    A count is considered missing when its cumulative column is 0 on every
+    day, e.g. a column of all 0's for cumulative recovered becomes a column
+    of all -1's for new recovered.  It overwrites the original .csv files
+    produced by the functions above.
 
     Args:
         data_path (str): Full path to data directory.
-        plot (bool): Whether to plot the changes.
 
     Returns:
         None
     """
-    csvs = [x for x in data_path.iterdir() if 'covidtimeseries' in str(x)]
-    for csv in tqdm(csvs, desc="Regions"):
-        roi = str(csv).split('.')[0].split('_')[-1]
-        df = pd.read_csv(csv)
-        for kind in ['cases', 'deaths', 'recover']:
-            if df['cum_%s' % kind].sum() == 0:
-                print("Negifying 'new_%s' for %s" % (kind, roi))
-                df['new_%s' % kind] = -1
-        out = data_path / (csv.name.split('.')[0]+'.csv')
-        df.to_csv(out)
+    clean_timeseries(data_path, ['negify_missing'])
+
+
+def negify_missing_stage(df: pd.DataFrame, roi: str,
+                         plot: bool = False) -> pd.DataFrame:
+    """Cleaning stage (see `clean_timeseries`) that sets the daily counts of
+    missing columns of one region to -1."""
+    for kind in ['cases', 'deaths', 'recover']:
+        if df['cum_%s' % kind].sum() == 0:
+            print("Negifying 'new_%s' for %s" % (kind, roi), flush=True)
+            df['new_%s' % kind] = -1
+    return df
+
 
 def remove_old_rois(data_path: str):
     """Delete time-series files for regions no longer tracked, such as:
      Diamond Princess, MS Zaandam, Samoa, Vanuatu, Marshall Islands,
      US, US_AS (American Somoa)"""
+    clean_timeseries(data_path, ['remove_old_rois'])
 
-    csvs = [x for x in data_path.iterdir() if 'covidtimeseries' in str(x)]
-    rois_to_remove = ['Diamond Princess', 'Grand Princess', 'MS Zaandam', 'Samoa', 'Vanuatu',
-                        'Marshall Islands', 'US', 'US_AS', 'Micronesia', 'Kiribati']
-    for csv in csvs:
-        roi = str(csv).split('.')[0].split('_', 1)[-1]
-        if roi in rois_to_remove:
-            try:
-                if os.path.exists(csv):
-                    print("Removing {} from data_path".format(roi))
-                    os.remove(csv)
-            except:
-                print("could not remove {}. Check that path is correct.".format(csv))
+
+def remove_old_rois_stage(df: pd.DataFrame, roi: str,
+                          plot: bool = False) -> pd.DataFrame:
+    """Cleaning stage (see `clean_timeseries`) that drops a region if it is
+    no longer tracked."""
+    if roi in OLD_ROIS:
+        print("Removing {} from data_path".format(roi), flush=True)
+        return None
+    return df
+
+
+# Regions that are no longer tracked
+OLD_ROIS = ['Diamond Princess', 'Grand Princess', 'MS Zaandam', 'Samoa',
+            'Vanuatu', 'Marshall Islands', 'US', 'US_AS', 'Micronesia',
+            'Kiribati']
+
+# Per-region cleaning stages, in the order they are applied.  Each one takes
+# a region's data (and the region's name) and returns the cleaned data, or
+# None if the region should be removed.
+CLEANING_STAGES = {'remove_old_rois': remove_old_rois_stage,
+                   'fix_negatives': fix_negatives_stage,
+                   'negify_missing': negify_missing_stage}
+
+
+def clean_timeseries(data_path: str, stages: list = None,
+                     max_workers: int = None, plot: bool = False) -> dict:
+    """Clean the time-series .csv files in a single pass.
+
+    Each region's file is read once, passed through all of the requested
+    cleaning stages (see CLEANING_STAGES) and then written once (or deleted,
+    if a stage removes the region).  Regions are cleaned in parallel
+    processes.
+
+    Args:
+        data_path (str): Full path to data directory.
+        stages (list, optional): Names of the stages to apply.  They are
+                                 always applied in the order of
+                                 CLEANING_STAGES.  Defaults to all of them.
+        max_workers (int, optional): Number of processes.  Defaults to the
+                                     number of CPUs.
+        plot (bool, optional): Whether to plot the changes made by the
+                               stages.  Regions are then cleaned one at a
+                               time in this process.
+
+    Returns:
+        dict: Total seconds spent in each stage (and in reading and writing
+              the files), summed over regions.
+    """
+    stages = list(CLEANING_STAGES) if stages is None else list(stages)
+    unknown = set(stages).difference(CLEANING_STAGES)
+    if unknown:
+        raise ValueError("Unknown cleaning stages: %s" % ', '.join(unknown))
+    stages = [stage for stage in CLEANING_STAGES if stage in stages]
+    prefix = get_data_prefix()
+    csvs = [Path(data_path) / ('%s_%s.csv' % (prefix, roi))
+            for roi in sorted(list_rois(data_path, prefix, '.csv'))]
+    jobs = [(csv, stages, plot) for csv in csvs]
+    if plot or max_workers == 1:
+        results = list(tqdm(map(_clean_region, jobs), total=len(jobs),
+                            desc="Regions"))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(tqdm(pool.map(_clean_region, jobs, chunksize=8),
+                                total=len(jobs), desc="Regions"))
+    timings = dict.fromkeys(['read'] + stages + ['write'], 0.0)
+    for roi, region_timings, rows, written in results:
+        for key, seconds in region_timings.items():
+            timings[key] += seconds
+            files = int(key == 'read' or (key == 'write' and written))
+            metrics.record(key, roi, seconds=seconds, rows=rows, files=files)
+    print("Cleaning time per stage (summed over %d regions):" % len(jobs))
+    for key, seconds in timings.items():
+        print("  %-16s %8.3f s" % (key, seconds))
+    return timings
+
+
+def _clean_region(job: tuple) -> tuple:
+    """Apply the cleaning stages to one region's file (see
+    `clean_timeseries`).  Returns the region, the seconds spent in each
+    stage, the number of rows and whether the file was written (or
+    deleted)."""
+    csv, stages, plot = job
+    roi = csv.stem.split('_', 1)[1]
+    timings = {}
+    start = time.perf_counter()
+    df = pd.read_csv(csv)
+    df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+    rows = len(df)
+    timings['read'] = time.perf_counter() - start
+    for stage in stages:
+        start = time.perf_counter()
+        df = CLEANING_STAGES[stage](df, roi, plot=plot)
+        timings[stage] = time.perf_counter() - start
+        if df is None:
+            break
+    start = time.perf_counter()
+    if df is None:
+        os.remove(csv)
+    else:
+        df.set_index('dates2').to_csv(csv)
+    timings['write'] = time.perf_counter() - start
+    return roi, timings, rows, df is not None
+
+
+def build_timeseries_store(data_path: str, export_csv: bool = True) -> dict:
+    """Collect the time-series .csv files into the columnar store.
+
+    The store (see `io.get_store_path`) is what `io.read_timeseries` and
+    the stan data preparation functions read from.  Regions whose .csv file
+    no longer exists are removed from the store.  Regions whose content is
+    unchanged since the last update are not rewritten, and a manifest of
+    the added, changed and removed regions is written to
+    `io.get_manifest_path` so that only those need to be refit.
+
+    Args:
+        data_path (str): Full path to data directory.
+        export_csv (bool): Whether to keep the per-region .csv files.
+
+    Returns:
+        dict: The manifest.
+    """
+    prefix = get_data_prefix()
+    rois = list_rois(data_path, prefix, '.csv')
+    old_hashes = (read_manifest(data_path) or {}).get('hashes', {})
+    manifest = {'added': {}, 'changed': {}, 'removed': [], 'hashes': {}}
+    for roi in tqdm(rois, desc='Storing regions'):
+        csv = Path(data_path) / ('%s_%s.csv' % (prefix, roi))
+        start = time.perf_counter()
+        df_csv = pd.read_csv(csv)
+        df = to_store_frame(df_csv)
+        manifest['hashes'][roi] = content_hash(df)
+        store_file = get_store_path(data_path, roi)
+        if not store_file.is_file():
+            manifest['added'][roi] = (df.index[0].strftime(DATES2_FORMAT)
+                                      if len(df) else None)
+            first_changed = None
+        elif old_hashes.get(roi) == manifest['hashes'][roi]:
+            first_changed = None
+        else:
+            first_changed = first_changed_date(pd.read_parquet(store_file), df)
+            if first_changed is not None:
+                manifest['changed'][roi] = first_changed
+        if store_file.is_file() and first_changed is None:
+            # Unchanged; keep the store file newer so that it is still used
+            os.utime(store_file)
+        else:
+            write_timeseries(df_csv, roi, data_path)
+        metrics.record('store', roi, seconds=time.perf_counter() - start,
+                       rows=len(df), files=int(first_changed is not None
+                                               or roi in manifest['added']))
+        if not export_csv:
+            os.remove(csv)
+    for roi in set(list_rois_in_store(data_path)).difference(rois):
+        os.remove(get_store_path(data_path, roi))
+        manifest['removed'].append(roi)
+    manifest['removed'].sort()
+    with open(get_manifest_path(data_path), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    print("%d regions added, %d changed and %d removed"
+          % (len(manifest['added']), len(manifest['changed']),
+             len(manifest['removed'])))
+    return manifest
+
+
+def first_changed_date(old: pd.DataFrame, new: pd.DataFrame) -> str:
+    """The first date on which two versions of a region's data differ.
+
+    Dates and columns present in only one of them count as differences.
+
+    Args:
+        old (pd.DataFrame): The previous data, with a date index.
+        new (pd.DataFrame): The new data, with a date index.
+
+    Returns:
+        str: The first changed date (in 'dates2' format), or None if the
+             data are the same.
+    """
+    index = old.index.union(new.index)
+    columns = old.columns.union(new.columns)
+    old = old.reindex(index=index, columns=columns)
+    new = new.reindex(index=index, columns=columns)
+    same = (old == new) | (old.isnull() & new.isnull())
+    changed = index[~same.all(axis=1).to_numpy()]
+    if not len(changed):
+        return None
+    return changed[0].strftime(DATES2_FORMAT)
+
+
+def export_timeseries_csvs(data_path: str) -> None:
+    """Write a .csv file for each region in the columnar store.
+
+    Args:
+        data_path (str): Full path to data directory.
+    """
+    for roi in tqdm(list_rois_in_store(data_path), desc='Exporting regions'):
+        csv = Path(data_path) / ('%s_%s.csv' % (get_data_prefix(), roi))
+        df = read_timeseries(csv).drop('day', axis=1)
+        df.set_index('dates2').to_csv(csv)
+        # Keep the store file newer so that it is still used for reading
+        os.utime(get_store_path(data_path, roi))
@@ -0,0 +1,92 @@
+"""Canonical representation of dates in the data.
+
+Dates are represented as whole days since DAY_ZERO (01/22/20, the first day of
+the JHU data and t=0 of the fixed time base), so that joins, truncation and
+weekly bucketing are integer operations.  Date strings are parsed once per
+unique value with one vectorized parser per source format.
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+DAY_ZERO = pd.Timestamp(2020, 1, 22)
+# Format of the 'dates2' column in the time-series files
+DATES2_FORMAT = '%m/%d/%y'
+
+
+def to_days(values, fmt: str = DATES2_FORMAT) -> np.ndarray:
+    """Convert date strings (or numbers, e.g. 20200412) to days since DAY_ZERO.
+
+    Args:
+        values: Array-like of dates in format `fmt`.
+        fmt (str, optional): strptime format of the dates.
+
+    Returns:
+        np.ndarray: Integer days since DAY_ZERO.
+    """
+    codes, uniques = pd.factorize(np.asarray(values), sort=False)
+    parsed = pd.to_datetime(pd.Series(uniques).astype(str), format=fmt)
+    days = (parsed - DAY_ZERO).dt.days.to_numpy()
+    return days[codes]
+
+
+def to_dates(days) -> pd.DatetimeIndex:
+    """Convert days since DAY_ZERO to dates.
+
+    Args:
+        days: Array-like of integer days since DAY_ZERO.
+
+    Returns:
+        pd.DatetimeIndex: The corresponding dates.
+    """
+    return DAY_ZERO + pd.to_timedelta(np.asarray(days), unit='D')
+
+
+def format_days(days, fmt: str = DATES2_FORMAT) -> np.ndarray:
+    """Convert days since DAY_ZERO to date strings.
+
+    Args:
+        days: Array-like of integer days since DAY_ZERO.
+        fmt (str, optional): strftime format of the result.
+
+    Returns:
+        np.ndarray: Date strings (one per day).
+    """
+    codes, uniques = pd.factorize(np.asarray(days), sort=False)
+    strings = to_dates(uniques).strftime(fmt).to_numpy()
+    return strings[codes]
+
+
+def date_to_day(value) -> int:
+    """Convert one date (in any format pandas understands) to days since
+    DAY_ZERO.
+
+    Args:
+        value: A date, e.g. '2020/06/01' or a datetime.
+
+    Returns:
+        int: Days since DAY_ZERO.
+    """
+    return int((pd.Timestamp(value) - DAY_ZERO).days)
+
+
+def parse_date_arg(value: str, option: str = '--last-date') -> int:
+    """Convert a MM/DD/YY command-line date to days since DAY_ZERO.
+
+    Args:
+        value (str): The date, e.g. '06/01/20'.
+        option (str, optional): Name of the option, for the error message.
+
+    Raises:
+        ValueError: If the date is not in MM/DD/YY format.
+
+    Returns:
+        int: Days since DAY_ZERO.
+    """
+    try:
+        day = datetime.strptime(value, DATES2_FORMAT)
+    except ValueError:
+        msg = "Incorrect %s format, should be MM/DD/YY" % option
+        raise ValueError(msg)
+    return date_to_day(day)
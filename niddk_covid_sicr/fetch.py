@@ -0,0 +1,371 @@
+"""Concurrent, conditional downloads shared by the data scrapers.
+
+All of the scrapers download through `fetch` (or `fetch_file`), which keeps
+a disk cache of each URL's content and validators.  `configure` changes how
+the cache is used for the whole process, e.g. to replay a previously filled
+cache without any network access.
+"""
+
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+import urllib.request
+
+from .metrics import stage
+
+# Default number of simultaneous downloads
+FETCH_MAX_WORKERS = 6
+# Bytes read from a response at a time by `iter_json_records`
+JSON_CHUNK_SIZE = 1 << 16
+# How downloads use the cache (see `configure`)
+FETCH_MODES = ['online', 'replay']
+HTTP_OPTIONS = {'mode': 'online', 'cache_path': None, 'max_age': 0,
+                'stale_while_revalidate': False,
+                'opener': urllib.request.urlopen}
+
+_revalidator = None  # Thread pool for stale-while-revalidate refreshes
+_revalidator_lock = threading.Lock()
+
+
+def configure(mode: str = None, cache_path: str = None,
+              max_age: float = None, stale_while_revalidate: bool = None,
+              opener=None) -> dict:
+    """Set how all downloads use the network and the cache.
+
+    Options that are not given keep their current values.
+
+    Args:
+        mode (str, optional): 'online' to download (conditionally, when a
+                              cached copy exists), or 'replay' to serve only
+                              from the cache and never use the network.
+        cache_path (str, optional): Cache directory to use for every
+                                    download, in place of each scraper's
+                                    default (see `get_cache_path`), e.g. a
+                                    copy of the cache of another machine.
+        max_age (float, optional): Seconds for which a cached copy is used
+                                   without asking the server.
+        stale_while_revalidate (bool, optional): Serve older cached copies
+                                                 at once too, and refresh
+                                                 them in the background for
+                                                 the next run.
+        opener (callable, optional): Called like urllib.request.urlopen to
+                                     make each request.
+
+    Raises:
+        ValueError: If the mode is unknown.
+
+    Returns:
+        dict: The options now in use.
+    """
+    if mode is not None and mode not in FETCH_MODES:
+        raise ValueError("Unknown fetch mode %s (use one of %s)"
+                         % (mode, ', '.join(FETCH_MODES)))
+    options = {'mode': mode, 'cache_path': cache_path, 'max_age': max_age,
+               'stale_while_revalidate': stale_while_revalidate,
+               'opener': opener}
+    HTTP_OPTIONS.update({key: value for key, value in options.items()
+                         if value is not None})
+    return dict(HTTP_OPTIONS)
+
+
+def get_cache_path(data_path: str) -> Path:
+    """Get the directory where downloaded source files are cached.
+
+    Args:
+        data_path (str): Full path to data directory.
+
+    Returns:
+        Path: The cache directory (inside the data directory).
+    """
+    return Path(data_path) / '.cache' / 'http'
+
+
+def _cache_paths(cache_path: str, url: str) -> tuple:
+    key = hashlib.sha1(url.encode()).hexdigest()
+    cache_path = Path(cache_path)
+    return cache_path / ('%s.body' % key), cache_path / ('%s.json' % key)
+
+
+def _tmp_path(path: Path) -> Path:
+    return path.with_name('%s.%d.%d.tmp' % (path.name, os.getpid(),
+                                            threading.get_ident()))
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    """Write to a temporary file and then move it into place, so that readers
+    never see a partially written file."""
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(JSON_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fetch(url: str, cache_path: str = None, timeout: float = 60) -> tuple:
+    """Download one URL, reusing the cached copy if upstream has not changed.
+
+    When a cached copy exists its ETag and Last-Modified validators are sent
+    with the request, so an unchanged file costs a single 304 response.
+
+    Args:
+        url (str): The URL to download.
+        cache_path (str, optional): Directory for cached copies.  If None
+                                    (and none is set with `configure`),
+                                    always download the full file.
+        timeout (float, optional): Seconds to wait for the server.
+
+    Raises:
+        HTTPError: If the server returns an error status.
+        URLError: If the server could not be reached, or the URL is not
+                  cached in replay mode.
+
+    Returns:
+        tuple: The content (bytes) and whether it changed since the cached
+               copy (bool).
+    """
+    if HTTP_OPTIONS['cache_path'] is None and cache_path is None:
+        if HTTP_OPTIONS['mode'] == 'replay':
+            raise URLError("No cache to replay %s from" % url)
+        request = urllib.request.Request(url)
+        with stage('download', url=url, status='downloaded') as counters:
+            with HTTP_OPTIONS['opener'](request, timeout=timeout) as response:
+                content = response.read()
+            counters['bytes'] = len(content)
+        return content, True
+    body_path, changed = fetch_file(url, cache_path=cache_path,
+                                    timeout=timeout)
+    return body_path.read_bytes(), changed
+
+
+def fetch_file(url: str, cache_path: str = None, timeout: float = 60) -> tuple:
+    """Download one URL into the cache, without holding it in memory.
+
+    The cached copy is used as it is in replay mode, if it is younger than
+    the 'max_age' option, or (when 'stale_while_revalidate' is set) while it
+    is refreshed in the background.  Otherwise it is revalidated as in
+    `fetch`.
+
+    Args:
+        url (str): The URL to download.
+        cache_path (str): Directory for cached copies.  Overridden by the
+                          'cache_path' option (see `configure`).
+        timeout (float, optional): Seconds to wait for the server.
+
+    Raises:
+        HTTPError: If the server returns an error status.
+        URLError: If the server could not be reached, or the URL is not
+                  cached in replay mode.
+
+    Returns:
+        tuple: The path of the cached content (Path) and whether it changed
+               since the previous cached copy (bool).
+    """
+    cache_path = Path(HTTP_OPTIONS['cache_path'] or cache_path)
+    body_path, meta_path = _cache_paths(cache_path, url)
+    with stage('download', url=url, status='cached') as counters:
+        if body_path.is_file() and meta_path.is_file():
+            age = time.time() - meta_path.stat().st_mtime
+            if HTTP_OPTIONS['mode'] == 'replay' or \
+                    age < HTTP_OPTIONS['max_age']:
+                return body_path, False
+            if HTTP_OPTIONS['stale_while_revalidate']:
+                _revalidate_later(url, cache_path, timeout)
+                return body_path, False
+        elif HTTP_OPTIONS['mode'] == 'replay':
+            counters['status'] = 'missing'
+            raise URLError("%s is not in the cache at %s" % (url, cache_path))
+        return _download(url, cache_path, timeout, counters)
+
+
+def _download(url: str, cache_path: Path, timeout: float,
+              counters: dict) -> tuple:
+    """Conditionally download one URL into the cache (see `fetch_file`),
+    recording the bytes downloaded and the status in `counters`."""
+    counters['status'] = 'failed'
+    cache_path.mkdir(parents=True, exist_ok=True)
+    body_path, meta_path = _cache_paths(cache_path, url)
+    headers = {}
+    meta = {}
+    if body_path.is_file() and meta_path.is_file():
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    request = urllib.request.Request(url, headers=headers)
+    tmp_path = _tmp_path(body_path)
+    try:
+        with HTTP_OPTIONS['opener'](request, timeout=timeout) as response:
+            try:
+                with open(tmp_path, 'wb') as f:
+                    shutil.copyfileobj(response, f, JSON_CHUNK_SIZE)
+            except BaseException:
+                try:
+                    tmp_path.unlink()
+                except FileNotFoundError:
+                    pass
+                raise
+            validators = {'url': url,
+                          'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get(
+                              'Last-Modified')}
+    except HTTPError as e:
+        if e.code == 304 and meta:
+            os.utime(meta_path)  # Validated now
+            counters['status'] = 'not modified'
+            return body_path, False
+        raise
+    counters['bytes'] = tmp_path.stat().st_size
+    counters['status'] = 'downloaded'
+    validators['sha256'] = _file_digest(tmp_path)
+    changed = not meta or \
+        (meta['sha256'] if 'sha256' in meta else _file_digest(body_path)) \
+        != validators['sha256']
+    os.replace(tmp_path, body_path)
+    _write_atomic(meta_path, json.dumps(validators).encode())
+    return body_path, changed
+
+
+def _revalidate_later(url: str, cache_path: Path, timeout: float) -> None:
+    """Refresh a cached copy in a background thread.  The process waits for
+    the refresh before it exits."""
+    global _revalidator
+
+    def revalidate():
+        try:
+            with stage('revalidate', url=url) as counters:
+                _download(url, cache_path, timeout, counters)
+        except (URLError, OSError):
+            pass  # Keep the stale copy
+
+    with _revalidator_lock:
+        if _revalidator is None:
+            _revalidator = ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS)
+        _revalidator.submit(revalidate)
+
+
+def fetch_all(urls: list, cache_path: str = None,
+              max_workers: int = FETCH_MAX_WORKERS,
+              timeout: float = 60, errors: dict = None) -> dict:
+    """Download several URLs at once.
+
+    Args:
+        urls (list): The URLs to download.
+        cache_path (str, optional): Directory for cached copies (see `fetch`).
+        max_workers (int, optional): Maximum number of downloads in flight.
+        timeout (float, optional): Seconds to wait for each server response.
+        errors (dict, optional): If given, the error of each URL that could
+                                 not be downloaded is added to it.
+
+    Returns:
+        dict: URL: (content, changed) pairs.  URLs that could not be
+              downloaded are left out.
+    """
+    urls = list(urls)
+
+    def fetch_one(url):
+        try:
+            return fetch(url, cache_path=cache_path, timeout=timeout)
+        # Including HTTPError, and timeouts and resets while reading
+        except (URLError, OSError) as e:
+            if errors is not None:
+                errors[url] = e
+            return None
+
+    results = {}
+    if not urls:
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
+        for url, result in zip(urls, pool.map(fetch_one, urls)):
+            if result is not None:
+                results[url] = result
+    return results
+
+
+def fingerprint(*parts) -> str:
+    """A short hash identifying a set of downloaded contents (and options).
+
+    Args:
+        parts: Byte strings or other objects (which are converted with `str`).
+
+    Returns:
+        str: A hex digest.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode()
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+
+def iter_json_records(stream, key: str,
+                      chunk_size: int = JSON_CHUNK_SIZE):
+    """Decode the records in a JSON array one at a time while reading it.
+
+    For a document like {"cases": [{...}, {...}, ...]} only one record is
+    ever decoded into Python objects at a time, instead of the whole tree.
+
+    Args:
+        stream: A binary file-like object, e.g. an HTTP response.
+        key (str): The name of the array in the top-level object.
+        chunk_size (int, optional): Bytes to read at a time.
+
+    Raises:
+        ValueError: If the array is not found or the document is truncated.
+
+    Yields:
+        The records (usually dicts), in order.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    separators = re.compile(r'[\s,]*')
+    buffer = ''
+    eof = False
+
+    def read_more():
+        nonlocal buffer, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += text_decoder.decode(chunk, final=eof)
+
+    match = None
+    while match is None:
+        match = start.search(buffer)
+        if match is None:
+            if eof:
+                raise ValueError("No array named %s was found" % key)
+            read_more()
+    pos = match.end()
+    while True:
+        pos = separators.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("The array named %s is truncated" % key)
+            buffer = buffer[pos:]
+            pos = 0
+            read_more()
+            continue
+        yield record
+        pos = end
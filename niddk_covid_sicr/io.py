@@ -1,29 +1,49 @@
 """Loading, saving, and listing of data and fits."""
 
+from contextlib import contextmanager
+from functools import lru_cache
+import hashlib
+import json
+import numpy as np
 import os
 import pandas as pd
 from pathlib import Path
 import pickle
 import platform
+import pyarrow.parquet as pq
 import pystan
 import re
+import shutil
+import sqlite3
 import sys
+import tempfile
+import time
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
-def get_fit_path(fits_path: str, model_name: str, roi: str) -> str:
+from .dates import DATES2_FORMAT, DAY_ZERO, to_dates, to_days
+from .fetch import fingerprint
+
+
+def get_fit_path(fits_path: str, model_name: str, roi: str,
+                 fit_format: int = 1) -> str:
     """Get a full path contain a model fit for one region.
 
     Args:
         fits_path: Path to directory where fits are stored.
         model_name: Name of the model (without .stan suffix).
         roi: A single region of interest, e.g. "US_MI" or "Greece".
+        fit_format: The fit format (see `get_ending`). Defaults to 1.
 
     Returns:
         A full path to a model fit for one region.
     """
     path = Path(fits_path)
-    path = path / ('%s_%s.pkl' % (model_name, roi))
-    assert path.is_file(), "No pickled fit file found at %s" % path
+    path = path / ('%s_%s%s' % (model_name, roi, get_ending(fit_format)))
+    assert path.exists(), "No fit found at %s" % path
     return path
 
 
@@ -35,15 +55,15 @@ def get_model_path(models_path: str, model_name: str,
     Args:
         models_path: Path to directory where models are stored.
         model_name: Name of the model (without .stan suffix).
+        compiled: Whether to get the compiled model (see
+                  `get_compiled_model_path`) instead of the .stan file.
 
     Returns:
         A full path to a Stan model file.
     """
     models_path = Path(models_path)
     if compiled:
-        file_path = models_path / ('%s_%s_%s.stanc' %
-                                   (model_name, platform.platform(),
-                                    platform.python_version()))
+        file_path = get_compiled_model_path(models_path, model_name)
     else:
         file_path = Path(models_path) / ('%s.stan' % model_name)
     if check_exists:
@@ -54,59 +74,530 @@ def get_model_path(models_path: str, model_name: str,
     return file_path.resolve()
 
 
-def get_data(roi: str, data_path: str = 'data') -> pd.DataFrame:
+def get_data(roi: str, data_path: str = 'data',
+             with_day: bool = False) -> pd.DataFrame:
     """Get the data associated with a given ROI.
 
     Args:
         roi (str): A single region of interest, e.g. "US_MI" or "Greece".
         data_path (str, optional): A path to the directory where data
                                    is stored.
+        with_day (bool, optional): Whether to keep a 'day' column (days
+                                   since `dates.DAY_ZERO`).
 
     Returns:
         pd.DataFrame: A dataframe containing the data.
     """
     path = Path(data_path) / ("covidtimeseries_%s.csv" % roi)
-    assert path.is_file(), "No file found at %s" % (path.resolve())
-    df = pd.read_csv(path).set_index('dates2')
-    df = df[[x for x in df if 'Unnamed' not in x]]
+    assert timeseries_exists(path), "No file found at %s" % (path.resolve())
+    df = read_timeseries(path).set_index('dates2')
+    if not with_day:
+        df = df.drop('day', axis=1)
     df.index.name = 'date'
     return df
 
 
+# Per-region files in the data path: name: (file, column with the region,
+# column with the value for the region, whether the value is a date)
+REGION_TABLES = {
+    'mitigation': ('mitigationprior.csv', 'region', 'date', True),
+    'priors': ('priors.csv', 'region', 'date', True),
+    'population': ('population_estimates.csv', 'roi', 'population', False),
+}
+
+
+def get_region_table(data_path: str, name: str) -> dict:
+    """Values of one of the per-region files in `REGION_TABLES`, indexed by
+    region.
+
+    Each file is read once per process (and again only if it changes), so
+    looking up many regions costs one read of the file.  Dates are
+    converted to days since `dates.DAY_ZERO` as the file is read.
+
+    Args:
+        data_path (str): Full path to the data directory.
+        name (str): The table, e.g. 'mitigation'.
+
+    Returns:
+        dict: Region: value (empty if the file is missing).  The dict is
+              shared by all callers and must not be modified.
+    """
+    file_name, region, value, is_date = REGION_TABLES[name]
+    path = Path(data_path).resolve() / file_name
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    return _load_region_table(str(path), mtime, region, value, is_date)
+
+
+def get_region_value(data_path: str, name: str, roi: str, default=None):
+    """One region's value in a per-region file (see `get_region_table`).
+
+    Args:
+        data_path (str): Full path to the data directory.
+        name (str): The table, e.g. 'mitigation'.
+        roi (str): A single region, e.g. "US_MI" or "Greece".
+        default (optional): The result if the region is not in the file.
+
+    Returns:
+        The value, e.g. the day mitigation started (in days since
+        `dates.DAY_ZERO`) for 'mitigation'.
+    """
+    return get_region_table(data_path, name).get(roi, default)
+
+
+@lru_cache(maxsize=None)
+def _load_region_table(path: str, mtime: int, region: str, value: str,
+                       is_date: bool) -> dict:
+    if mtime is None:
+        return {}
+    df = pd.read_csv(path, usecols=[region, value], encoding='utf-8-sig')
+    df = df.drop_duplicates(region).dropna()
+    if is_date:  # Unreadable dates are left out, like missing regions
+        dates = pd.to_datetime(df[value], format=DATES2_FORMAT,
+                               errors='coerce')
+        df = df.assign(**{value: (dates - DAY_ZERO).dt.days})
+        df = df.dropna().astype({value: int})
+    return dict(zip(df[region], df[value].tolist()))
+
+
+def get_store_path(data_path: str, roi: str = None) -> Path:
+    """Get the path of the columnar time-series store (or one region in it).
+
+    The store holds one Parquet file per region, with a date index and
+    integer columns.
+
+    Args:
+        data_path (str): Full path to the data directory.
+        roi (str, optional): A single region, e.g. "US_MI" or "Greece".
+
+    Returns:
+        Path: The store directory, or the file for `roi` if given.
+    """
+    path = Path(data_path) / 'timeseries'
+    if roi is not None:
+        path = path / ('%s.parquet' % roi)
+    return path
+
+
+def _store_file(full_data_path: str) -> Path:
+    """The store file for a region's .csv path, if it is up to date."""
+    full_data_path = Path(full_data_path)
+    roi = full_data_path.stem.replace(get_data_prefix() + '_', '', 1)
+    store_file = get_store_path(full_data_path.parent, roi)
+    if not store_file.is_file():
+        return None
+    if full_data_path.is_file() and \
+            full_data_path.stat().st_mtime > store_file.stat().st_mtime:
+        return None  # The .csv file was rewritten after the store
+    return store_file
+
+
+def get_timeseries_file(full_data_path: str) -> Path:
+    """The file that `read_timeseries` reads for a region.
+
+    Args:
+        full_data_path (str): Path to the region's .csv file, e.g.
+                              data/covidtimeseries_US_MI.csv.
+
+    Returns:
+        Path: The region's store file if it is up to date, and otherwise
+              the .csv file.
+    """
+    store_file = _store_file(full_data_path)
+    return Path(full_data_path) if store_file is None else store_file
+
+
+# Hashes of the files read so far: path: (size, modification time, hash)
+_file_hashes = {}
+
+
+def file_hash(path: str) -> str:
+    """A hash of the contents of a file.
+
+    The hash is only computed again if the size or modification time of the
+    file has changed since it was last computed.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        str: A hex digest, or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = str(Path(path).resolve())
+    cached = _file_hashes.get(key)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _file_hashes[key] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def timeseries_exists(full_data_path: str) -> bool:
+    """Whether data exists for a region, in the store or as a .csv file.
+
+    Args:
+        full_data_path (str): Path to the region's .csv file, e.g.
+                              data/covidtimeseries_US_MI.csv.
+
+    Returns:
+        bool: True if the data can be read with `read_timeseries`.
+    """
+    return Path(full_data_path).is_file() or \
+        _store_file(full_data_path) is not None
+
+
+def read_timeseries(full_data_path: str, columns: list = None) -> pd.DataFrame:
+    """Read the time-series data for one region.
+
+    Reads the region from the columnar store when it is present and up to
+    date, and otherwise from the .csv file.  Either way the result has the
+    .csv layout: a 'dates2' column, a 'day' column (days since
+    `dates.DAY_ZERO`) and then the data columns.
+
+    Args:
+        full_data_path (str): Path to the region's .csv file, e.g.
+                              data/covidtimeseries_US_MI.csv.
+        columns (list, optional): Only read these columns (and 'dates2').
+                                  Columns that do not exist are ignored.
+
+    Returns:
+        pd.DataFrame: The data, one row per day.
+    """
+    store_file = _store_file(full_data_path)
+    if store_file is not None:
+        if columns is not None:
+            names = pq.read_schema(store_file).names
+            columns = [c for c in columns if c in names and c != 'dates2']
+        df = pd.read_parquet(store_file, columns=columns)
+        df.insert(0, 'dates2', df.index.strftime(DATES2_FORMAT))
+        df.insert(1, 'day', (df.index - DAY_ZERO).days)
+        return df.reset_index(drop=True)
+    if columns is not None:
+        wanted = set(columns).union(['dates2'])
+        df = pd.read_csv(full_data_path, usecols=lambda c: c in wanted)
+    else:
+        df = pd.read_csv(full_data_path)
+        df = df[[x for x in df if 'Unnamed' not in x]]
+    df.insert(df.columns.get_loc('dates2') + 1, 'day', to_days(df['dates2']))
+    return df
+
+
+def timeseries_hash(full_data_path: str) -> str:
+    """A hash of the time-series data of one region.
+
+    The hash is of the data itself (see `content_hash`), so it is the same
+    whether the data is read from the columnar store or the .csv file.
+
+    Args:
+        full_data_path (str): Path to the region's .csv file, e.g.
+                              data/covidtimeseries_US_MI.csv.
+
+    Returns:
+        str: A hex digest.
+    """
+    return content_hash(to_store_frame(read_timeseries(full_data_path)))
+
+
+def content_hash(df: pd.DataFrame) -> str:
+    """A hash of one region's data in the store layout.
+
+    Args:
+        df (pd.DataFrame): The data, as returned by `to_store_frame`.
+
+    Returns:
+        str: A hex digest.
+    """
+    return fingerprint(list(zip(df.columns, df.dtypes.astype(str))),
+                       pd.util.hash_pandas_object(df).to_numpy().tobytes())
+
+
+def to_store_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert one region's data from the .csv layout to the store layout.
+
+    Args:
+        df (pd.DataFrame): The data, with a 'dates2' column.
+
+    Returns:
+        pd.DataFrame: The data with a date index, and integer columns
+                      wherever all the values are whole numbers (the others
+                      are kept as they are).
+    """
+    df = df[[x for x in df if 'Unnamed' not in x and x != 'day']]
+    df = df.set_index(to_dates(to_days(df['dates2'])))
+    df = df.drop('dates2', axis=1)
+    df.index.name = 'date'
+    for column in df:
+        values = df[column]
+        if pd.api.types.is_float_dtype(values) and \
+                np.isfinite(values).all() and (values == values.round()).all():
+            df[column] = values.astype('int64')
+    return df
+
+
+def write_timeseries(df: pd.DataFrame, roi: str, data_path: str) -> Path:
+    """Write one region's data (.csv layout) into the columnar store.
+
+    Args:
+        df (pd.DataFrame): The data, with a 'dates2' column.
+        roi (str): A single region, e.g. "US_MI" or "Greece".
+        data_path (str): Full path to the data directory.
+
+    Returns:
+        Path: The store file that was written.
+    """
+    df = to_store_frame(df)
+    path = get_store_path(data_path, roi)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name('%s.%d.tmp' % (path.name, os.getpid()))
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def list_data_rois(data_path: str) -> list:
+    """List all of the ROIs for which there is data.
+
+    Uses the columnar store if it exists, and the .csv files otherwise.
+
+    Args:
+        data_path (str): Full path to the data directory.
+
+    Returns:
+        list: All regions, e.g. ['US_MI', 'Greece', ...].
+    """
+    store_path = get_store_path(data_path)
+    if store_path.is_dir():
+        return list_rois_in_store(data_path)
+    return list_rois(data_path, get_data_prefix(), '.csv')
+
+
+def list_rois_in_store(data_path: str) -> list:
+    """List all of the ROIs in the columnar store.
+
+    Args:
+        data_path (str): Full path to the data directory.
+
+    Returns:
+        list: All regions, e.g. ['US_MI', 'Greece', ...].
+    """
+    store_path = get_store_path(data_path)
+    if not store_path.is_dir():
+        return []
+    return [file.stem for file in store_path.iterdir()
+            if file.suffix == '.parquet']
+
+
+def get_manifest_path(data_path: str) -> Path:
+    """Get the path of the manifest of regions changed by the last update.
+
+    Args:
+        data_path (str): Full path to the data directory.
+
+    Returns:
+        Path: The manifest file.
+    """
+    return Path(data_path) / 'manifest.json'
+
+
+def read_manifest(data_path: str) -> dict:
+    """Read the manifest written by the last update of the data.
+
+    The manifest has 'added' and 'changed' (region: first new or changed
+    date) and 'removed' (list of regions) entries, as well as the content
+    hash of every region in 'hashes'.
+
+    Args:
+        data_path (str): Full path to the data directory.
+
+    Returns:
+        dict: The manifest, or None if there is none.
+    """
+    path = get_manifest_path(data_path)
+    if not path.is_file():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def list_changed_rois(data_path: str) -> list:
+    """List the ROIs that were added or changed by the last update.
+
+    Args:
+        data_path (str): Full path to the data directory.
+
+    Returns:
+        list: Regions with new data, e.g. ['US_MI', 'Greece', ...], or None
+              if there is no manifest (so nothing is known to be unchanged).
+    """
+    manifest = read_manifest(data_path)
+    if manifest is None:
+        return None
+    return sorted(set(manifest['added']).union(manifest['changed']))
+
+
+# Lines of a Stan program that include another file
+STAN_INCLUDE = re.compile(r'^\s*#include\s*[<"]?([^>"\s]+)[>"]?\s*$')
+# Environment variables (compiler settings) that change a compiled model
+STAN_COMPILE_ENV = ['CC', 'CXX', 'CFLAGS', 'CXXFLAGS', 'LDFLAGS']
+
+# Models loaded (or compiled) in this process, by compiled model file
+_stan_models = {}
+
+
+def resolve_stan_source(stan_path: str, include_paths: list,
+                        _seen: tuple = ()) -> str:
+    """The source of a Stan program with all of its `#include`s expanded.
+
+    Included files are looked up in `include_paths` and then next to the
+    file that includes them.  An include that is not found is kept as it
+    is (the compiler will report it).
+
+    Args:
+        stan_path (str): Full path to the .stan file.
+        include_paths (list): Directories to look for included files in.
+
+    Returns:
+        str: The expanded source.
+    """
+    stan_path = Path(stan_path)
+    lines = []
+    for line in stan_path.read_text().splitlines():
+        match = STAN_INCLUDE.match(line)
+        if match:
+            candidates = [Path(path) / match.group(1)
+                          for path in list(include_paths) + [stan_path.parent]]
+            found = [path.resolve() for path in candidates if path.is_file()]
+            if found and found[0] not in _seen:
+                line = resolve_stan_source(found[0], include_paths,
+                                           _seen + (found[0],))
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def stan_model_key(stan_path: str, include_paths: list) -> str:
+    """A hash of everything that goes into a compiled model: the source with
+    all of its includes, the versions of pystan, Python and the platform, and
+    the compiler settings in `STAN_COMPILE_ENV`.
+
+    Args:
+        stan_path (str): Full path to the .stan file.
+        include_paths (list): Directories to look for included files in.
+
+    Returns:
+        str: A hex digest.
+    """
+    h = hashlib.sha256(resolve_stan_source(stan_path, include_paths).encode())
+    for part in [getattr(pystan, '__version__', ''), platform.platform(),
+                 platform.python_version()] + \
+            [os.environ.get(name, '') for name in STAN_COMPILE_ENV]:
+        h.update(b'\0' + part.encode())
+    return h.hexdigest()
+
+
+def get_compiled_model_path(models_path: str, model_name: str) -> Path:
+    """The file that a model is compiled to, named by its `stan_model_key`.
+
+    Args:
+        models_path (str): Path to directory containing the .stan model
+                           files.
+        model_name (str): Name of the model (without '.stan' extension).
+
+    Returns:
+        Path: The compiled model file (which may not exist yet).
+    """
+    uncompiled_path = get_model_path(models_path, model_name, with_suffix=True)
+    key = stan_model_key(uncompiled_path, [str(Path(models_path).resolve())])
+    return uncompiled_path.with_name('%s_%s.stanc' % (uncompiled_path.stem,
+                                                      key[:16]))
+
+
 def load_or_compile_stan_model(model_name: str, models_path: str = './models',
                                force_recompile: bool = False,
                                verbose: bool = False):
     """Loads a compiled Stan model from disk or compiles it if does not exist.
 
+    Compiled models are kept next to the .stan files, named by a hash of the
+    model (see `get_compiled_model_path`), so that changing the model or any file it
+    includes leads to a new compilation.  Compiling is done under a file
+    lock, so that when many processes need the same model one of them
+    compiles it and the others wait for it and load it.  Models are also
+    kept in memory for the rest of the process.
+
     Args:
-        model_name (str): [description]
-        force_recompile (bool, optional): [description]. Defaults to False.
-        verbose (bool, optional): [description]. Defaults to False.
+        model_name (str): Name of the model (without '.stan' extension).
+        models_path (str, optional): Path to directory containing the .stan
+                                     model files.
+        force_recompile (bool, optional): Compile the model even if it was
+                                          compiled before (but not if
+                                          another process compiled it while
+                                          this one waited). Defaults to False.
+        verbose (bool, optional): Report loading from the cache. Defaults to
+                                  False.
 
     Returns:
-        [type]: [description]
+        pystan.StanModel: The compiled model.
     """
-    uncompiled_path = get_model_path(models_path, model_name, with_suffix=True)
-    compiled_path = get_model_path(models_path, model_name,
-                                   compiled=True, with_suffix=True,
-                                   check_exists=False)
-    stan_raw_last_mod_t = os.path.getmtime(uncompiled_path)
+    start = time.time()
+    compiled_path = get_compiled_model_path(models_path, model_name)
+    if compiled_path in _stan_models and not force_recompile:
+        return _stan_models[compiled_path]
+    sm = None if force_recompile else _load_stan_model(compiled_path)
+    if sm is None:
+        with _file_lock(compiled_path.with_suffix('.lock')):
+            # Another process may have compiled it while this one waited
+            if not force_recompile or (compiled_path.is_file() and
+                                       compiled_path.stat().st_mtime >= start):
+                sm = _load_stan_model(compiled_path)
+            if sm is None:
+                uncompiled_path = get_model_path(models_path, model_name,
+                                                 with_suffix=True)
+                models_path = str(Path(models_path).resolve())
+                sm = pystan.StanModel(file=str(uncompiled_path),
+                                      include_paths=[models_path])
+                fd, tmp = tempfile.mkstemp(dir=compiled_path.parent,
+                                           suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        pickle.dump(sm, f)
+                    os.replace(tmp, compiled_path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+    elif verbose:
+        print("Loading %s from cache..." % model_name)
+    _stan_models[compiled_path] = sm
+    return sm
+
+
+def _load_stan_model(compiled_path: Path):
+    """A compiled model from a file, or None if it is missing or unusable."""
+    if not compiled_path.is_file():
+        return None
     try:
-        stan_compiled_last_mod_t = os.path.getmtime(compiled_path)
-    except FileNotFoundError:
-        stan_compiled_last_mod_t = 0
-    if force_recompile or (stan_compiled_last_mod_t < stan_raw_last_mod_t):
-        models_path = str(Path(models_path).resolve())
-        sm = pystan.StanModel(file=str(uncompiled_path),
-                              include_paths=[models_path])
-        with open(compiled_path, 'wb') as f:
-            pickle.dump(sm, f)
-    else:
-        if verbose:
-            print("Loading %s from cache..." % model_name)
         with open(compiled_path, 'rb') as f:
-            sm = pickle.load(f)
-    return sm
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+@contextmanager
+def _file_lock(lock_path: Path):
+    """Hold an exclusive lock on a file (where the platform supports it)."""
+    with open(lock_path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
 
 def get_data_prefix() -> str:
@@ -122,7 +613,7 @@ def get_ending(fit_format: int) -> str:
     """Get the file extension for a given fit format.
 
     Args:
-        fit_format (int): .csv (0) or .pkl (1).
+        fit_format (int): .csv (0), .pkl (1) or .draws (2).
 
     Raises:
         Exception: If an invalid fit format is provided.
@@ -134,6 +625,8 @@ def get_ending(fit_format: int) -> str:
         ending = '.csv'
     elif fit_format == 1:
         ending = '.pkl'
+    elif fit_format == 2:
+        ending = '.draws'
     else:
         raise Exception("No such fit format: %s" % fit_format)
     return ending
@@ -144,7 +637,9 @@ def list_rois(path: str, prefix: str, extension: str) -> list:
 
     Restricts to those with ending `ending` at the given path. Assumes there
     are no underscores until immediately before the region begins in each
-    potential file name
+    potential file name.  If the path has a fit catalog (see `record_fit`),
+    the regions are taken from it instead of listing the files (see
+    `update_fit_catalog` for fits made before there was a catalog).
 
     Args:
         path (str): A fit_path or data_path contaning one file for each region.
@@ -156,6 +651,10 @@ def list_rois(path: str, prefix: str, extension: str) -> list:
     """
     if isinstance(path, str):
         path = Path(path)
+    if get_catalog_path(path).is_file():
+        fits = query_fits(path, model=prefix,
+                          ending='.' + extension.lstrip('.'))
+        return list(fits['roi'])
     rois = []
     for file in path.iterdir():
         file_name = str(file.name)
@@ -166,11 +665,14 @@ def list_rois(path: str, prefix: str, extension: str) -> list:
     return rois
 
 
-def list_models(models_path: str) -> list:
+def list_models(models_path: str, fits_path: str = None) -> list:
     """Lists all available Stan models.
 
     Args:
         models_path (str): Full path to the models directory.
+        fits_path (str, optional): Only list the models with fits in the fit
+                                   catalog of this fits directory (if it has
+                                   one).
 
     Returns:
         list: A list of Stan models (without '.stan' suffixes).
@@ -181,9 +683,235 @@ def list_models(models_path: str) -> list:
                    if file.name[0] == file.name.upper()[0]
                    and file.suffix == '.stan']
     models = [mp.with_suffix('').name for mp in model_paths]
+    if fits_path is not None and get_catalog_path(fits_path).is_file():
+        with _connect_catalog(fits_path) as con:
+            fitted = {model for model, in
+                      con.execute('SELECT DISTINCT model FROM fits')}
+        models = [model for model in models if model in fitted]
     return models
 
 
+# Name of the fit catalog in a fits directory
+FIT_CATALOG = 'catalog.sqlite'
+# Columns of the fit catalog, one row per fit (model, roi and ending)
+FIT_CATALOG_COLUMNS = {
+    'model': 'TEXT NOT NULL',
+    'roi': 'TEXT NOT NULL',
+    'ending': 'TEXT NOT NULL',  # '.csv', '.pkl' or '.draws'
+    'file': 'TEXT',  # Name of the fit file in the fits directory
+    'fit_time': 'REAL',  # When the fit was saved, in seconds since the epoch
+    'data_hash': 'TEXT',  # `timeseries_hash` of the data it was fit to
+    'args': 'TEXT',  # JSON of the options of the fit
+    'n_chains': 'INTEGER',
+    'n_draws': 'INTEGER',  # Per chain
+    'size': 'INTEGER',  # Of the fit file (or store), in bytes
+    'lp__rhat': 'REAL',
+    'n_divergent': 'INTEGER',
+    'waic': 'REAL',
+    'loo': 'REAL',
+}
+# Columns of the fit catalog with an index
+FIT_CATALOG_INDICES = ['roi', 'fit_time', 'data_hash', 'lp__rhat']
+
+
+def get_catalog_path(fits_path: str) -> Path:
+    """Get the path of the fit catalog of a fits directory.
+
+    Args:
+        fits_path (str): Full path to the fits directory.
+
+    Returns:
+        Path: The catalog, an SQLite database.
+    """
+    return Path(fits_path) / FIT_CATALOG
+
+
+@contextmanager
+def _connect_catalog(fits_path: str):
+    """A connection to the fit catalog, created if needed, which commits
+    everything done with it in one transaction."""
+    columns = ', '.join('%s %s' % item for item in FIT_CATALOG_COLUMNS.items())
+    # Waits for other processes (e.g. concurrent runs) writing to it
+    con = sqlite3.connect(str(get_catalog_path(fits_path)), timeout=60)
+    try:
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS fits (%s, '
+                        'PRIMARY KEY (model, roi, ending))' % columns)
+            for column in FIT_CATALOG_INDICES:
+                con.execute('CREATE INDEX IF NOT EXISTS fits_%s ON fits (%s)'
+                            % (column, column))
+            yield con
+    finally:
+        con.close()
+
+
+def record_fit(fits_path: str, model_name: str, roi: str, fit_format: int,
+               args=None, models_path: str = None, **fields) -> dict:
+    """Add a fit to the fit catalog of its fits directory (or replace it).
+
+    The file, its size and the time it was saved are taken from the fit
+    file, which must already be saved.  The row is written in a single
+    transaction, so it is either fully there or not at all.
+
+    Args:
+        fits_path (str): Full path to the fits directory.
+        model_name (str): Name of the model (without '.stan' extension).
+        roi (str): A single region of interest, e.g. "US_MI" or "Greece".
+        fit_format (int): The fit format (see `get_ending`).
+        args (optional): The options of the fit, e.g. from argparse.
+        models_path (str, optional): Full path to the models directory.  If
+                                     given and the fits directory has no
+                                     catalog yet, its fits of these models
+                                     are added first (see
+                                     `update_fit_catalog`).
+        fields: Other columns of the catalog (see `FIT_CATALOG_COLUMNS`),
+                e.g. data_hash, n_chains or lp__rhat.  Keys which are not
+                columns (e.g. the rest of `get_fit_quality`) are ignored.
+
+    Returns:
+        dict: The row.
+    """
+    if models_path is not None and not get_catalog_path(fits_path).is_file():
+        # Fits made before there was a catalog
+        update_fit_catalog(fits_path, list_models(models_path))
+    row = _fit_row(fits_path, model_name, roi, fit_format, args, **fields)
+    with _connect_catalog(fits_path) as con:
+        _write_fit_rows(con, [row])
+    return row
+
+
+def _fit_row(fits_path: str, model_name: str, roi: str, fit_format: int,
+             args=None, **fields) -> dict:
+    """A row of the fit catalog, as for `record_fit`."""
+    fit_path = get_fit_path(fits_path, model_name, roi, fit_format)
+    if fit_path.is_dir():  # A draws store
+        size = sum(file.stat().st_size for file in fit_path.iterdir())
+    else:
+        size = fit_path.stat().st_size
+    row = {column: fields.get(column) for column in FIT_CATALOG_COLUMNS}
+    row.update({'model': model_name, 'roi': roi,
+                'ending': get_ending(fit_format), 'file': fit_path.name,
+                'fit_time': fit_path.stat().st_mtime, 'size': size})
+    if args is not None:
+        row['args'] = json.dumps(args if isinstance(args, dict) else vars(args),
+                                 default=str, sort_keys=True)
+    for column, value in row.items():
+        if isinstance(value, np.generic):  # Not understood by sqlite3
+            row[column] = value.item()
+    return row
+
+
+def _write_fit_rows(con, rows: list):
+    """Add rows to the fit catalog (or replace them)."""
+    columns = list(FIT_CATALOG_COLUMNS)
+    con.executemany('INSERT OR REPLACE INTO fits (%s) VALUES (%s)' %
+                    (', '.join(columns), ', '.join('?' * len(columns))),
+                    [[row[column] for column in columns] for row in rows])
+
+
+def query_fits(fits_path: str, where: str = None, params: tuple = (),
+               **equals) -> pd.DataFrame:
+    """Query the fit catalog of a fits directory (see `record_fit`).
+
+    Args:
+        fits_path (str): Full path to the fits directory.
+        where (str, optional): An SQL condition on the columns of the
+                               catalog, e.g. 'lp__rhat > 1.1' or
+                               'n_divergent > ?'.
+        params (tuple, optional): Values for the ?'s in `where`.
+        equals: Only fits with these values, e.g. model='SICRLMQ'.
+
+    Returns:
+        pd.DataFrame: One row per fit, ordered by model and region (with no
+                      rows if there is no catalog).  The files are not
+                      checked (see `list_stale_fits`).
+    """
+    if not get_catalog_path(fits_path).is_file():
+        return pd.DataFrame(columns=list(FIT_CATALOG_COLUMNS))
+    conditions = ['%s = ?' % column for column in equals]
+    params = list(equals.values()) + list(params)
+    if where:
+        conditions.append('(%s)' % where)
+    query = 'SELECT * FROM fits'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    with _connect_catalog(fits_path) as con:
+        return pd.read_sql_query(query + ' ORDER BY model, roi, ending', con,
+                                 params=params)
+
+
+def list_stale_fits(fits_path: str, data_path: str) -> pd.DataFrame:
+    """List the fits in the fit catalog made with data that has changed since,
+    or whose files are gone.
+
+    Args:
+        fits_path (str): Full path to the fits directory.
+        data_path (str): Full path to the data directory.
+
+    Returns:
+        pd.DataFrame: The rows of the catalog (see `query_fits`) of fits
+                      whose region's data (see `timeseries_hash`) is not
+                      the data they were fit to, or is unknown, and of
+                      fits whose files have been deleted.
+    """
+    fits = query_fits(fits_path)
+    hashes = {}
+    for roi in fits['roi'].unique():
+        csv = Path(data_path) / ('%s_%s.csv' % (get_data_prefix(), roi))
+        hashes[roi] = (timeseries_hash(csv) if timeseries_exists(csv)
+                       else None)
+    stale = [data_hash is None or data_hash != hashes[roi]
+             or not (Path(fits_path) / file).exists()
+             for roi, data_hash, file in zip(fits['roi'], fits['data_hash'],
+                                             fits['file'])]
+    return fits[stale].reset_index(drop=True)
+
+
+def update_fit_catalog(fits_path: str, model_names: list) -> pd.DataFrame:
+    """Bring the fit catalog in line with the fit files of a fits directory.
+
+    Adds fits which are not in the catalog (e.g. those copied from
+    elsewhere, or made before there was a catalog), with what can be known
+    from their files, and removes fits whose files are gone.
+
+    Args:
+        fits_path (str): Full path to the fits directory.
+        model_names (list): The models whose fits to add (without '.stan'
+                            extension).
+
+    Returns:
+        pd.DataFrame: The catalog (see `query_fits`).
+    """
+    fits_path = Path(fits_path)
+    known = set(query_fits(fits_path)['file'])
+    endings = {get_ending(fit_format): fit_format for fit_format in [0, 1, 2]}
+    # Longest first, so e.g. MMODS_ROUND2_US_MI is not a fit of MMODS
+    model_names = sorted(model_names, key=len, reverse=True)
+    files = set()
+    rows = []
+    for file in fits_path.iterdir():
+        files.add(file.name)
+        if file.name in known or file.suffix not in endings:
+            continue
+        stem = file.name[:-len(file.suffix)]
+        model_name = next((name for name in model_names
+                           if stem.startswith(name + '_')), None)
+        if model_name is None:
+            continue
+        fields = {}
+        if file.suffix == '.draws':
+            meta = read_draws_meta(file)
+            fields = {key: meta[key] for key in ['n_chains', 'n_draws']}
+        rows.append(_fit_row(fits_path, model_name,
+                             stem[len(model_name) + 1:],
+                             endings[file.suffix], **fields))
+    with _connect_catalog(fits_path) as con:
+        _write_fit_rows(con, rows)
+        con.executemany('DELETE FROM fits WHERE file = ?',
+                        [(file,) for file in known - files])
+    return query_fits(fits_path)
+
+
 def load_fit(fit_path: str, model_full_path: str, new_module_name: str = None):
     """Return a Stan fit instance.
 
@@ -232,15 +960,27 @@ def load_fit(fit_path: str, model_full_path: str, new_module_name: str = None):
 
 
 def extract_samples(fits_path: str, models_path: str, model_name: str,
-                    roi: str, fit_format: int) -> pd.DataFrame:
+                    roi: str, fit_format: int, params: list = None,
+                    chains: list = None, thin: int = None) -> pd.DataFrame:
     """Extract samples from the fit into a dataframe.
 
+    Only the columns of `params` are read where the format allows it (the
+    .csv and .draws formats), and only they are converted to a dataframe
+    for the .pkl format.
+
     Args:
         fits_path (str): Full path to the fits directory.
         models_path (str): Full path to the models directory.
         model_name (str): Name of the model (without '.stan' extension).
         roi (str): A single region, e.g. "US_MI" or "Greece".
-        fit_format (int): .csv (0) or .pkl (1).
+        fit_format (int): .csv (0), .pkl (1) or .draws (2).
+        params (list, optional): Parameters to extract, e.g. ['R0', 'Rt'] or
+                                 ['lambda[*,1]'] (see
+                                 `select_sample_columns`).  All of them by
+                                 default.
+        chains (list, optional): Only extract these chains.
+        thin (int, optional): Only extract every `thin`-th draw of each
+                              chain.
 
     Returns:
         pd.DataFrame: Samples extracted from the fit instance.
@@ -248,17 +988,110 @@ def extract_samples(fits_path: str, models_path: str, model_name: str,
     if fit_format in [0]:
         # Load the format that is just samples in a .csv file
         fit_path = Path(fits_path) / ("%s_%s.csv" % (model_name, roi))
-        samples = pd.read_csv(fit_path)
+        if params is None:
+            samples = pd.read_csv(fit_path)
+        else:
+            columns = pd.read_csv(fit_path, nrows=0).columns
+            samples = pd.read_csv(
+                fit_path, usecols=select_sample_columns(columns, params))
     elif fit_format == 1:
         # Load the format that is a pickle fit containing a Stan fit instance
         # and some other things
         fit_path = Path(fits_path) / ("%s_%s.pkl" % (model_name, roi))
         model_full_path = get_model_path(models_path, model_name)
         fit = load_fit(fit_path, model_full_path)
-        samples = fit.to_dataframe()
+        samples = fit_to_dataframe(fit, params)
+    elif fit_format == 2:
+        # Load the draws store, which does not need the model
+        fit_path = Path(fits_path) / ("%s_%s.draws" % (model_name, roi))
+        return draws_to_dataframe(fit_path, params, chains=chains, thin=thin)
+    return subset_draws(samples, chains=chains, thin=thin)
+
+
+def select_sample_columns(columns: list, params: list) -> list:
+    """The columns of a samples dataframe that hold some parameters.
+
+    A parameter can be given by name (e.g. 'Rt' for all of 'Rt[0]', 'Rt[1]',
+    ...), or as elements with '*' for any index (e.g. 'lambda[*,1]').  The
+    chain, draw and warmup columns are always selected.
+
+    Args:
+        columns (list): The columns, e.g. 'R0', 'lambda[3,1]', ...
+        params (list): The parameters.
+
+    Returns:
+        list: The selected columns, in their original order.
+    """
+    patterns = [re.escape(param).replace(r'\*', '[0-9]+') if '[' in param
+                else re.escape(param) + r'(\[[0-9,]+\])?'
+                for param in params]
+    regex = re.compile('^(?:%s)$' % '|'.join(patterns or ['(?!)']))
+    return [column for column in columns
+            if column in DRAWS_INDEX or regex.match(column)]
+
+
+def fit_to_dataframe(fit, params: list = None) -> pd.DataFrame:
+    """The samples of a fit as a dataframe, only converting those of some
+    parameters.
+
+    Args:
+        fit (pystan.StanFit4model): The fit.
+        params (list, optional): Parameters, as for `select_sample_columns`
+                                 (all of them by default).
+
+    Returns:
+        pd.DataFrame: The samples, one row per draw.
+    """
+    if params is None:
+        return fit.to_dataframe()
+    names = {param.split('[')[0] for param in params}
+    samples = fit.to_dataframe(pars=[name for name in fit.model_pars
+                                     if name in names])
+    return samples[select_sample_columns(samples.columns, params)]
+
+
+def subset_draws(samples: pd.DataFrame, chains: list = None,
+                 thin: int = None) -> pd.DataFrame:
+    """Some of the chains and draws of a samples dataframe.
+
+    Args:
+        samples (pd.DataFrame): The samples, one row per draw.
+        chains (list, optional): Only keep these chains (all by default).
+        thin (int, optional): Only keep every `thin`-th draw of each chain.
+
+    Returns:
+        pd.DataFrame: The kept samples.
+    """
+    if chains is not None and 'chain' in samples:
+        samples = samples[samples['chain'].isin(chains)]
+    if thin and thin > 1:
+        if 'chain' in samples:
+            positions = samples.groupby('chain').cumcount().to_numpy()
+        else:
+            positions = np.arange(len(samples))
+        samples = samples[thinned_draws(positions, thin)]
     return samples
 
 
+def thinned_draws(positions: np.ndarray, thin: int = None) -> np.ndarray:
+    """Which draws are kept when thinning, for all fit formats alike.
+
+    The first draw of each chain and every `thin`-th one after it are kept.
+
+    Args:
+        positions (np.ndarray): The position of each draw within its chain
+                                (0 for the first draw of each chain).
+        thin (int, optional): Keep every `thin`-th draw (all by default).
+
+    Returns:
+        np.ndarray: True for the draws that are kept.
+    """
+    positions = np.asarray(positions)
+    if not thin or thin <= 1:
+        return np.ones(positions.shape, dtype=bool)
+    return positions % thin == 0
+
+
 def last_sample_as_dict(fit_path: str, model_path: str) -> dict:
     """Return the last sample of a fit as a dict.
 
@@ -272,6 +1105,191 @@ def last_sample_as_dict(fit_path: str, model_path: str) -> dict:
     Returns:
         dict: Parameter:value pairs from the last sample of the given fit.
     """
+    if Path(fit_path).suffix == '.draws':
+        draws = load_draws(fit_path)
+        return {key: np.array(value[-1, -1]) for key, value in draws.items()
+                if key not in DRAWS_INDEX and not key.endswith('__')
+                or key == 'lp__'}
     fit = load_fit(fit_path, model_path)
     last = {key: value[-1] for key, value in fit.extract().items()}
     return last
+
+
+# Columns of a fit's dataframe that are not parameters
+DRAWS_INDEX = ['chain', 'draw', 'warmup']
+# Name of the file describing a draws store
+DRAWS_META = 'meta.json'
+# A column for one element of a parameter, e.g. 'lambda[3,0]'
+FLAT_NAME = re.compile(r'^(.+)\[([0-9,]+)\]$')
+
+
+def save_draws(samples: pd.DataFrame, path: str, **meta) -> Path:
+    """Save the draws of a fit as a draws store (fit format 2).
+
+    The store is a directory with one .npy file per parameter (and per
+    sampler diagnostic, e.g. lp__ or divergent__), shaped chains x draws x
+    the shape of the parameter, and a meta.json file describing them.
+    Parameters can then be read one at a time, memory-mapped, without
+    pystan or the compiled model.
+
+    Args:
+        samples (pd.DataFrame): The draws, as from `StanFit4model.to_dataframe`
+                                (one row per draw, a 'chain' column and
+                                columns like 'lambda[0,1]').
+        path (str): The store, e.g. fits/SICRLMQ_US_MI.draws.
+        meta: Other details to keep in meta.json, e.g. model_name.
+
+    Returns:
+        Path: The store.
+    """
+    path = Path(path)
+    if 'chain' in samples:
+        samples = samples.sort_values('chain', kind='stable')
+        n_chains = samples['chain'].nunique()
+    else:
+        n_chains = 1
+    n_draws = len(samples) // n_chains
+    assert n_chains * n_draws == len(samples), \
+        "Chains of different lengths in %s" % path
+    params = {}
+    for column in samples:
+        name, index = _split_flat_name(column)
+        params.setdefault(name, []).append((index, column))
+    # Written under a name of this process' own and then renamed into place
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=path.name + '.',
+                                suffix='.tmp'))
+    shapes = {}
+    for name, items in params.items():
+        indices = [index for index, _ in items]
+        values = samples[[column for _, column in items]].to_numpy()
+        if not indices[0]:  # A scalar
+            shape = ()
+            draws = values[:, 0]
+        else:
+            shape = tuple(int(n) for n in np.max(indices, axis=0) + 1)
+            if len(indices) == int(np.prod(shape)):
+                draws = np.empty((len(samples),) + shape, dtype=values.dtype)
+            else:  # Some elements are missing
+                draws = np.full((len(samples),) + shape, np.nan)
+            draws[(slice(None),) + tuple(np.transpose(indices))] = values
+        np.save(tmp / ('%s.npy' % name),
+                draws.reshape((n_chains, n_draws) + shape))
+        shapes[name] = list(shape)
+    meta.update({'n_chains': n_chains, 'n_draws': n_draws, 'params': shapes,
+                 'columns': list(samples.columns)})
+    with open(tmp / DRAWS_META, 'w') as f:
+        json.dump(meta, f)
+    _replace_dir(tmp, path)
+    return path
+
+
+def _replace_dir(new: Path, path: Path) -> None:
+    """Put the directory `new` in the place of `path`.
+
+    The old directory is first renamed aside, so `path` is only missing for
+    the time between two renames (rather than while the old one is
+    deleted).  If another process puts its own directory in place at the
+    same time, one of them is kept and the other deleted.
+    """
+    old = Path(tempfile.mkdtemp(dir=path.parent, prefix=path.name + '.',
+                                suffix='.old'))
+    try:
+        os.replace(path, old)  # Replaces the empty directory made above
+    except FileNotFoundError:  # No previous store
+        pass
+    try:
+        os.replace(new, path)
+    except OSError:
+        if not path.is_dir():
+            raise
+        shutil.rmtree(new)  # Another process' store is already in place
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def read_draws_meta(path: str) -> dict:
+    """The meta.json of a draws store (see `save_draws`).
+
+    Args:
+        path (str): The store.
+
+    Returns:
+        dict: n_chains, n_draws, the shape of each parameter ('params'), the
+              columns of the draws as saved ('columns'), and anything else
+              given to `save_draws`.
+    """
+    with open(Path(path) / DRAWS_META) as f:
+        return json.load(f)
+
+
+def load_draws(path: str, params: list = None) -> dict:
+    """Read parameters from a draws store (see `save_draws`).
+
+    Args:
+        path (str): The store.
+        params (list, optional): Parameters to read, e.g. ['R0', 'llx']
+                                 (all of them by default).  Those not in
+                                 the store are left out.
+
+    Returns:
+        dict: Parameter: its draws, memory-mapped and shaped chains x draws
+              x the shape of the parameter.
+    """
+    shapes = read_draws_meta(path)['params']
+    if params is None:
+        params = list(shapes)
+    return {name: np.load(Path(path) / ('%s.npy' % name), mmap_mode='r')
+            for name in params if name in shapes}
+
+
+def draws_to_dataframe(path: str, params: list = None, chains: list = None,
+                       thin: int = None) -> pd.DataFrame:
+    """Read a draws store (see `save_draws`) into a dataframe like that of
+    `StanFit4model.to_dataframe`, with one column per element of each
+    parameter.
+
+    Args:
+        path (str): The store.
+        params (list, optional): Parameters to read, as for
+                                 `select_sample_columns` (all of them by
+                                 default).
+        chains (list, optional): Only read these chains.
+        thin (int, optional): Only read every `thin`-th draw of each chain.
+
+    Returns:
+        pd.DataFrame: The draws, one row per draw.
+    """
+    meta = read_draws_meta(path)
+    columns = meta['columns']
+    if params is not None:
+        columns = select_sample_columns(columns, params)
+    draws = load_draws(path, {_split_flat_name(column)[0]
+                              for column in columns} | {'chain'})
+    chain_axis = np.arange(meta['n_chains'])
+    if chains is not None and 'chain' in draws:
+        chain_axis = np.flatnonzero(np.isin(draws['chain'][:, 0], chains))
+    draw_axis = np.flatnonzero(thinned_draws(np.arange(meta['n_draws']),
+                                             thin))
+    axes = np.ix_(chain_axis, draw_axis)
+    elements = {}
+    for column in columns:
+        name, index = _split_flat_name(column)
+        elements.setdefault(name, []).append((index, column))
+    dfs = []
+    for name, items in elements.items():
+        values = np.asarray(draws[name][axes])
+        shape = values.shape
+        values = values.reshape(shape[0] * shape[1], -1)
+        positions = [np.ravel_multi_index(index, shape[2:]) if index else 0
+                     for index, _ in items]
+        dfs.append(pd.DataFrame(values[:, positions],
+                                columns=[column for _, column in items]))
+    return pd.concat(dfs, axis=1)[columns]
+
+
+def _split_flat_name(column: str) -> tuple:
+    """The parameter and index of a column, e.g. ('lambda', (3, 0))."""
+    match = FLAT_NAME.match(column)
+    if match is None:
+        return column, ()
+    return match.group(1), tuple(int(i) for i in match.group(2).split(','))
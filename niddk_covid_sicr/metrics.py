@@ -0,0 +1,159 @@
+"""Instrumentation of the data ingest pipeline.
+
+Each stage of the work (a download, parsing a source, writing a region's
+file, a cleaning step, ...) adds a record with its wall time and the bytes
+downloaded, rows parsed and files written.  Once metrics are turned on with
+`configure`, the totals of each stage are kept for `summary` and, if a path
+is set, the records are also appended to a JSON lines file so that runs can
+be compared over time.
+"""
+
+import atexit
+from contextlib import contextmanager
+from datetime import datetime
+import json
+from pathlib import Path
+import threading
+import time
+
+# Counters kept by every record
+METRICS_COUNTERS = ['seconds', 'bytes', 'rows', 'files']
+METRICS_OPTIONS = {'path': None, 'run': None}
+# Records written to the JSON lines file at a time
+METRICS_FLUSH_RECORDS = 1000
+
+_totals = {}  # Stage: the totals for `summary`
+_rois = {}  # Stage: regions it was done for
+_pending = []  # Records not yet written to the file
+_lock = threading.Lock()
+
+
+def configure(path: str = None, run: str = None) -> None:
+    """Turn metrics on and start a new run of records.
+
+    Args:
+        path (str, optional): JSON lines file that records are appended to
+                              (none if not given).
+        run (str, optional): Identifies the run in each record.  Defaults
+                             to the current time.
+    """
+    flush()
+    METRICS_OPTIONS['path'] = Path(path) if path else None
+    METRICS_OPTIONS['run'] = run or datetime.now().isoformat(timespec='seconds')
+    if METRICS_OPTIONS['path'] is not None:
+        METRICS_OPTIONS['path'].parent.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        _totals.clear()
+        _rois.clear()
+
+
+def record(stage: str, roi: str = None, **fields) -> dict:
+    """Add one record.
+
+    Nothing is kept until metrics are turned on with `configure`.
+
+    Args:
+        stage (str): What was done, e.g. 'download' or 'fix_negatives'.
+        roi (str, optional): The region it was done for, if any.
+        fields: Counters (see METRICS_COUNTERS) and any other details,
+                e.g. url or source.
+
+    Returns:
+        dict: The record.
+    """
+    entry = {'run': METRICS_OPTIONS['run'], 'stage': stage}
+    if roi is not None:
+        entry['roi'] = roi
+    entry.update(dict.fromkeys(METRICS_COUNTERS, 0))
+    entry.update(fields)
+    if METRICS_OPTIONS['run'] is None:
+        return entry
+    with _lock:
+        total = _totals.setdefault(stage, dict(
+            {'stage': stage, 'count': 0, 'regions': 0},
+            **dict.fromkeys(METRICS_COUNTERS, 0)))
+        total['count'] += 1
+        for counter in METRICS_COUNTERS:
+            total[counter] += entry.get(counter) or 0
+        if roi is not None:
+            _rois.setdefault(stage, set()).add(roi)
+        if METRICS_OPTIONS['path'] is not None:
+            _pending.append(entry)
+            if len(_pending) >= METRICS_FLUSH_RECORDS:
+                _write_pending()
+    return entry
+
+
+def flush() -> None:
+    """Write the records not yet written to the JSON lines file."""
+    with _lock:
+        _write_pending()
+
+
+def _write_pending() -> None:
+    """Append the pending records to the file (with the lock held)."""
+    if _pending and METRICS_OPTIONS['path'] is not None:
+        with open(METRICS_OPTIONS['path'], 'a') as f:
+            f.writelines(json.dumps(entry, default=str) + '\n'
+                         for entry in _pending)
+    _pending.clear()
+
+
+atexit.register(flush)
+
+
+@contextmanager
+def stage(name: str, roi: str = None, **fields):
+    """Time a block of work and add a record for it when it is done.
+
+    The block can add to the counters in the dict it is given, e.g.
+    `counters['rows'] += len(df)`.
+
+    Args:
+        name (str): What is done, e.g. 'parse'.
+        roi (str, optional): The region it is done for, if any.
+        fields: Other details for the record.
+
+    Yields:
+        dict: The counters (bytes, rows and files) of the record.
+    """
+    counters = dict.fromkeys(METRICS_COUNTERS[1:], 0)
+    counters.update(fields)
+    start = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        record(name, roi, seconds=time.perf_counter() - start, **counters)
+
+
+def summary() -> list:
+    """Totals of the current run for each stage.
+
+    The records so far are also written to the JSON lines file.
+
+    Returns:
+        list: One dict per stage (in order of first appearance) with the
+              stage, the number of records and regions, and the sum of each
+              counter.  Seconds are summed over records, so stages done in
+              parallel can add up to more than the elapsed time.
+    """
+    flush()
+    with _lock:
+        totals = [dict(total, regions=len(_rois.get(name, ())))
+                  for name, total in _totals.items()]
+    return totals
+
+
+def print_summary() -> None:
+    """Print a table of `summary`."""
+    rows = summary()
+    if not rows:
+        return
+    width = max(len('stage'), max(len(row['stage']) for row in rows))
+    print("%-*s %7s %7s %10s %12s %10s %7s" % (
+        width, 'stage', 'count', 'regions', 'seconds', 'bytes', 'rows',
+        'files'))
+    for row in rows:
+        print("%-*s %7d %7d %10.3f %12d %10d %7d" % (
+            width, row['stage'], row['count'], row['regions'],
+            row['seconds'], row['bytes'], row['rows'], row['files']))
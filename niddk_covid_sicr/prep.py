@@ -1,24 +1,36 @@
-from datetime import datetime, timedelta, date
+from datetime import timedelta, date
 import calendar
 import numpy as np
 import math
 from numpy.random import gamma, exponential, lognormal,normal
+import os
 import pandas as pd
 from pathlib import Path
 import sys
+import tempfile
 import niddk_covid_sicr as ncs
+from .dates import DAY_ZERO, format_days, parse_date_arg
+from .fetch import fingerprint
+from .io import (file_hash, get_region_value, get_timeseries_file,
+                 read_timeseries)
+
+# Columns of the time-series data used to prepare the stan data
+DAILY_COLUMNS = ['new_cases', 'new_recover', 'new_deaths']
+WEEKLY_COLUMNS = ['cum_cases', 'cum_recover', 'cum_deaths', 'new_cases',
+                  'new_recover', 'new_deaths', 'population']
+# Directory (under the data path) of the cached stan data
+STAN_DATA_CACHE = Path('.cache') / 'stan_data'
+# Options that change the stan data prepared from a region's data
+STAN_DATA_ARGS = ['last_date', 'first_last_date', 'totwk', 'fixed_t']
+# Version of the preparation of the stan data, part of its key in the cache;
+# increase it whenever get_stan_data or the weekly totals change
+STAN_DATA_VERSION = 1
+
 
 def get_stan_data(full_data_path, args):
-    df = pd.read_csv(full_data_path)
+    df = read_timeseries(full_data_path, columns=DAILY_COLUMNS)
     if getattr(args, 'last_date', None):
-        try:
-            datetime.strptime(args.last_date, '%m/%d/%y')
-        except ValueError:
-            msg = "Incorrect --last-date format, should be MM/DD/YY"
-            raise ValueError(msg)
-        else:
-            end = df[df['dates2'] == args.last_date].index.values[0]
-            df = df.iloc[:end+1]
+        df = df[df['day'] <= parse_date_arg(args.last_date)]
     # t0 := where to start time series, index space
     try:
         t0 = np.where(df["new_cases"].values >= 5)[0][0]
@@ -46,9 +58,7 @@ def get_stan_data(full_data_path, args):
     stan_data['n_weeks'] = math.floor((len(df['dates2']) - t0)/7)
     stan_data['n_total'] = len(df['dates2']) - t0 + n_proj
     if args.fixed_t:
-        global_start = datetime.strptime('01/22/20', '%m/%d/%y')
-        frame_start = datetime.strptime(df['dates2'][0], '%m/%d/%y')
-        offset = (frame_start - global_start).days
+        offset = df['day'].iloc[0]  # Days since 01/22/20
         stan_data['tm'] += offset
         stan_data['ts'] += offset
     return stan_data, df['dates2'][t0], stan_data['n_weeks']
@@ -57,117 +67,485 @@ def get_stan_data_weekly_total(full_data_path, args):
     """ Get weekly totals for new cases, recoveries,
         and deaths from timeseries data.
     """
-    df = pd.read_csv(full_data_path)
+    df = read_weekly_data(full_data_path, args)
+    days, new, cum, first, last, offsets = stack_regions([df])
+    weeks, totals, valid = weekly_totals(days, new, cum, first, last,
+                                         index_offset=offsets)
+    return weekly_stan_data(df, weeks, totals, valid, args,
+                            roi=getattr(args, 'roi', None))
+
+
+def get_stan_data_weekly_totals(full_data_paths: dict, args) -> dict:
+    """Weekly stan data (see `get_stan_data_weekly_total`) for many regions,
+    with the weekly totals of all of them computed in one call of
+    `weekly_totals`.
+
+    Args:
+        full_data_paths (dict): Region: path to its time-series data.
+        args: Options, as for `get_stan_data_weekly_total`.
+
+    Returns:
+        dict: Region: (stan_data, t0, n_weeks).
+    """
+    dfs = [read_weekly_data(path, args) for path in full_data_paths.values()]
+    days, new, cum, first, last, offsets = stack_regions(dfs)
+    weeks, totals, valid = weekly_totals(days, new, cum, first, last,
+                                         index_offset=offsets)
+    return {roi: weekly_stan_data(df, weeks, totals[[i]], valid[[i]], args,
+                                  roi=roi)
+            for i, (roi, df) in enumerate(zip(full_data_paths, dfs))}
+
+
+def read_weekly_data(full_data_path, args) -> pd.DataFrame:
+    """Read the time-series data used for the weekly stan data, limited to
+    the dates in `args.last_date` and `args.first_last_date`."""
+    df = read_timeseries(full_data_path, columns=WEEKLY_COLUMNS)
     if getattr(args, 'last_date', None):
-        try:
-            datetime.strptime(args.last_date, '%m/%d/%y')
-        except ValueError:
-            msg = "Incorrect --last-date format, should be MM/DD/YY"
-            raise ValueError(msg)
-        else:
-            df = df[df['dates2'] <= args.last_date]
+        df = df[df['day'] <= parse_date_arg(args.last_date)]
 
     if getattr(args, 'first_last_date', None):
         try:
             date_range = args.first_last_date.split(" ") # split on whitespace
-            test_start = datetime.strptime(date_range[0], '%m/%d/%y') # make sure its formatted correctly
-            test_end_date = datetime.strptime(date_range[1], '%m/%d/%y')
             start_date = date_range[0]
             end_date = date_range[1]
+            start_day = parse_date_arg(start_date) # make sure its formatted correctly
+            end_day = parse_date_arg(end_date)
 
-        except ValueError:
+        except (ValueError, IndexError):
             msg = """Incorrect --first_last_date format, should be MM/DD/YY
             MM/DD/YY where first date is start date, followed by a whitespace,
             followed by last date"""
             raise ValueError(msg)
         else:
             try: # check if start_date exists
-                start = df[df['dates2'] == start_date].index.values[0]
+                start = df[df['day'] == start_day].index.values[0]
             except:
                 start = 0
                 print("Start date of {} not found in time-series. "
                      "Using first date found instead: {}".format(start_date, df['dates2'][0]))
             try: # check if end_date exists
-                end = df[df['dates2'] == end_date].index.values[0]
+                end = df[df['day'] == end_day].index.values[0]
             except:
                 end = len(df)-1
                 print("End date of {} not found in time-series. "
                      "Using last date found instead: {}".format(end_date, df['dates2'][end]))
 
             df = df.iloc[start:end]
+    return df
+
+
+def stack_regions(dfs: list) -> tuple:
+    """Arrange the data of several regions on a common axis of days, as
+    needed by `weekly_totals`.
+
+    Args:
+        dfs (list): Each region's data (from `read_weekly_data`).
+
+    Returns:
+        tuple: The arguments of `weekly_totals`: days, new, cum, first,
+               last and index_offset.
+    """
+    kinds = ['cases', 'recover', 'deaths']
+    first_day = min(df['day'].iloc[0] for df in dfs)
+    last_day = max(df['day'].iloc[-1] for df in dfs)
+    days = np.arange(first_day, last_day + 1)
+    new = np.full((len(dfs), len(days), len(kinds)), np.nan)
+    cum = np.full_like(new, np.nan)
+    for i, df in enumerate(dfs):
+        columns = df['day'].to_numpy() - first_day
+        for k, kind in enumerate(kinds):
+            for array, name in [(new, 'new_%s' % kind), (cum, 'cum_%s' % kind)]:
+                if name in df:
+                    array[i, columns, k] = df[name].to_numpy(dtype=float)
+    first = np.array([df['day'].iloc[0] - first_day for df in dfs])
+    last = np.array([df['day'].iloc[-1] - first_day for df in dfs])
+    # Row labels of the first day (not 0 after --first-last-date)
+    offsets = np.array([df.index[0] for df in dfs])
+    return days, new, cum, first, last, offsets
+
+
+def weekly_totals(days, new, cum, first, last, index_offset=None) -> tuple:
+    """Weekly totals (weeks ending on Saturdays) for many regions at once.
+
+    Days with missing data (-1 or NaN) count as 0.  Where a cumulative count
+    is back to 0 after its first positive value, that day's new count is
+    taken as missing, and if it is never positive all of them are.  Weekly
+    recovery totals of 0 become -1 (no data), and all totals are at least
+    -1.  Only weeks that end within each region's data are used.
+
+    Args:
+        days (np.ndarray): Consecutive days (since DAY_ZERO), n_days long.
+        new (np.ndarray): Daily new cases, recoveries and deaths, shaped
+                          (n_regions, n_days, 3).
+        cum (np.ndarray): The cumulative counts, shaped like `new`.
+        first (np.ndarray): Index (in `days`) of each region's first day.
+        last (np.ndarray): Index (in `days`) of each region's last day.
+        index_offset (np.ndarray, optional): Added to each region's row
+                                             number before comparing it to
+                                             that of its first positive
+                                             cumulative count.
+
+    Returns:
+        tuple: The Saturdays ending each week (days since DAY_ZERO, n_weeks
+               long), the weekly totals (ints shaped (n_regions, n_weeks,
+               3)) and which weeks each region has (bools shaped
+               (n_regions, n_weeks)).
+    """
+    days = np.asarray(days)
+    new = np.array(new, dtype=float)
+    cum = np.asarray(cum, dtype=float)
+    first = np.asarray(first)
+    last = np.asarray(last)
+    n_regions, n_days, n_kinds = new.shape
+    if index_offset is None:
+        index_offset = np.zeros(n_regions, dtype=int)
+    columns = np.arange(n_days)
+    in_range = (columns >= first[:, None]) & (columns <= last[:, None])
+    rows = columns - first[:, None] + np.asarray(index_offset)[:, None]
+
+    # Missing data crops up as 0 in the cumulative values
+    positive = (cum > 0) & in_range[:, :, None]
+    has_positive = positive.any(axis=1)
+    start = positive.argmax(axis=1) - first[:, None]
+    new[(cum == 0) & (rows[:, :, None] > start[:, None, :])] = -1
+    new[~has_positive[:, None, :] & in_range[:, :, None]] = -1
+    values = np.where((new == -1) | np.isnan(new) | ~in_range[:, :, None],
+                      0, new)
+
+    # Pad to whole weeks (Sunday to Saturday) and sum each of them
+    lead = (days[0] + DAY_ZERO.dayofweek + 1) % 7  # Days since Sunday
+    n_weeks = -(-(lead + n_days) // 7)
+    padded = np.zeros((n_regions, n_weeks * 7, n_kinds))
+    padded[:, lead:lead + n_days] = values
+    totals = padded.reshape(n_regions, n_weeks, 7, n_kinds).sum(axis=2)
+    totals = totals.astype(int)
+    weeks = days[0] - lead + 6 + 7 * np.arange(n_weeks)
+    valid = (weeks >= days[first][:, None]) & (weeks <= days[last][:, None])
+
+    recover = totals[:, :, 1]
+    recover[recover == 0] = -1 # No recovery data
+    totals = np.maximum(totals, -1) # handle negatives by setting to -1
+    return weeks, totals, valid
+
+
+def weekly_stan_data(df: pd.DataFrame, weeks, totals, valid, args,
+                     roi: str = None) -> tuple:
+    """Stan data for one region from its weekly totals.
+
+    Args:
+        df (pd.DataFrame): The region's data (from `read_weekly_data`).
+        weeks, totals, valid: The region's `weekly_totals` (for a single
+                              region).
+        args: Options, as for `get_stan_data_weekly_total`.
+        roi (str, optional): The region, for the mitigation prior.
+
+    Returns:
+        tuple: stan_data, t0 and n_weeks, as for
+               `get_stan_data_weekly_total`.
+    """
+    weekly_days = weeks[valid[0]]
+    y = totals[0][valid[0]]
+    t0 = np.where(y[:, 0] > 0)[0][0]
 
     n_proj = 0
     stan_data = {}
-    for kind in ['cases', 'deaths', 'recover']: # find where missing data crops
-                                    # up in cumulative values and set to -1
-        try:
-            start_data = np.where(df["cum_%s" % kind].values > 0)[0][0]
-            df['new_%s' % kind] = np.where(((df['cum_%s' % kind] == 0) & ((df.index > start_data))), -1, df['new_%s' % kind])
-        except: # if data is preset to -1 indicating no data already (from CTP archived data)
-            df['new_%s' % kind] = -1 # keep it at -1
-
-    df['Datetime'] = pd.to_datetime(df.loc[:, 'dates2']) # used to calculate leading week
-    df.set_index('Datetime', inplace=True) # need this for df.resample()
-
-    df = df.replace(-1, np.nan)# Set -1 to NaNs to handle no data during summing
-    df['weeklytotal_new_cases'] = df.new_cases.resample('W-SAT').sum()
-    df['weeklytotal_new_recover'] = df.new_recover.resample('W-SAT').sum()
-    df['weeklytotal_new_deaths'] = df.new_deaths.resample('W-SAT').sum()
-
-    # Create datetime index with range to exclude days that spill over weekly chunks
-    weekly_index = pd.date_range(start=df.index[0], end=df.index[-1], freq='W-SAT')
-    df = df.reindex(weekly_index)
-
-    df.weeklytotal_new_cases = df.weeklytotal_new_cases.astype(int) # convert float to int
-    df.weeklytotal_new_recover = df.weeklytotal_new_recover.astype(int)
-    df.weeklytotal_new_deaths = df.weeklytotal_new_deaths.astype(int)
-
-    df = df.replace({'weeklytotal_new_recover': 0}, -1) # NaNs became zeros
-    # handle negatives by setting to -1
-    df['weeklytotal_new_cases'] = df['weeklytotal_new_cases'].clip(lower=-1)
-    df['weeklytotal_new_recover'] = df['weeklytotal_new_recover'].clip(lower=-1)
-    df['weeklytotal_new_deaths'] = df['weeklytotal_new_deaths'].clip(lower=-1)
-
-    df.reset_index(inplace=True) # reset index
-    t0 = np.where(df["weeklytotal_new_cases"].values > 0)[0][0]
-
-    if df.loc[0 ,"dates2"] == 0: # handle cases where this did not get removed
-        df.drop([0], inplace=True)
-        df.reset_index(inplace=True)
     # tm := start of mitigation, index space
-
-    try:
-        dfm = pd.read_csv(args.data_path / 'mitigationprior.csv')
-        tmdate = dfm.loc[dfm.region == args.roi, 'date'].values[0]
-        tm = np.where(df["dates2"] == tmdate)[0][0]
-    except Exception:
+    tm = np.where(weekly_days == get_region_value(args.data_path, 'mitigation',
+                                                  roi))[0]
+    if len(tm):
+        tm = tm[0]
+    else:
         # print("Could not use mitigation prior data; setting mitigation prior to default.")
         tm = t0 + 10
 
     try: # Get population estimate for roi
-        population = df['population'].iloc[0]
+        population = df.loc[df['day'] == weekly_days[0], 'population'].iloc[0]
         stan_data['N'] = int(population)
     except:
-        if args.roi:
-            print("Could not get population estimate for {}.".format(args.roi))
+        if roi:
+            print("Could not get population estimate for {}.".format(roi))
         else:
             print("Could not get population estimate.")
 
     stan_data['n_ostates'] = 3
     stan_data['tm'] = tm
-    stan_data['ts'] = np.arange(t0, len(df['dates2']) + n_proj)
-    stan_data['y'] = df[['weeklytotal_new_cases', 'weeklytotal_new_recover',
-                    'weeklytotal_new_deaths']].to_numpy().astype(int)[t0:, :]
-    stan_data['n_obs'] = len(df['dates2']) - t0
-    stan_data['n_weeks'] = len(df['dates2']) - t0
-    stan_data['n_total'] = len(df['dates2']) - t0 + n_proj
+    stan_data['ts'] = np.arange(t0, len(weekly_days) + n_proj)
+    stan_data['y'] = y[t0:, :]
+    stan_data['n_obs'] = len(weekly_days) - t0
+    stan_data['n_weeks'] = len(weekly_days) - t0
+    stan_data['n_total'] = len(weekly_days) - t0 + n_proj
     if args.fixed_t:
-        global_start = datetime.strptime('01/22/20', '%m/%d/%y')
-        frame_start = datetime.strptime(df.loc[t0 ,"dates2"], '%m/%d/%y')
-        offset = math.floor((frame_start - global_start).days/7)
+        offset = weekly_days[t0] // 7  # Weeks since 01/22/20
         stan_data['tm'] += offset
         stan_data['ts'] += offset
-    return stan_data, df['dates2'][t0], stan_data['n_weeks']
+    return stan_data, format_days(weekly_days[t0:t0 + 1])[0], \
+        stan_data['n_weeks']
+
+
+def get_stan_data_ragged(full_data_paths: dict, args) -> tuple:
+    """Weekly stan data for many regions packed into flat (ragged) arrays,
+    for a model that fits all of them at once (there is none in models/
+    yet; `unpack_stan_data` gives each region's data for the current
+    single-region models).
+
+    The weekly totals of all regions are computed in one call of
+    `weekly_totals`, and each region's weeks from its t0 on are then taken
+    from them in one pass.  Region i's rows are
+    y[start[i] - 1:start[i] - 1 + n_weeks[i]] (i.e. `segment(y, start[i],
+    n_weeks[i])` in Stan), and likewise for ts.  Regions with no week of new
+    cases or no population estimate are left out (and reported).
+
+    Args:
+        full_data_paths (dict): Region: path to its time-series data.
+        args: Options, as for `get_stan_data_weekly_total`.
+
+    Returns:
+        tuple: The stan data and the regions in it (in order).  The stan
+               data has n_regions, n_ostates, n_obs (all weeks of all
+               regions), y (n_obs x 3), ts (n_obs), and for each region
+               n_weeks, start (1-based row of its first week), N, tm and t0
+               (its first week, in weeks since 01/22/20).
+    """
+    rois = list(full_data_paths)
+    dfs = [read_weekly_data(path, args) for path in full_data_paths.values()]
+    days, new, cum, first, last, offsets = stack_regions(dfs)
+    weeks, totals, valid = weekly_totals(days, new, cum, first, last,
+                                         index_offset=offsets)
+    first_week = valid.argmax(axis=1)
+    has_cases = valid & (totals[:, :, 0] > 0)
+    t0 = has_cases.argmax(axis=1)
+    # As in `weekly_stan_data`, or from population_estimates.csv
+    population = np.array([
+        df['population'].to_numpy()[df['day'].to_numpy() == weeks[i]][:1].sum()
+        if 'population' in df
+        else get_region_value(args.data_path, 'population', roi, 0)
+        for roi, df, i in zip(rois, dfs, first_week)])
+    keep = has_cases.any(axis=1) & (population > 0)
+    for roi, has, n in zip(rois, has_cases.any(axis=1), population):
+        if not has:
+            print("No week of new cases for %s; leaving it out." % roi)
+        elif not n:
+            print("Could not get population estimate for %s; "
+                  "leaving it out." % roi)
+
+    rois = [roi for roi, k in zip(rois, keep) if k]
+    first_week, t0, population = first_week[keep], t0[keep], population[keep]
+    totals, valid = totals[keep], valid[keep]
+    used = valid & (np.arange(len(weeks)) >= t0[:, None])
+    region, week = np.nonzero(used)  # Ordered by region, then week
+    n_weeks = used.sum(axis=1)
+
+    # Index space within each region's weeks, as in `weekly_stan_data`
+    offset = weeks[t0] // 7 if args.fixed_t else np.zeros(len(rois), int)
+    tm_days = [get_region_value(args.data_path, 'mitigation', roi)
+               for roi in rois]
+    tm = np.array([np.flatnonzero(weeks == day)[:1].sum() if day in weeks
+                   else -1 for day in tm_days])
+    tm = np.where(tm >= 0, tm - first_week, t0 - first_week + 10)
+    stan_data = {'n_regions': len(rois),
+                 'n_ostates': 3,
+                 'n_obs': len(week),
+                 'n_weeks': n_weeks,
+                 'start': np.cumsum(n_weeks) - n_weeks + 1,
+                 'N': population.astype(int),
+                 'tm': tm + offset,
+                 't0': weeks[t0] // 7,
+                 'y': totals[region, week],
+                 'ts': week - first_week[region] + offset[region]}
+    return stan_data, rois
+
+
+def unpack_stan_data(ragged: dict, i: int) -> dict:
+    """One region's stan data from `get_stan_data_ragged`, in the form
+    given by `get_stan_data_weekly_total`.
+
+    Args:
+        ragged (dict): The stan data of many regions.
+        i (int): The region's position in the regions.
+
+    Returns:
+        dict: The region's stan data.
+    """
+    rows = slice(ragged['start'][i] - 1,
+                 ragged['start'][i] - 1 + ragged['n_weeks'][i])
+    n_weeks = int(ragged['n_weeks'][i])
+    return {'N': int(ragged['N'][i]),
+            'n_ostates': ragged['n_ostates'],
+            'tm': int(ragged['tm'][i]),
+            'ts': ragged['ts'][rows],
+            'y': ragged['y'][rows],
+            'n_obs': n_weeks,
+            'n_weeks': n_weeks,
+            'n_total': n_weeks}
+
+
+def load_stan_data(full_data_path, args, cache: bool = True) -> tuple:
+    """Stan data for one region, from `get_stan_data` or, if `args.totwk` is
+    set, `get_stan_data_weekly_total`.
+
+    The result is kept in a file under the data path (see
+    `STAN_DATA_CACHE`), and read from there the next time it is needed for
+    the same data and options (see `stan_data_key`), e.g. by each model fit
+    to the region.  There is one file per region and options, which is
+    replaced when the data changes.
+
+    Args:
+        full_data_path (str): Path to the region's .csv file.
+        args: Options, as for `get_stan_data` and
+              `get_stan_data_weekly_total`.
+        cache (bool, optional): Whether to use and update the cache.
+                                Defaults to True.
+
+    Returns:
+        tuple: stan_data, t0 and n_weeks, or three Nones if the region has
+               no data to fit.
+    """
+    roi = getattr(args, 'roi', None)
+    cache_file = _stan_data_file(full_data_path, args) if cache else None
+    key = stan_data_key(full_data_path, args, roi) if cache else None
+    result = read_cached_stan_data(cache_file, key)
+    if result is None:
+        if getattr(args, 'totwk', 0):
+            result = get_stan_data_weekly_total(full_data_path, args)
+        else:
+            result = get_stan_data(full_data_path, args)
+        if result[0] is None:
+            return None, None, None
+        write_cached_stan_data(cache_file, *result, key=key)
+    return result
+
+
+def load_stan_data_many(full_data_paths: dict, args,
+                        cache: bool = True) -> dict:
+    """Stan data for many regions (see `load_stan_data`).  The weekly
+    totals of the regions that are not cached are computed in one call of
+    `get_stan_data_weekly_totals`.
+
+    Args:
+        full_data_paths (dict): Region: path to its .csv file.
+        args: Options, as for `load_stan_data`.
+        cache (bool, optional): Whether to use and update the cache.
+                                Defaults to True.
+
+    Returns:
+        dict: Region: (stan_data, t0, n_weeks).
+    """
+    results = {}
+    cache_files = {}
+    keys = {}
+    for roi, path in full_data_paths.items():
+        cache_files[roi] = _stan_data_file(path, args) if cache else None
+        keys[roi] = stan_data_key(path, args, roi) if cache else None
+        result = read_cached_stan_data(cache_files[roi], keys[roi])
+        if result is not None:
+            results[roi] = result
+    missing = {roi: path for roi, path in full_data_paths.items()
+               if roi not in results}
+    if getattr(args, 'totwk', 0):
+        computed = get_stan_data_weekly_totals(missing, args) \
+            if missing else {}
+    else:
+        computed = {roi: get_stan_data(path, args)
+                    for roi, path in missing.items()}
+    for roi, result in computed.items():
+        if result[0] is None:
+            result = None, None, None
+        else:
+            write_cached_stan_data(cache_files[roi], *result, key=keys[roi])
+        results[roi] = result
+    return {roi: results[roi] for roi in full_data_paths}
+
+
+def stan_data_key(full_data_path, args, roi: str = None) -> str:
+    """The key of a region's stan data in the cache.
+
+    It is a hash of `STAN_DATA_VERSION`, the region's data (from the store
+    or the .csv file, whichever `read_timeseries` would use) and the
+    options in `STAN_DATA_ARGS`, and for weekly totals also of the region
+    and mitigationprior.csv, which give the start of mitigation.
+
+    Args:
+        full_data_path (str): Path to the region's .csv file.
+        args: Options, as for `load_stan_data`.
+        roi (str, optional): The region.
+
+    Returns:
+        str: A hex digest.
+    """
+    parts = [STAN_DATA_VERSION,
+             file_hash(get_timeseries_file(full_data_path))]
+    parts += [getattr(args, name, None) for name in STAN_DATA_ARGS]
+    if getattr(args, 'totwk', 0):
+        parts += [roi, file_hash(Path(args.data_path) / 'mitigationprior.csv')]
+    return fingerprint(*parts)
+
+
+def _stan_data_file(full_data_path, args) -> Path:
+    """The cache file for a region's stan data with these options, which
+    holds the stan data of only the last data (and version) it was
+    prepared from."""
+    options = fingerprint(*[getattr(args, name, None)
+                            for name in STAN_DATA_ARGS])
+    return Path(full_data_path).parent / STAN_DATA_CACHE / \
+        ('%s.%s.npz' % (Path(full_data_path).stem, options[:16]))
+
+
+def read_cached_stan_data(cache_file: Path, key: str = None) -> tuple:
+    """Read stan data written by `write_cached_stan_data`.
+
+    Args:
+        cache_file (Path): The file (or None).
+        key (str, optional): Only read the stan data if it was written with
+                             this key (see `stan_data_key`).
+
+    Returns:
+        tuple: stan_data, t0 and n_weeks, or None if the file is missing,
+               has another key or cannot be read.
+    """
+    if cache_file is None or not cache_file.is_file():
+        return None
+    try:
+        with np.load(cache_file) as f:
+            stan_data = dict(f.items())
+    except Exception:  # Incomplete or from another version
+        return None
+    for name, value in stan_data.items():
+        if value.ndim == 0:  # Numbers (and t0) are saved as 0-d arrays
+            stan_data[name] = value.item()
+    if stan_data.pop('_key', None) != (key or ''):  # Of other data
+        return None
+    t0 = stan_data.pop('_t0')
+    return stan_data, t0, stan_data['n_weeks']
+
+
+def write_cached_stan_data(cache_file: Path, stan_data: dict, t0: str,
+                           n_weeks: int, key: str = None) -> None:
+    """Write stan data to a cache file (as arrays in a .npz file).
+
+    The file is written under a temporary name and then renamed, so that
+    other processes never read a partly written file.  This replaces the
+    stan data of older data in the file.
+
+    Args:
+        cache_file (Path): The file (or None, to write nothing).
+        stan_data (dict): The stan data.
+        t0 (str): The first date of the data that is used.
+        n_weeks (int): The number of weeks of data.
+        key (str, optional): The key of the stan data (see
+                             `stan_data_key`).
+    """
+    if cache_file is None:
+        return
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_file.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, _t0=t0, _key=key or '', **stan_data)
+        os.replace(tmp, cache_file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
 
 def get_n_data(stan_data):
     if stan_data:
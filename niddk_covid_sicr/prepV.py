@@ -1,23 +1,17 @@
-from datetime import datetime
 import numpy as np
 from numpy.random import gamma, exponential, lognormal,normal
-import pandas as pd
 from pathlib import Path
 import sys
 
 import niddk_covid_sicr as ncs
+from .dates import parse_date_arg
+from .io import get_region_value, read_timeseries
 
 
 def get_stan_dataV(full_data_path, args):
-    df = pd.read_csv(full_data_path)
+    df = read_timeseries(full_data_path)
     if getattr(args, 'last_date', None):
-        try:
-            datetime.strptime(args.last_date, '%m/%d/%y')
-        except ValueError:
-            msg = "Incorrect --last-date format, should be MM/DD/YY"
-            raise ValueError(msg)
-        else:
-            df = df[df['dates2'] <= args.last_date]
+        df = df[df['day'] <= parse_date_arg(args.last_date)]
 
     # t0 := where to start time series, index space
     try:
@@ -26,11 +20,11 @@ def get_stan_dataV(full_data_path, args):
         return [None, None]
     # tm := start of mitigation, index space
 
-    try:
-        dfm = pd.read_csv(args.data_path / 'mitigationprior.csv')
-        tmdate = dfm.loc[dfm.region == args.roi, 'date'].values[0]
-        tm = np.where(df["dates2"] == tmdate)[0][0]
-    except Exception:
+    tm = np.where(df["day"] == get_region_value(args.data_path, 'mitigation',
+                                                args.roi))[0]
+    if len(tm):
+        tm = tm[0]
+    else:
         print("Could not use mitigation prior data; setting mitigation prior to default.")
         tm = t0 + 10
 
@@ -44,9 +38,7 @@ def get_stan_dataV(full_data_path, args):
     stan_data['n_obs'] = len(df['dates2']) - t0
     stan_data['n_total'] = len(df['dates2']) - t0 + n_proj
     if args.fixed_t:
-        global_start = datetime.strptime('01/22/20', '%m/%d/%y')
-        frame_start = datetime.strptime(df['dates2'][0], '%m/%d/%y')
-        offset = (frame_start - global_start).days
+        offset = df['day'].iloc[0]  # Days since 01/22/20
         stan_data['tm'] += offset
         stan_data['ts'] += offset
     return stan_data, df['dates2'][t0]
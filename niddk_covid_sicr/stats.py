@@ -16,8 +16,11 @@ def get_rhat(fit) -> float:
     """Get `rhat` for the log-probability of a fit.
 
     This is a measure of the convergence across sampling chains.
-    Good convergence is indicated by a value near 1.0.
+    Good convergence is indicated by a value near 1.0.  `fit` can also be
+    draws from a draws store (see `io.load_draws`).
     """
+    if isinstance(fit, dict):
+        return float(az.rhat(np.asarray(fit['lp__']), method='split'))
     x = _summary(fit, ['lp__'], [])
     summary = pd.DataFrame(x['summary'], columns=x['summary_colnames'], index=x['summary_rownames'])
     return summary.loc['lp__', 'Rhat']
@@ -65,14 +68,20 @@ def get_fit_quality(fit) -> dict:
     Leave One Out (LOO) from a fit instance using Arviz.
 
     Args:
-        fit: A PyStan4model instance (i.e. a PyStan fit).
+        fit: A PyStan4model instance (i.e. a PyStan fit), or draws from a
+             draws store with 'llx' and 'lp__' (see `io.load_draws`).
 
     Returns:
         dict: WAIC and LOO statistics (and se's) for this fit.
     """
     result = {}
     try:
-        idata = az.from_pystan(fit, log_likelihood="llx")
+        if isinstance(fit, dict):
+            idata = az.from_dict(
+                posterior={'lp__': np.asarray(fit['lp__'])},
+                log_likelihood={'llx': np.asarray(fit['llx'])})
+        else:
+            idata = az.from_pystan(fit, log_likelihood="llx")
     except KeyError as e:
         warn("'%s' not found; waic and loo will not be computed" % str(e),
              stacklevel=2)
@@ -107,7 +116,7 @@ def getllxtensor_singleroi(roi: str, data_path: str, fits_path: str,
         .astype(int)[t0:, :]
     # load samples
     samples = extract_samples(fits_path, models_path, model_name, roi,
-                              fit_format)
+                              fit_format, params=['lambda', 'phi', 'll_'])
     S = np.shape(samples['lambda[0,0]'])[0]
     # print(S)
     # get number of observations, check against data above
@@ -116,8 +125,6 @@ def getllxtensor_singleroi(roi: str, data_path: str, fits_path: str,
         if candidate in samples:
             N = i+1  # N observations, add 1 since index starts at 0
             break  # And move on
-    print(N)  # run using old data
-    print(len(y))
     llx = np.zeros((S, N, 3))
     # # conversion from Stan neg_binom2(n_stan | mu,phi)
     # to scipy.stats.nbinom(k,n_scipy,p)
@@ -132,9 +139,6 @@ def getllxtensor_singleroi(roi: str, data_path: str, fits_path: str,
             llx[i, j, 1] = np.log(nbinom.pmf(max(y[j, 1], 0), phi, phi/mu))
             mu = max(samples['lambda['+str(j)+',2]'][i], 1)
             llx[i, j, 2] = np.log(nbinom.pmf(max(y[j, 2], 0), phi, phi/mu))
-        print(np.sum(llx[i, :, :]))
-        print(samples['ll_'][i])
-        print('--')
     return llx
 
 def get_aic(d):
@@ -0,0 +1,113 @@
+"""Compare the grouped export used by `data.get_brazil` with the original
+loop, which scanned the whole national file once per state, on a synthetic
+national file."""
+
+import argparse
+import filecmp
+from pathlib import Path
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from niddk_covid_sicr import data
+
+# Parse all the command-line arguments
+parser = argparse.ArgumentParser(
+    description='Benchmark the export of the Brazilian state data')
+parser.add_argument('-dp', '--data-path', default='./data',
+                    help='Path to directory containing population_estimates.csv')
+parser.add_argument('-nd', '--n-days', type=int, default=1000,
+                    help='Number of days in the synthetic national file')
+parser.add_argument('-r', '--repeats', type=int, default=3,
+                    help='Number of times to time each implementation')
+parser.add_argument('-mw', '--max-workers', type=int, default=8,
+                    help='Number of files to write at once')
+args = parser.parse_args()
+
+
+def synthetic_national_file(n_days: int) -> pd.DataFrame:
+    """Random cumulative counts for every state (and the 'TOTAL' rows that
+    the real file also has), one row per state and date, ordered by date."""
+    rng = np.random.default_rng(0)
+    states = list(data.BRAZIL_STATES) + ['TOTAL']
+    dates = pd.date_range('2020-02-25', periods=n_days).strftime('%Y-%m-%d')
+    df = pd.DataFrame({'date': np.repeat(dates, len(states)),
+                       'state': np.tile(states, n_days)})
+    shape = (n_days, len(states))
+    for new, cum in [('newCases', 'totalCases'), ('newDeaths', 'deaths'),
+                     ('newRecovered', 'recovered')]:
+        counts = rng.poisson(100, size=shape)
+        df[new] = counts.ravel()
+        df[cum] = counts.cumsum(axis=0).ravel()
+    df.loc[rng.random(len(df)) < 0.01, 'recovered'] = np.nan
+    return df.drop('newRecovered', axis=1)
+
+
+def legacy_export(df_raw: pd.DataFrame, data_path: Path) -> None:
+    """The original `get_brazil` loop, after the download."""
+    population = data.get_population_index(args.data_path)
+    for state in data.BRAZIL_STATES:
+        source = df_raw[df_raw['state'] == state]
+        df = pd.DataFrame(columns=['dates2', 'cum_cases', 'cum_deaths',
+                                   'cum_recover', 'new_cases',
+                                   'new_deaths', 'new_recover',
+                                   'new_uninfected'])
+        df['dates2'] = data.owid_days(source['date'])
+        df['cum_cases'] = source['totalCases'].values
+        df['cum_deaths'] = source['deaths'].values
+        df['cum_recover'] = source['recovered'].values
+        df['new_cases'] = source['newCases'].values
+        df['new_deaths'] = source['newDeaths'].values
+        df['new_recover'] = df['cum_recover'].diff()
+        df['new_uninfected'] = df['new_recover'] + df['new_deaths']
+        roi = 'BR_' + data.BRAZIL_STATES[state]
+        if roi in population.index:
+            df['population'] = population[roi]
+        df.sort_values(by=['dates2'], inplace=True)
+        df['dates2'] = data.format_days(df['dates2'])
+        df = df.set_index('dates2').fillna(0).astype(int)
+        df.to_csv(data_path /
+                  ('covidtimeseries_BR_%s.csv' % data.BRAZIL_STATES[state]))
+
+
+def grouped_export(df_raw: pd.DataFrame, data_path: Path) -> None:
+    """The export done by `get_brazil`, after the download."""
+    df = data.add_population(data.brazil_timeseries(df_raw), args.data_path,
+                             desc='Brazilian states')
+    data.write_regions(df, data_path, desc='Brazilian States',
+                       max_workers=args.max_workers)
+
+
+def best_time(f, df_raw: pd.DataFrame, out_path: Path) -> float:
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        f(df_raw, out_path)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+df_raw = synthetic_national_file(args.n_days)
+tmp_path = Path(tempfile.mkdtemp())
+try:
+    legacy_path = tmp_path / 'legacy'
+    grouped_path = tmp_path / 'grouped'
+    legacy_path.mkdir()
+    grouped_path.mkdir()
+    legacy_time = best_time(legacy_export, df_raw, legacy_path)
+    grouped_time = best_time(grouped_export, df_raw, grouped_path)
+    names = sorted(csv.name for csv in legacy_path.iterdir())
+    _, mismatch, errors = filecmp.cmpfiles(legacy_path, grouped_path, names,
+                                           shallow=False)
+    assert not (mismatch or errors), \
+        "Files differ: %s" % ', '.join(mismatch + errors)
+finally:
+    shutil.rmtree(tmp_path)
+
+print("%d states, %d days, identical output files" % (len(names),
+                                                      args.n_days))
+print("Original loop:  %.3f s" % legacy_time)
+print("Grouped export: %.3f s" % grouped_time)
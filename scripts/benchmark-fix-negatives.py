@@ -0,0 +1,115 @@
+"""Compare the single-pass monotone repair used by `data.fix_neg` with the
+original loop, which added 1 to every decreasing entry and re-interpolated
+until the cumulative counts were non-decreasing."""
+
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+import pandas as pd
+
+from niddk_covid_sicr import data
+
+# Parse all the command-line arguments
+parser = argparse.ArgumentParser(
+    description='Benchmark the repair of decreasing cumulative counts')
+parser.add_argument('-dp', '--data-path', default='./data/current_paper_data',
+                    help='Path to directory containing the data files')
+parser.add_argument('-r', '--repeats', type=int, default=3,
+                    help='Number of times to time each implementation')
+parser.add_argument('-m', '--method', default='raise',
+                    help="Monotone repair method ('raise' or 'isotonic')")
+args = parser.parse_args()
+
+COLUMNS = ['cases', 'deaths', 'recover']
+
+
+def legacy_repair(df: pd.DataFrame, c: str) -> pd.Series:
+    """The original `fix_neg` loop for one column, returning the repaired
+    cumulative counts."""
+    cum = 'cum_%s' % c
+    new = 'new_%s' % c
+    df = df.copy()
+    before = df[cum].copy()
+    non_zeros = df[df[new] > 0].index
+    has_negs = before.diff().min() < 0
+    if not (len(non_zeros) and has_negs):
+        return before.astype(float)
+    first_non_zero = non_zeros[0]
+    maxx = df.loc[first_non_zero, cum].max()
+    bad = df.loc[first_non_zero:, cum] == 0
+    df.loc[bad[bad].index, cum] = None
+    bad = df.loc[first_non_zero:, new] < 0
+    df.loc[bad[bad].index, cum] = None
+    if np.isnan(df.loc[df.index[-1], cum]):
+        df.loc[df.index[-1], cum] = maxx
+    while True:
+        after = df[cum].interpolate('pchip')
+        diff = after.diff()
+        if diff.min() < 0:
+            neg_index = diff[diff < 0].index
+            df.loc[neg_index, cum] += 1
+        else:
+            break
+    return after
+
+
+def best_time(f) -> float:
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+csvs = sorted(Path(args.data_path).glob('covidtimeseries_*.csv'))
+# As in `fix_negatives`, the final (often partial) day is left out
+regions = {csv.stem.split('_', 1)[1]: pd.read_csv(csv).iloc[:-1]
+           for csv in csvs}
+cums = ['cum_%s' % c for c in COLUMNS]
+news = ['new_%s' % c for c in COLUMNS]
+
+
+def run_legacy():
+    return {roi: pd.concat([legacy_repair(df, c) for c in COLUMNS], axis=1)
+            for roi, df in regions.items()}
+
+
+def run_per_region():
+    return {roi: data.repair_monotone(df[cums],
+                                      df[news].set_axis(cums, axis=1),
+                                      method=args.method)
+            for roi, df in regions.items()}
+
+
+def run_all_at_once():
+    # One column per region and kind, padded with NaN to a common length
+    cum = pd.concat({roi: df[cums] for roi, df in regions.items()}, axis=1)
+    new = pd.concat({roi: df[news].set_axis(cums, axis=1)
+                     for roi, df in regions.items()}, axis=1)
+    return data.repair_monotone(cum, new, method=args.method)
+
+
+legacy = run_legacy()
+per_region = run_per_region()
+all_at_once = run_all_at_once()
+
+n_repaired = 0
+max_diff = 0
+for roi, df in regions.items():
+    old = legacy[roi].to_numpy()
+    changed = ~np.isclose(old, df[cums].to_numpy(), equal_nan=True)
+    n_repaired += changed.any(axis=0).sum()
+    for result in [per_region[roi].to_numpy(),
+                   all_at_once[roi].iloc[:len(df)].to_numpy()]:
+        # (Gaps in the raw data are left as they are)
+        assert not (np.diff(result, axis=0) < 0).any()
+        max_diff = max(max_diff, np.nanmax(np.abs(result - old)))
+
+print("%d regions, %d repaired series" % (len(regions), n_repaired))
+print("Largest difference from the original loop: %.3g" % max_diff)
+print("Original loop:            %.3f s" % best_time(run_legacy))
+print("Single pass, per region:  %.3f s" % best_time(run_per_region))
+print("Single pass, all at once: %.3f s" % best_time(run_all_at_once))
@@ -0,0 +1,155 @@
+"""Compare the weekly stan data prepared with the `prep.weekly_totals` kernel
+(one region at a time, and all regions in one call) with the original
+pandas implementation of `get_stan_data_weekly_total`, which resampled each
+region's data separately."""
+
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+import pandas as pd
+
+import niddk_covid_sicr as ncs
+from niddk_covid_sicr.dates import DAY_ZERO
+
+# Parse all the command-line arguments
+parser = argparse.ArgumentParser(
+    description='Benchmark the weekly totals used for the stan data')
+parser.add_argument('-dp', '--data-path', default='./data/current_paper_data',
+                    help='Path to directory containing the data files')
+parser.add_argument('-r', '--repeats', type=int, default=3,
+                    help='Number of times to time each implementation')
+parser.add_argument('-ld', '--last-date',
+                    help='Last date to use in the data (MM/DD/YY)')
+parser.add_argument('-fld', '--first-last-date',
+                    help='First and last dates to use (MM/DD/YY MM/DD/YY)')
+parser.add_argument('-ft', '--fixed-t', type=int, default=0,
+                    help='Use a fixed time base')
+args = parser.parse_args()
+args.data_path = Path(args.data_path)
+
+
+def legacy_weekly_total(full_data_path, args):
+    """The original `get_stan_data_weekly_total`."""
+    df = ncs.read_weekly_data(full_data_path, args)
+    n_proj = 0
+    stan_data = {}
+    for kind in ['cases', 'deaths', 'recover']:
+        try:
+            start_data = np.where(df["cum_%s" % kind].values > 0)[0][0]
+            df['new_%s' % kind] = np.where(((df['cum_%s' % kind] == 0) & ((df.index > start_data))), -1, df['new_%s' % kind])
+        except:
+            df['new_%s' % kind] = -1
+    df['Datetime'] = ncs.to_dates(df['day'])
+    df.set_index('Datetime', inplace=True)
+    df = df.replace(-1, np.nan)
+    df['weeklytotal_new_cases'] = df.new_cases.resample('W-SAT').sum()
+    df['weeklytotal_new_recover'] = df.new_recover.resample('W-SAT').sum()
+    df['weeklytotal_new_deaths'] = df.new_deaths.resample('W-SAT').sum()
+    weekly_index = pd.date_range(start=df.index[0], end=df.index[-1], freq='W-SAT')
+    df = df.reindex(weekly_index)
+    weekly_days = (weekly_index - DAY_ZERO).days.to_numpy()
+    df.weeklytotal_new_cases = df.weeklytotal_new_cases.astype(int)
+    df.weeklytotal_new_recover = df.weeklytotal_new_recover.astype(int)
+    df.weeklytotal_new_deaths = df.weeklytotal_new_deaths.astype(int)
+    df = df.replace({'weeklytotal_new_recover': 0}, -1)
+    df['weeklytotal_new_cases'] = df['weeklytotal_new_cases'].clip(lower=-1)
+    df['weeklytotal_new_recover'] = df['weeklytotal_new_recover'].clip(lower=-1)
+    df['weeklytotal_new_deaths'] = df['weeklytotal_new_deaths'].clip(lower=-1)
+    df.reset_index(inplace=True)
+    t0 = np.where(df["weeklytotal_new_cases"].values > 0)[0][0]
+    try:
+        dfm = pd.read_csv(args.data_path / 'mitigationprior.csv')
+        tmdate = dfm.loc[dfm.region == args.roi, 'date'].values[0]
+        tm = np.where(weekly_days == ncs.to_days([tmdate])[0])[0][0]
+    except Exception:
+        tm = t0 + 10
+    try:
+        population = df['population'].iloc[0]
+        stan_data['N'] = int(population)
+    except:
+        pass
+    stan_data['n_ostates'] = 3
+    stan_data['tm'] = tm
+    stan_data['ts'] = np.arange(t0, len(df['dates2']) + n_proj)
+    stan_data['y'] = df[['weeklytotal_new_cases', 'weeklytotal_new_recover',
+                    'weeklytotal_new_deaths']].to_numpy().astype(int)[t0:, :]
+    stan_data['n_obs'] = len(df['dates2']) - t0
+    stan_data['n_weeks'] = len(df['dates2']) - t0
+    stan_data['n_total'] = len(df['dates2']) - t0 + n_proj
+    if args.fixed_t:
+        offset = weekly_days[t0] // 7
+        stan_data['tm'] += offset
+        stan_data['ts'] += offset
+    return stan_data, df['dates2'][t0], stan_data['n_weeks']
+
+
+def call_each(f):
+    results = {}
+    for roi, csv in paths.items():
+        args.roi = roi
+        try:
+            results[roi] = f(csv, args)
+        except IndexError:  # No week with new cases
+            results[roi] = None
+    return results
+
+
+def same(a, b) -> bool:
+    if a is None or b is None:
+        return a is b
+    (data_a, t0_a, n_a), (data_b, t0_b, n_b) = a, b
+    return t0_a == t0_b and n_a == n_b and data_a.keys() == data_b.keys() \
+        and all(np.array_equal(data_a[key], data_b[key]) for key in data_a)
+
+
+def best_time(f) -> float:
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+prefix = ncs.get_data_prefix()
+paths = {roi: args.data_path / ('%s_%s.csv' % (prefix, roi))
+         for roi in sorted(ncs.list_data_rois(args.data_path))}
+# Regions with no week of new cases raise IndexError in every implementation
+usable = {roi for roi, result in call_each(legacy_weekly_total).items()
+          if result is not None}
+paths = {roi: path for roi, path in paths.items() if roi in usable}
+dfs = {roi: ncs.read_weekly_data(path, args) for roi, path in paths.items()}
+
+legacy = call_each(legacy_weekly_total)
+per_region = call_each(ncs.get_stan_data_weekly_total)
+all_at_once = ncs.get_stan_data_weekly_totals(paths, args)
+mismatches = [roi for roi in paths
+              if not (same(legacy[roi], per_region[roi])
+                      and same(legacy[roi], all_at_once[roi]))]
+assert not mismatches, "Different results for %s" % ', '.join(mismatches)
+print("%d regions, identical stan data" % len(paths))
+
+
+def kernel_only():
+    days, new, cum, first, last, offsets = ncs.stack_regions(list(dfs.values()))
+    ncs.weekly_totals(days, new, cum, first, last, index_offset=offsets)
+
+
+def legacy_kernel_only():
+    # The resampling part of the original, on data that is already read
+    for df in dfs.values():
+        df = df.set_index(ncs.to_dates(df['day'])).replace(-1, np.nan)
+        for column in ['new_cases', 'new_recover', 'new_deaths']:
+            df[column].resample('W-SAT').sum()
+
+
+print("Original, per region:          %.3f s" % best_time(
+    lambda: call_each(legacy_weekly_total)))
+print("Kernel, per region:            %.3f s" % best_time(
+    lambda: call_each(ncs.get_stan_data_weekly_total)))
+print("Kernel, all regions at once:   %.3f s" % best_time(
+    lambda: ncs.get_stan_data_weekly_totals(paths, args)))
+print("Resampling only (original):    %.3f s" % best_time(legacy_kernel_only))
+print("Weekly totals only (kernel):   %.3f s" % best_time(kernel_only))
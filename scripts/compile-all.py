@@ -1,8 +1,13 @@
-"""Fit many models for many regions.  If you have HPC access it is recommended
-to instead use `run.py` in parallel."""
+"""Compile all of the Stan models (or some of them), several at a time."""
 
 import argparse
+from functools import partial
+from multiprocessing import Pool
+import os
 from pathlib import Path
+import resource
+import sys
+import time
 from tqdm.auto import tqdm
 
 import niddk_covid_sicr as ncs
@@ -14,33 +19,78 @@ parser.add_argument('-mn', '--model-names', default=[], nargs='+',
                     help='Name of the Stan model file (without extension)')
 parser.add_argument('-mp', '--models-path', default='./models',
                     help='Path to directory containing the .stan model files')
-parser.add_argument('-fc', '--force-compile', default=1,
+parser.add_argument('-fc', '--force-compile', type=int, default=0,
                     help='Force compile all models (no reliance on previous compilation)')
-args = parser.parse_args()
-
-if not args.model_names:
-    args.model_names = ncs.list_models(args.models_path)
-    assert len(args.model_names),\
-        ("No such model files matching: *.stan' at %s" % (args.models_path))
-
-model_paths = [Path(args.models_path) / ('%s.stan' % model_name)
-               for model_name in args.model_names]
-for model_path in model_paths:
-    assert model_path.is_file(), "No such .stan file: %s" % model_path
-
-run_script_path = Path(__file__).parent / 'run.py'
-run_flags = [('--%s' % key.replace('_', '-'), value)
-             for key, value in args.__dict__.items()
-             if key not in ['model_names', 'rois']]
-
-# This next section will be run in serial since this is only a reference
-# implementation. Parallel implementations are possible with multiprocessing
-# or the library of your choice. Best performance comes from parallelizing
-# run.py on a cluster.
-iterator = tqdm(args.model_names, desc='Model')
-for model_name in iterator:
-    iterator.set_description("Compiling %s" % model_name)
-    ncs.load_or_compile_stan_model(model_name, models_path=args.models_path,
-                                   force_recompile=True)
-
-print("Finished compiling all models")
+parser.add_argument('-nw', '--n-workers', type=int, default=0,
+                    help=('Number of models to compile at once (default: as '
+                          'many as the cores and memory allow)'))
+parser.add_argument('-mpc', '--memory-per-compile', type=float, default=2,
+                    help='Memory (in GB) to allow for each compilation')
+
+# Units of ru_maxrss, in MB (bytes on macOS, kB elsewhere)
+MAXRSS_MB = 1 / 1024**2 if sys.platform == 'darwin' else 1 / 1024
+
+
+def compile_model(model_name: str, models_path: str, force: bool) -> tuple:
+    """Compile one model (in a worker process of its own) and measure the
+    time taken and the peak memory of the worker and the compiler."""
+    start = time.perf_counter()
+    ncs.load_or_compile_stan_model(model_name, models_path=models_path,
+                                   force_recompile=force)
+    peak = max(resource.getrusage(who).ru_maxrss
+               for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN])
+    return model_name, time.perf_counter() - start, peak * MAXRSS_MB
+
+
+def default_n_workers(memory_per_compile: float) -> int:
+    """As many workers as there are cores, and memory for."""
+    try:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return ncs.ncpus
+    return max(1, min(ncs.ncpus, int(available / (memory_per_compile * 1e9))))
+
+
+def main():
+    args = parser.parse_args()
+
+    if not args.model_names:
+        args.model_names = ncs.list_models(args.models_path)
+        assert len(args.model_names),\
+            ("No such model files matching: *.stan' at %s" % (args.models_path))
+
+    model_paths = [Path(args.models_path) / ('%s.stan' % model_name)
+                   for model_name in args.model_names]
+    for model_path in model_paths:
+        assert model_path.is_file(), "No such .stan file: %s" % model_path
+
+    # Models already compiled from the same source and settings are skipped
+    if not args.force_compile:
+        compiled = [model_name for model_name in args.model_names
+                    if ncs.get_compiled_model_path(args.models_path,
+                                                   model_name).is_file()]
+        for model_name in compiled:
+            print("%s is already compiled" % model_name)
+        args.model_names = [model_name for model_name in args.model_names
+                            if model_name not in compiled]
+
+    n_workers = args.n_workers or default_n_workers(args.memory_per_compile)
+    n_workers = min(n_workers, len(args.model_names)) or 1
+    print("Compiling %d models, %d at a time" % (len(args.model_names),
+                                                 n_workers))
+    # One model per worker process, so that its peak memory is its own
+    with Pool(n_workers, maxtasksperchild=1) as pool:
+        f = partial(compile_model, models_path=args.models_path,
+                    force=bool(args.force_compile))
+        results = list(tqdm(pool.imap_unordered(f, args.model_names),
+                            total=len(args.model_names), desc='Compiling'))
+
+    for model_name, seconds, peak in sorted(results):
+        print("%-30s %8.1f s %8.0f MB" % (model_name, seconds, peak))
+    print("Finished compiling all models")
+
+
+# The workers import this file when they are spawned (the default on macOS
+# and Windows)
+if __name__ == '__main__':
+    main()
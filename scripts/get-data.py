@@ -3,7 +3,7 @@
 
 
 import argparse
-from niddk_covid_sicr import data
+from niddk_covid_sicr import data, fetch, metrics
 from pathlib import Path
 
 # Parse all the command-line arguments
@@ -12,6 +12,9 @@ parser.add_argument('-dp', '--data-path', default='./data',
                     help='Path for storing data')
 parser.add_argument('-s', '--sources', default=['jhu', 'canada', 'brazil', 'owid_tests', 'jhu_us_states_tests', 'owid_global_vaccines', 'owid_us_vaccines'],
                     nargs='+', help='Data sources to use.')
+parser.add_argument('-mw', '--max-workers', default=0, type=int,
+                    help=('Maximum number of sources to get data from at the '
+                          'same time (default is all of them)'))
 parser.add_argument('-fi', '--filter', default=0, type=int,
                     help='Whether or not to filter based on data thresholds')
 parser.add_argument('-fn', '--fix-negatives', default=0, type=int,
@@ -25,40 +28,86 @@ parser.add_argument('-nm', '--negify-missing', default=1, type=int,
                           "recovered"))
 parser.add_argument('-ror', '--remove-old-rois', default=1, type=int,
                     help=("Remove rois that no longer report adequate data from data_path if present "))
+parser.add_argument('-st', '--store', default=1, type=int,
+                    help=("Whether or not to collect the data into the "
+                          "columnar time-series store"))
+parser.add_argument('-ec', '--export-csv', default=1, type=int,
+                    help=("Whether or not to keep a .csv file for each region "
+                          "(when the store is built)"))
+parser.add_argument('-xs', '--export-store', default=0, type=int,
+                    help=("Only write a .csv file for each region in the "
+                          "time-series store (e.g. one built with "
+                          "--export-csv=0), without getting any data"))
+parser.add_argument('-hm', '--http-mode', default='online',
+                    choices=fetch.FETCH_MODES,
+                    help=("'online' to download what changed upstream, or "
+                          "'replay' to use only previously downloaded files "
+                          "(no network access)"))
+parser.add_argument('-hc', '--http-cache',
+                    help=("Directory of downloaded files to use in place of "
+                          "DATA_PATH/.cache/http, e.g. for --http-mode=replay"))
+parser.add_argument('-ma', '--max-age', default=0, type=float,
+                    help=("Seconds for which downloaded files are used "
+                          "without checking for a newer version"))
+parser.add_argument('-swr', '--stale-while-revalidate', default=0, type=int,
+                    help=("Whether or not to use previously downloaded files "
+                          "at once and check for newer versions (for the next "
+                          "run) in the background"))
+parser.add_argument('-mx', '--metrics-path',
+                    help=("JSON lines file to append timing and size records "
+                          "of each stage to (default is "
+                          "DATA_PATH/.cache/metrics.jsonl)"))
 
-args = parser.parse_args()
 
-# Create the data path
-data_path = Path(args.data_path)
-data_path.mkdir(parents=True, exist_ok=True)
-assert data_path.exists(), "%s is not a valid data path" % data_path.resolve()
+def main():
+    args = parser.parse_args()
 
+    # Create the data path
+    data_path = Path(args.data_path)
+    data_path.mkdir(parents=True, exist_ok=True)
+    assert data_path.exists(), "%s is not a valid data path" % data_path.resolve()
 
-def get_scraper(name):
-    func_name = 'get_%s' % name.replace('-', '_')
-    try:
-        f = getattr(data, func_name)
-    except AttributeError:
-        raise Exception("No function named %s in the data.py module"
-                        % func_name)
-    return f
+    if args.export_store:
+        data.export_timeseries_csvs(data_path)
+        print("Data now available at %s" % data_path.resolve())
+        return
 
+    metrics.configure(args.metrics_path or data_path / '.cache' / 'metrics.jsonl')
+    fetch.configure(mode=args.http_mode, cache_path=args.http_cache,
+                    max_age=args.max_age,
+                    stale_while_revalidate=bool(args.stale_while_revalidate))
 
-for source in args.sources:
-    print("Getting data from %s..." % source)
-    f = get_scraper(source)
-    f(data_path, filter_=args.filter)
+    # Get data from all sources; sources that do not depend on each other (see
+    # data.SOURCES) are run at the same time
+    sources = [source.replace('-', '_') for source in args.sources]
+    data.run_sources(data_path, sources, filter_=args.filter,
+                     max_workers=args.max_workers or None)
 
-if args.fix_negatives:
-    print("Fixing negative values in daily data...")
-    data.fix_negatives(data_path)
+    # Clean each region's data in one pass over the files
+    stages = []
+    if args.remove_old_rois:
+        stages.append('remove_old_rois')
+    if args.fix_negatives:
+        stages.append('fix_negatives')
+    if args.negify_missing:
+        stages.append('negify_missing')
+    if stages:
+        print("Cleaning data (%s)..." % ', '.join(stages))
+        with metrics.stage('clean'):
+            data.clean_timeseries(data_path, stages)
 
-if args.negify_missing:
-    print("Replacing missing columns with -1 in daily data...")
-    data.negify_missing(data_path)
+    if args.store:
+        print("Collecting data into the time-series store...")
+        with metrics.stage('build store'):
+            data.build_timeseries_store(data_path, export_csv=args.export_csv)
 
-if args.remove_old_rois:
-    print("Removing old regions that no longer report data:")
-    data.remove_old_rois(data_path)
+    print("Data now available at %s" % data_path.resolve())
+    print("Time and size of each stage (also in %s):"
+          % metrics.METRICS_OPTIONS['path'])
+    metrics.print_summary()
 
-print("Data now available at %s" % data_path.resolve())
+
+# Regions are cleaned in worker processes, which import this file when they
+# are spawned (the default on macOS and Windows)
+if __name__ == '__main__':
+    main()
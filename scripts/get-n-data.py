@@ -26,18 +26,20 @@ data_path = Path(args.data_path).resolve()
 assert data_path.exists(), "No such data path: %s" % data_path
 
 # Get all model_names, roi combinations
-rois = ncs.list_rois(args.data_path, 'covidtimeseries', '.csv')
+rois = ncs.list_data_rois(args.data_path)
 args.roi = rois
 
-df = pd.DataFrame(index=rois, columns=['n_data_pts'], dtype=int)
+csvs = {}
 for roi in rois:
     csv = Path(args.data_path) / ("covidtimeseries_%s.csv" % roi)
     csv = csv.resolve()
-    assert csv.exists(), "No such csv file: %s" % csv
-    if not args.totwk:
-        stan_data, t0, num_weeks = ncs.get_stan_data(csv, args)
-    if args.totwk:
-        stan_data, t0, num_weeks = ncs.get_stan_data_weekly_total(csv, args)
+    assert ncs.timeseries_exists(csv), "No such csv file: %s" % csv
+    csvs[roi] = csv
+all_stan_data = ncs.load_stan_data_many(csvs, args)
+
+df = pd.DataFrame(index=rois, columns=['n_data_pts'], dtype=int)
+for roi in rois:
+    stan_data, t0, num_weeks = all_stan_data[roi]
     n_data = ncs.get_n_data(stan_data)
     df.loc[roi, 'n_data_pts'] = int(n_data)
     df.loc[roi, 't0'] = t0
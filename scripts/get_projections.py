@@ -34,7 +34,8 @@ rois = ncs.list_rois(fitloc, 'SICRMQC2R2DX2', '.pkl')
 
 for current_roi in rois:
 
-    df = ncs.extract_samples(fitloc, './models/', 'SICRMQC2R2DX2', current_roi, 1)
+    df = ncs.extract_samples(fitloc, './models/', 'SICRMQC2R2DX2', current_roi, 1,
+                             params=['y_proj'])
     proj_cols = [col for col in df.columns if '_proj' in col]
     compressed_pickle(current_roi,df[proj_cols])
     print(current_roi,len(proj_cols))
@@ -2,14 +2,12 @@
 # coding: utf-8
 
 import argparse
-from datetime import datetime
 from itertools import repeat
 import pandas as pd
 from pathlib import Path
 from p_tqdm import p_map
 from pathos.helpers import cpu_count
 import warnings
-import math
 warnings.simplefilter("ignore")
 
 import niddk_covid_sicr as ncs
@@ -31,7 +29,8 @@ parser.add_argument('-fp', '--fits-path', default='./fits',
 parser.add_argument('-tp', '--tables-path', default='./tables/',
                     help='Path to directory to save tables')
 parser.add_argument('-f', '--fit-format', type=int, default=1,
-                    help='Version of fit format')
+                    help=('Version of fit format: .csv (0), .pkl (1) or a '
+                          '.draws store of per-parameter arrays (2)'))
 parser.add_argument('-p', '--params', default=['R0', 'car', 'ifr', 'ir', 'dI', 'beta', 'alpha'], nargs='+',
                     help='Which params to include in the table')
 parser.add_argument('-d', '--dates', default=None, nargs='+',
@@ -42,6 +41,18 @@ parser.add_argument('-ql', '--quantiles',
 parser.add_argument('-r', '--rois', default=[], nargs='+',
                     help=('Which rois to include in the table '
                           '(default is all of them)'))
+parser.add_argument('-co', '--changed-only', type=int, default=0,
+                    help=('Only include regions that were added or changed by '
+                          'the last get-data run (see data_path/manifest.json); '
+                          'usually used with --append'))
+parser.add_argument('-w', '--where',
+                    help=('Only include fits matching this SQL condition on '
+                          'the fit catalog of the fits path, e.g. '
+                          '"lp__rhat < 1.1"'))
+parser.add_argument('-uc', '--update-catalog', type=int, default=0,
+                    help=('Add the fits that are not in the fit catalog '
+                          '(e.g. copied from elsewhere) to it first, as is '
+                          'done when there is no catalog yet'))
 parser.add_argument('-mj', '--max-jobs', type=int, default=0,
                     help=('How many jobs (regions) to extract data for '
                           'simultaneously'))
@@ -63,13 +74,26 @@ parser.add_argument('-ma', '--model-averaging', type=int, default=0,
                    help=('Model averaging for fits. Default is no model averaging, 0.'))
 args = parser.parse_args()
 
+# Only regions with new data
+if args.changed_only:
+    changed = ncs.list_changed_rois(args.data_path)
+    if changed is not None:
+        args.rois = [roi for roi in (args.rois or changed) if roi in changed]
+        assert len(args.rois), "No regions were added or changed"
+
 # Max jobs
 if not args.max_jobs:
     args.max_jobs = cpu_count()
 
-# If no model_names are provided, use all of them
+# Regions are listed from the fit catalog, so fits not in it (e.g. copied
+# from elsewhere, or made before there was a catalog) are added first
+if args.update_catalog or \
+        not ncs.get_catalog_path(args.fits_path).is_file():
+    ncs.update_fit_catalog(args.fits_path, ncs.list_models(args.models_path))
+
+# If no model_names are provided, use all of them (with fits)
 if not args.model_names:
-    args.model_names = ncs.list_models(args.models_path)
+    args.model_names = ncs.list_models(args.models_path, args.fits_path)
     assert len(args.model_names),\
         ("No such model files matching: *.stan' at %s" % (args.models_path))
 
@@ -78,10 +102,14 @@ if not args.average_only:
     combos = []
     for model_name in args.model_names:
         model_path = ncs.get_model_path(args.models_path, model_name)
-        extension = ['csv', 'pkl'][args.fit_format]
+        extension = ncs.get_ending(args.fit_format)
         rois = ncs.list_rois(args.fits_path, model_name, extension)
         if args.rois:
             rois = list(set(rois).intersection(args.rois))
+        if args.where:
+            matching = ncs.query_fits(args.fits_path, where=args.where,
+                                      model=model_name, ending=extension)
+            rois = list(set(rois).intersection(matching['roi']))
         combos += [(model_name, roi) for roi in rois]
     # Organize into (model_name, roi) tuples
     combos = list(zip(*combos))
@@ -93,35 +121,36 @@ def roi_df(args, model_name, roi):
         args.roi = roi  # Temporary
         csv = Path(args.data_path) / ("covidtimeseries_%s.csv" % args.roi)
         csv = csv.resolve()
-        assert csv.exists(), "No such csv file: %s" % csv
-        if not args.totwk:
-            stan_data, t0, num_weeks = ncs.get_stan_data(csv, args)
-        if args.totwk:
-            stan_data, t0, num_weeks = ncs.get_stan_data_weekly_total(csv, args)
+        assert ncs.timeseries_exists(csv), "No such csv file: %s" % csv
+        stan_data, t0, num_weeks = ncs.load_stan_data(csv, args)
 
-        global_start = datetime.strptime('01/22/20', '%m/%d/%y')
-        frame_start = datetime.strptime(t0, '%m/%d/%y')
+        frame_start = ncs.to_days([t0])[0]  # Days since 01/22/20
 
         if not args.totwk:
-            day_offset = (frame_start - global_start).days
+            day_offset = frame_start
         if args.totwk:
-            day_offset = math.floor((frame_start - global_start).days/7) # for weeks
+            day_offset = frame_start // 7 # for weeks
     else:
         day_offset = 0
     model_path = ncs.get_model_path(args.models_path, model_name)
-    extension = ['csv', 'pkl'][args.fit_format]
-    rois = ncs.list_rois(args.fits_path, model_name, extension)
-    if args.rois:
-        rois = list(set(rois).intersection(args.rois))
-    fit_path = ncs.get_fit_path(args.fits_path, model_name, roi)
+    fit_path = ncs.get_fit_path(args.fits_path, model_name, roi,
+                                args.fit_format)
+    # Only extract the parameters in the table
+    params = [param.replace('-by-week', '') for param in args.params]
     if args.fit_format == 1:
         fit = ncs.load_fit(fit_path, model_path)
         stats = ncs.get_waic_and_loo(fit)
-        samples = fit.to_dataframe()
+        samples = ncs.fit_to_dataframe(fit, params)
     elif args.fit_format == 0:
         samples = ncs.extract_samples(args.fits_path, args.models_path,
-                                      model_name, roi, args.fit_format)
+                                      model_name, roi, args.fit_format,
+                                      params=params + ['llx'])
         stats = ncs.get_waic(samples)
+    elif args.fit_format == 2:
+        stats = ncs.get_fit_quality(ncs.load_draws(fit_path, ['llx', 'lp__']))
+        samples = ncs.extract_samples(args.fits_path, args.models_path,
+                                      model_name, roi, args.fit_format,
+                                      params=params)
     df = ncs.make_table(roi, samples, args.params, args.totwk,
                         stats, quantiles=args.quantiles,
                         day_offset=day_offset)
@@ -200,19 +229,15 @@ def roi_df_averaging(args, model_name, roi):
         args.roi = roi  # Temporary
         csv = Path(args.data_path) / ("covidtimeseries_%s.csv" % args.roi)
         csv = csv.resolve()
-        assert csv.exists(), "No such csv file: %s" % csv
-        if not args.totwk:
-            stan_data, t0, num_weeks = ncs.get_stan_data(csv, args)
-        if args.totwk:
-            stan_data, t0, num_weeks = ncs.get_stan_data_weekly_total(csv, args)
+        assert ncs.timeseries_exists(csv), "No such csv file: %s" % csv
+        stan_data, t0, num_weeks = ncs.load_stan_data(csv, args)
 
-        global_start = datetime.strptime('01/22/20', '%m/%d/%y')
-        frame_start = datetime.strptime(t0, '%m/%d/%y')
+        frame_start = ncs.to_days([t0])[0]  # Days since 01/22/20
 
         if not args.totwk:
-            day_offset = (frame_start - global_start).days
+            day_offset = frame_start
         if args.totwk:
-            day_offset = math.floor((frame_start - global_start).days/7) # for weeks
+            day_offset = frame_start // 7 # for weeks
     else:
         day_offset = 0
 
@@ -236,8 +261,9 @@ if args.model_averaging: # Perform model averaging using raw fit file
         dfs = []
         for model_name in models:
             model_path = ncs.get_model_path(args.models_path, model_name)
-            extension = ['csv', 'pkl'][args.fit_format]
-            fit_path = ncs.get_fit_path(args.fits_path, model_name, roi)
+            extension = ncs.get_ending(args.fit_format)
+            fit_path = ncs.get_fit_path(args.fits_path, model_name, roi,
+                                        args.fit_format)
             df_roi = df_weights.loc[roi]
             model_name_weight = model_name + '_weight'
             weight = df_roi[model_name_weight]
@@ -256,9 +282,15 @@ if args.model_averaging: # Perform model averaging using raw fit file
                 samples = fit.to_dataframe()
                 samples_weighted_df = samples.sample(frac=weight, replace=True)
                 dfs.append(samples_weighted_df)
+
+            elif args.fit_format == 2:
+                samples = ncs.draws_to_dataframe(fit_path)
+                samples_weighted_df = samples.sample(frac=weight, replace=True)
+                dfs.append(samples_weighted_df)
         df_model_averaged = pd.concat(dfs)
         df_model_averaged.reset_index(inplace=True, drop=True)
         df_model_averaged.to_csv(Path(args.fits_path) / f'DiscreteAverage_{roi}.csv')
+        ncs.record_fit(args.fits_path, 'DiscreteAverage', roi, 0)
 
     # now that we have model averaged fits, create tables
     # mimic other tables code and merge reweighted table with model averaged table
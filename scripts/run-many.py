@@ -25,6 +25,9 @@ parser.add_argument('-fp', '--fits-path', default='./fits',
                     help='Path to directory to save fit files')
 parser.add_argument('-r', '--rois', default=[], nargs='+',
                     help='ROI to use')
+parser.add_argument('-co', '--changed-only', type=int, default=0,
+                    help=('Only fit regions that were added or changed by the '
+                          'last get-data run (see data_path/manifest.json)'))
 parser.add_argument('-ch', '--n-chains', type=int, default=4,
                     help='Number of chains to run')
 parser.add_argument('-wm', '--n-warmups', type=int, default=500,
@@ -48,10 +51,14 @@ if args.n_threads == 0:
     
 prefix = ncs.get_data_prefix()
 if not args.rois:
-    args.rois = ncs.list_rois(args.data_path, prefix, '.csv')
+    args.rois = ncs.list_data_rois(args.data_path)
     assert len(args.rois),\
         ("No such data files matching: %s*.csv' at %s"
          % (prefix, args.data_path))
+if args.changed_only:
+    changed = ncs.list_changed_rois(args.data_path)
+    if changed is not None:
+        args.rois = [roi for roi in args.rois if roi in changed]
 
 if not args.model_names:
     args.model_names = ncs.list_models(args.models_path)
@@ -65,7 +72,7 @@ for model_path in model_paths:
 
 run_script_path = Path(__file__).parent / 'run.py'
 run_flags = [('--%s' % key.replace('_', '-'), value) for key, value in args.__dict__.items()
-             if key not in ['model_names', 'rois']]
+             if key not in ['model_names', 'rois', 'changed_only']]
     
 # This next section will be run in serial since this is only a reference implementation
 # Parallel implementations are possible with multiprocessing or the library of your choice
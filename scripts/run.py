@@ -39,8 +39,13 @@ parser.add_argument('-ad', '--adapt-delta', type=float, default=0.85,
                     help='Adapt delta control parameter')
 parser.add_argument('-fc', '--force-recompile', type=int, default=0,
                     help='Force recompilation of model (no cache)')
+parser.add_argument('-su', '--skip-unchanged', type=int, default=0,
+                    help=('Skip the fit if one already exists and the region '
+                          'was not added or changed by the last get-data run '
+                          '(see data_path/manifest.json)'))
 parser.add_argument('-f', '--fit-format', type=int, default=1,
-                    help='Version of fit format')
+                    help=('Version of fit format: .csv (0), .pkl (1) or a '
+                          '.draws store of per-parameter arrays (2)'))
 parser.add_argument('-i', '--init',
                     help=('Fit file to use for initial conditions '
                           '(uses last sample)'))
@@ -81,17 +86,24 @@ if args.n_threads == 0:
 if args.n_iter < args.n_warmups:
     args.n_warmups = int(args.n_iter/2)
 
+if args.skip_unchanged:
+    changed = ncs.list_changed_rois(args.data_path)
+    fit_file = Path(args.fits_path) / ("%s_%s%s" % (
+        args.model_name, args.roi, ncs.get_ending(args.fit_format)))
+    if changed is not None and args.roi not in changed and fit_file.exists():
+        print("No new data for %s; skipping fit." % args.roi)
+        sys.exit(0)
+
 csv = Path(args.data_path) / ("covidtimeseries_%s.csv" % args.roi)
 csv = csv.resolve()
-assert csv.exists(), "No such csv file: %s" % csv
+assert ncs.timeseries_exists(csv), "No such csv file: %s" % csv
 
-if not args.totwk:
-    stan_data, t0, num_weeks  = ncs.get_stan_data(csv, args)
-if args.totwk:
-    stan_data, t0, num_weeks = ncs.get_stan_data_weekly_total(csv, args)
+stan_data, t0, num_weeks = ncs.load_stan_data(csv, args)
 if stan_data is None:
     print("No data for %s; skipping fit." % args.roi)
     sys.exit(0)
+# Of the data as it is fit (which may be updated while sampling)
+data_hash = ncs.timeseries_hash(csv)
 if args.n_data_only:
     print(ncs.get_n_data(stan_data))
     sys.exit(0)
@@ -124,6 +136,10 @@ if not args.advi:
     if args.fit_format == 0:
         save_path = save_dir / ("%s_%s.csv" % (args.model_name, args.roi))
         result = fit.to_dataframe().to_csv(save_path)
+    elif args.fit_format == 2:
+        save_path = save_dir / ("%s_%s.draws" % (args.model_name, args.roi))
+        ncs.save_draws(fit.to_dataframe(), save_path,
+                       model_name=args.model_name, roi=args.roi)
     else:
         save_path = save_dir / ("%s_%s.pkl" % (args.model_name, args.roi))
         with open(save_path, "wb") as f:
@@ -131,6 +147,17 @@ if not args.advi:
                          'model_code': stanrunmodel.model_code, 'fit': fit},
                         f, protocol=pickle.HIGHEST_PROTOCOL)
 
+    # Add the fit to the catalog of the fits directory
+    sampler_params = fit.get_sampler_params(inc_warmup=False)
+    ncs.record_fit(args.fits_path, args.model_name, args.roi, args.fit_format,
+                   args=args, models_path=args.models_path,
+                   data_hash=data_hash,
+                   n_chains=len(sampler_params),
+                   n_draws=len(sampler_params[0]['divergent__']),
+                   n_divergent=sum(chain['divergent__'].sum()
+                                   for chain in sampler_params),
+                   **ncs.get_fit_quality(fit))
+
     print("Finished %s" % args.roi)
 
 else:
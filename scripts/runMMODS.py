@@ -56,6 +56,8 @@ if args.n_iter < args.n_warmups:
 csv = Path(args.data_path) / ("covidtimeseries_%s.csv" % args.roi)
 csv = csv.resolve()
 assert csv.exists(), "No such csv file: %s" % csv
+# Of the data as it is fit (which may be updated while sampling)
+data_hash = ncs.timeseries_hash(csv)
 
 model_path = Path(args.models_path) / ('%s.stan' % args.model_name)
 model_path = model_path.resolve()
@@ -147,4 +149,9 @@ else:
                      'model_code': stanrunmodel.model_code, 'fit': fit},
                     f, protocol=pickle.HIGHEST_PROTOCOL)
 
+# Add the fit to the catalog of the fits directory
+ncs.record_fit(args.fits_path, args.model_name, args.roi, args.fit_format,
+               args=args, models_path=args.models_path,
+               data_hash=data_hash)
+
 print("Finished %s" % args.roi)
@@ -61,7 +61,9 @@ if args.n_iter < args.n_warmups:
 
 csv = Path(args.data_path) / ("covidtimeseries_%s.csv" % args.roi)
 csv = csv.resolve()
-assert csv.exists(), "No such csv file: %s" % csv
+assert ncs.timeseries_exists(csv), "No such csv file: %s" % csv
+# Of the data as it is fit (which may be updated while sampling)
+data_hash = ncs.timeseries_hash(csv)
 
 stan_data, t0 = ncs.get_stan_data(csv, args)
 if stan_data is None:
@@ -104,4 +106,9 @@ else:
                      'model_code': stanrunmodel.model_code, 'fit': fit},
                     f, protocol=pickle.HIGHEST_PROTOCOL)
 
+# Add the fit to the catalog of the fits directory
+ncs.record_fit(args.fits_path, args.model_name, args.roi, args.fit_format,
+               args=args, models_path=args.models_path,
+               data_hash=data_hash)
+
 print("Finished %s" % args.roi)
@@ -14,7 +14,7 @@ for lib in ['blib2to3', 'papermill']:
     logger = logging.getLogger(lib)
     logger.setLevel(logging.WARNING)
 
-from niddk_covid_sicr import get_data_prefix, get_ending, list_rois
+from niddk_covid_sicr import get_ending, list_data_rois, list_rois
 
 notebook_path = Path(__file__).parent.parent / 'notebooks'
 
@@ -66,7 +66,7 @@ assert any([x.name.endswith('.pkl') or x.name.endswith('.csv')
 ending = get_ending(args.fit_format)
 
 if not args.rois:
-    data_rois = list_rois(data_path, get_data_prefix(), '.csv')
+    data_rois = list_data_rois(data_path)
     fit_rois = list_rois(fits_path, args.model_name, ending)
     args.rois = list(set(data_rois).intersection(fit_rois))
 
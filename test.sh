@@ -1,4 +1,5 @@
 pip install --user -e .
+python -m pytest -q tests
 python scripts/get-data.py
 # This is a totally insufficient number of samples to draw 
 # It is only this slow here to support continuous integration,
@@ -0,0 +1,61 @@
+"""Tests of the download helpers in niddk_covid_sicr.fetch."""
+
+from io import BytesIO
+import json
+import socket
+
+import pytest
+
+import niddk_covid_sicr.fetch
+from niddk_covid_sicr.fetch import fetch_all, iter_json_records
+
+RECORDS = [{'province': 'Québec', 'date': '2020-03-%02d' % day,
+            'cases': day * 10, 'notes': ['a', {'b': None}]}
+           for day in range(1, 21)]
+
+
+def document(records: list) -> bytes:
+    return json.dumps({'version': 1, 'cases': records}, indent=1,
+                      ensure_ascii=False).encode('utf-8')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1 << 16])
+def test_records_split_across_chunks(chunk_size):
+    """Records (and multi-byte characters) cut by a chunk boundary are
+    decoded whole."""
+    stream = BytesIO(document(RECORDS))
+    assert list(iter_json_records(stream, 'cases', chunk_size)) == RECORDS
+
+
+def test_empty_array():
+    stream = BytesIO(document([]))
+    assert list(iter_json_records(stream, 'cases', 5)) == []
+
+
+def test_missing_array():
+    stream = BytesIO(document(RECORDS))
+    with pytest.raises(ValueError):
+        list(iter_json_records(stream, 'deaths', 5))
+
+
+def test_truncated_array():
+    stream = BytesIO(document(RECORDS)[:-100])
+    with pytest.raises(ValueError):
+        list(iter_json_records(stream, 'cases', 5))
+
+
+def test_fetch_all_leaves_out_failed_urls(monkeypatch):
+    """Errors while reading a response (not only URLError) leave the URL
+    out rather than stopping the other downloads."""
+    def fetch(url, cache_path=None, timeout=None):
+        if url == 'slow':
+            raise socket.timeout('timed out')
+        if url == 'reset':
+            raise ConnectionResetError()
+        return url.encode(), True
+
+    monkeypatch.setattr(niddk_covid_sicr.fetch, 'fetch', fetch)
+    errors = {}
+    results = fetch_all(['ok', 'slow', 'reset'], errors=errors)
+    assert results == {'ok': (b'ok', True)}
+    assert set(errors) == {'slow', 'reset'}
@@ -0,0 +1,65 @@
+"""Tests of the data and fit helpers in niddk_covid_sicr.io."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from niddk_covid_sicr.io import (extract_samples, get_data,
+                                 get_timeseries_file, save_draws,
+                                 write_timeseries)
+
+N_CHAINS = 3
+N_DRAWS = 10
+
+
+@pytest.fixture
+def fits_path(tmp_path):
+    """The same samples saved as a .csv fit and as a .draws fit."""
+    rng = np.random.default_rng(0)
+    n = N_CHAINS * N_DRAWS
+    samples = pd.DataFrame({
+        'chain': np.repeat(np.arange(N_CHAINS), N_DRAWS),
+        # Draw numbers that do not start at 0 in each chain
+        'draw': np.arange(n) + 1,
+        'warmup': np.zeros(n, dtype=int),
+        'R0': rng.random(n),
+        'x[1]': rng.random(n),
+        'x[2]': rng.random(n),
+        'lp__': rng.random(n)})
+    samples.to_csv(tmp_path / 'Model_Roi.csv', index=False)
+    save_draws(samples, tmp_path / 'Model_Roi.draws')
+    return tmp_path
+
+
+@pytest.mark.parametrize('thin', [None, 1, 2, 3, 4, N_DRAWS + 1])
+@pytest.mark.parametrize('chains', [None, [1], [0, 2]])
+@pytest.mark.parametrize('params', [None, ['x']])
+def test_formats_give_the_same_draws(fits_path, thin, chains, params):
+    """Thinning and chain selection keep the same draws in all formats."""
+    csv, draws = [extract_samples(fits_path, fits_path, 'Model', 'Roi',
+                                  fit_format, params=params, chains=chains,
+                                  thin=thin).reset_index(drop=True)
+                  for fit_format in [0, 2]]
+    pd.testing.assert_frame_equal(csv, draws, check_dtype=False)
+    n_chains = N_CHAINS if chains is None else len(chains)
+    assert len(csv) == n_chains * len(range(0, N_DRAWS, thin or 1))
+
+
+def test_store_keeps_the_values_of_the_csv(tmp_path):
+    """Data read from the store is the data of the .csv file, including
+    columns with fractions or missing values."""
+    pd.DataFrame({
+        'dates2': ['03/%02d/20' % day for day in range(1, 6)],
+        'cum_cases': [1, 2, 4, 8, 16],
+        'new_cases': [1., 1., 2., 4., 8.],  # Whole numbers written as floats
+        'new_recover': [0., np.nan, 1., 2., 3.],
+        'positivity': [0.1, 0.25, 1 / 3, 0.5, 0.75],
+    }).to_csv(tmp_path / 'covidtimeseries_Roi.csv')
+    from_csv = get_data('Roi', tmp_path)
+    write_timeseries(pd.read_csv(tmp_path / 'covidtimeseries_Roi.csv'), 'Roi',
+                     tmp_path)
+    assert get_timeseries_file(tmp_path / 'covidtimeseries_Roi.csv').suffix \
+        == '.parquet'
+    pd.testing.assert_frame_equal(get_data('Roi', tmp_path), from_csv,
+                                  check_dtype=False)
+    assert get_data('Roi', tmp_path)['positivity'].dtype == 'float64'